@@ -0,0 +1,202 @@
+"""
+Priority-aware admission control for HTTP requests.
+
+Every request is put in a lane by path: agent heartbeats, agent asset uploads,
+interactive queries (dashboards, /api/*) and bulk jobs (exports, scans, admin
+tasks). At most `capacity` requests are being served at once. Each lane also
+has its own concurrency limit, and a *headroom*: the number of slots it must
+leave free for the lanes above it. Heartbeats have no headroom, and every other
+lane leaves at least as many free slots as the lane above it. So however many
+dashboard sorts or nmap scans are queued, there is always room for a heartbeat.
+
+Requests that can't be admitted wait in their lane's FIFO queue. When a slot
+frees up, the highest-priority lane that fits goes first. A request that waits
+longer than its lane's timeout, or finds the queue full, gets a 503 with
+Retry-After. The client backs off instead of piling onto a server that is
+already saturated.
+
+Admission runs on the event loop before a route is handed to the threadpool,
+so it needs no locks. Size `capacity` to the database pool: an admitted request
+then gets a connection straight away.
+"""
+import asyncio
+import collections
+import json
+import time
+from typing import Optional
+
+from metrics import LATENCY_BUCKETS, REGISTRY, Counter, Gauge, Histogram
+
+ADMISSION = REGISTRY.register(Counter(
+    "qs_admission_requests_total", "Requests by admission lane and outcome (admitted, timeout, queue_full).",
+    ("lane", "outcome")))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "qs_admission_wait_seconds", "Time admitted requests spent queued for a slot.", LATENCY_BUCKETS, ("lane",)))
+
+# (path, lane); a path ending in "/" is a prefix. Exact paths win over prefixes, the longest
+# prefix wins, and anything unmatched is a "query". A lane of None skips admission.
+LANE_ROUTES = (
+    ("/agent_heartbeat", "heartbeat"),
+    ("/agent_assets", "assets"),
+    ("/metrics", None),
+    ("/static/", None),
+    ("/api/assets/export", "bulk"),
+    ("/api/agents/bulk_update", "bulk"),
+    ("/nmap_scan", "bulk"),
+    ("/gather_assets", "bulk"),
+    ("/downloads/", "bulk"),
+    ("/admin/", "bulk"),
+)
+
+controller: Optional["AdmissionController"] = None
+
+
+class Lane:
+    def __init__(self, name: str, limit: int, headroom: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.headroom = headroom
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = collections.deque()
+
+
+def default_lanes(capacity: int, queue_timeout: float) -> list:
+    """Heartbeat > assets > query > bulk, highest priority first.
+
+    Headroom is capped at capacity - 1, so on a tiny pool every lane can still run
+    one request at a time once the server is otherwise idle.
+    """
+    if capacity < 1:
+        raise ValueError(f"Admission capacity must be at least 1, got {capacity} (QS_ADMISSION_CAPACITY)")
+    reserve = min(max(1, capacity // 10), capacity - 1)
+    double_reserve = min(2 * reserve, capacity - 1)
+    return [
+        Lane("heartbeat", capacity, 0, max_queue=4096, queue_timeout=queue_timeout * 2),
+        Lane("assets", capacity, reserve, max_queue=1024, queue_timeout=queue_timeout * 2),
+        Lane("query", capacity, double_reserve, max_queue=256, queue_timeout=queue_timeout),
+        Lane("bulk", max(1, reserve), double_reserve, max_queue=16, queue_timeout=queue_timeout),
+    ]
+
+
+class AdmissionController:
+    def __init__(self, capacity: int, lanes: list, routes: tuple = LANE_ROUTES):
+        self.capacity = capacity
+        self.lanes = list(lanes)
+        self.active = 0
+        by_name = {lane.name: lane for lane in self.lanes}
+        self._exact = {path: by_name.get(name) for path, name in routes if not path.endswith("/")}
+        self._prefixes = sorted(((path, by_name.get(name)) for path, name in routes if path.endswith("/")),
+                                key=lambda item: -len(item[0]))
+        self._default = by_name.get("query")
+
+    def lane_for(self, path: str) -> Optional[Lane]:
+        if path in self._exact:
+            return self._exact[path]
+        for prefix, lane in self._prefixes:
+            if path.startswith(prefix):
+                return lane
+        return self._default
+
+    def queued(self) -> int:
+        return sum(len(lane.waiters) for lane in self.lanes)
+
+    def _fits(self, lane: Lane) -> bool:
+        return lane.active < lane.limit and self.active < self.capacity - lane.headroom
+
+    def _take(self, lane: Lane):
+        lane.active += 1
+        self.active += 1
+
+    async def acquire(self, lane: Lane) -> bool:
+        """Wait for a slot in `lane`; False if the request should be turned away."""
+        if not lane.waiters and self._fits(lane):
+            self._take(lane)
+            ADMISSION.inc((lane.name, "admitted"))
+            ADMISSION_WAIT_SECONDS.observe((lane.name,), 0.0)
+            return True
+        if len(lane.waiters) >= lane.max_queue:
+            ADMISSION.inc((lane.name, "queue_full"))
+            return False
+
+        started = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, lane.queue_timeout)
+        except asyncio.TimeoutError:
+            # The slot may have been granted in the same loop iteration the timeout fired.
+            if not waiter.done() or waiter.cancelled():
+                self._forget(lane, waiter)
+                ADMISSION.inc((lane.name, "timeout"))
+                return False
+        except asyncio.CancelledError:
+            # Client went away while queued.
+            if waiter.done() and not waiter.cancelled():
+                self.release(lane)
+            else:
+                self._forget(lane, waiter)
+            raise
+        ADMISSION.inc((lane.name, "admitted"))
+        ADMISSION_WAIT_SECONDS.observe((lane.name,), time.perf_counter() - started)
+        return True
+
+    def release(self, lane: Lane):
+        lane.active -= 1
+        self.active -= 1
+        self._wake()
+
+    def _forget(self, lane: Lane, waiter):
+        try:
+            lane.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _wake(self):
+        for lane in self.lanes:
+            while lane.waiters and self._fits(lane):
+                waiter = lane.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._take(lane)
+                waiter.set_result(None)
+
+
+def configure(capacity: int, queue_timeout: float, routes: tuple = LANE_ROUTES) -> AdmissionController:
+    """The process-wide controller read by AdmissionMiddleware and the /metrics gauges."""
+    global controller
+    controller = AdmissionController(capacity, default_lanes(capacity, queue_timeout), routes)
+    return controller
+
+
+REGISTRY.register(Gauge("qs_admission_active", "Requests admitted and being served.",
+                        lambda: controller.active if controller else None))
+REGISTRY.register(Gauge("qs_admission_queued", "Requests waiting for an admission slot.",
+                        lambda: controller.queued() if controller else None))
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware: hold a lane slot for the whole request, or answer 503."""
+
+    def __init__(self, app, retry_after_seconds: int = 1):
+        self.app = app
+        self.retry_after = str(retry_after_seconds).encode()
+
+    async def __call__(self, scope, receive, send):
+        lane = controller.lane_for(scope["path"]) if scope["type"] == "http" and controller else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+        if not await controller.acquire(lane):
+            body = json.dumps({"detail": "Server busy, retry shortly"}).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                (b"retry-after", self.retry_after),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(lane)
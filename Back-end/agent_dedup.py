@@ -0,0 +1,109 @@
+"""
+Agent identity deduplication.
+
+agent_uuid is minted per install and kept in the agent's agent_uuid.txt, so
+every reinstall adds a row to `agents`. Agents also report a stable `host_id`
+(machine-id / MachineGuid / IOPlatformUUID) as a hint; it is not the row key,
+because VM clones that were never given a new machine ID share it.
+
+`AgentDeduplicator` moves every row that a newer UUID on the same machine has
+superseded, and that has been silent for the grace period, into `agents_archive`.
+Rows are the same machine when their host_ids match (e.g. after a rename), or
+when their hostnames match and either row has no host_id. Two rows with
+different host_ids are never merged: hosts sharing a default hostname
+("ubuntu", "localhost") stay apart. Admin classification on the
+archived rows is carried over to the survivor where the survivor still has the
+default. Passes are incremental: only machines with a row created since the
+previous pass (minus the grace period) are examined, with a full pass at startup
+and then every `full_pass_seconds`. Only one worker runs a pass at a time.
+"""
+import threading
+import time
+
+from db import db_session
+from queries import AGENT_DEDUP_ARCHIVE, AGENT_DEDUP_CANDIDATES
+from risk import refresh_risk
+
+DEDUP_LOCK_KEY = 0x51_5344_4450  # pg_advisory_lock key shared by all workers
+ANALYZE_AFTER_ROWS = 1000
+
+
+class AgentDeduplicator(threading.Thread):
+    def __init__(self, cache, interval_seconds: float = 300.0, grace_seconds: float = 3600.0,
+                 full_pass_seconds: float = 86400.0, batch_size: int = 500):
+        super().__init__(name="agent-dedup", daemon=True)
+        self.cache = cache
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self.full_pass_seconds = full_pass_seconds
+        self.batch_size = batch_size
+        self.archived_total = 0
+        self._since = None          # DB time the previous pass started; None forces a full pass
+        self._next_full_pass = 0.0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def dedup(self, full: bool = False) -> dict:
+        """Run one pass; returns {"archived": n, "merged": n}, or None if another worker holds the lock."""
+        with db_session() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(%s), NOW()::timestamp;", (DEDUP_LOCK_KEY,))
+            locked, started = cur.fetchone()
+            conn.commit()
+            if not locked:
+                cur.close()
+                return None
+            try:
+                summary = self._run_pass(conn, cur, None if full else self._since)
+            finally:
+                conn.rollback()
+                cur.execute("SELECT pg_advisory_unlock(%s);", (DEDUP_LOCK_KEY,))
+                conn.commit()
+                cur.close()
+        self._since = started
+        self.archived_total += summary["archived"]
+        return summary
+
+    def _run_pass(self, conn, cur, since) -> dict:
+        summary = {"archived": 0, "merged": 0}
+        while True:
+            AGENT_DEDUP_CANDIDATES.execute(cur, {
+                "since": since, "grace_seconds": self.grace_seconds, "limit": self.batch_size})
+            uuids = [row[0] for row in cur.fetchall()]
+            if not uuids:
+                break
+            AGENT_DEDUP_ARCHIVE.execute(cur, {"uuids": uuids, "grace_seconds": self.grace_seconds})
+            rows = cur.fetchall()
+            archived = sum(1 for action, _ in rows if action == "archived")
+            merged = {hostname for action, hostname in rows if action == "merged"}
+            if merged:
+                refresh_risk(cur, sorted(merged))
+            if rows:
+                self.cache.notify(cur, "agents", "assets")
+            conn.commit()
+            summary["archived"] += archived
+            summary["merged"] += len(merged)
+            if archived == 0:
+                break  # every candidate heartbeated meanwhile
+        if summary["archived"] >= ANALYZE_AFTER_ROWS:
+            # The per-host "latest heartbeat" plans depend on rows per hostname.
+            cur.execute("ANALYZE agents;")
+            conn.commit()
+        return summary
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                full = time.monotonic() >= self._next_full_pass
+                summary = self.dedup(full=full)
+                if summary is not None:
+                    if full:
+                        self._next_full_pass = time.monotonic() + self.full_pass_seconds
+                    if summary["archived"]:
+                        print(f"[INFO] Archived {summary['archived']} superseded agent UUID(s), "
+                              f"merged classification into {summary['merged']} host(s)")
+            except Exception as e:
+                print(f"⚠️ Agent dedup error: {e}")
+            self._stop_event.wait(self.interval_seconds)
@@ -0,0 +1,116 @@
+"""
+Agent Active/Inactive tracking.
+
+`agents.status` is kept current and every transition is appended to
+`agent_state_changes`, so dashboards filter by status in SQL and outage
+timelines are a range scan.
+
+Inactive -> Active happens inside the heartbeat upsert itself. Active ->
+Inactive needs a timer: `AgentStatusSweeper` keeps a min-heap of
+(expected next heartbeat, agent_uuid). Every heartbeat pushes a new deadline
+(O(log n)); superseded entries are skipped lazily when they surface. The sweeper
+sleeps until the earliest deadline, then marks the overdue agents Inactive in
+one conditional UPDATE. A full reconciliation runs at startup and periodically,
+covering agents whose heartbeats went to another worker.
+"""
+import heapq
+import threading
+import time
+
+from db import db_session
+from queries import (ACTIVE_AGENT_DEADLINES, AGENTS_MARK_ALL_INACTIVE,
+                     AGENTS_MARK_INACTIVE)
+
+
+class AgentStatusSweeper(threading.Thread):
+    def __init__(self, cache, threshold_seconds: float, grace_seconds: float = 1.0,
+                 reconcile_seconds: float = 60.0):
+        super().__init__(name="agent-status-sweeper", daemon=True)
+        self.cache = cache
+        self.threshold_seconds = threshold_seconds
+        self.grace_seconds = grace_seconds
+        self.reconcile_seconds = reconcile_seconds
+        self.transitions = 0
+        self._heap = []       # (monotonic deadline, agent_uuid)
+        self._expected = {}   # agent_uuid -> its latest deadline; older heap entries are stale
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def expect(self, agent_uuid: str, age_seconds: float = 0.0):
+        """Record a heartbeat: the agent is overdue `threshold` seconds after it was sent."""
+        deadline = time.monotonic() + self.threshold_seconds + self.grace_seconds - age_seconds
+        with self._lock:
+            self._expected[agent_uuid] = deadline
+            heapq.heappush(self._heap, (deadline, agent_uuid))
+            earliest = self._heap[0][0] == deadline
+        if earliest:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._expected)
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, agent_uuid = heapq.heappop(self._heap)
+                if self._expected.get(agent_uuid) == deadline:
+                    del self._expected[agent_uuid]
+                    due.append(agent_uuid)
+        return due
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            if not self._heap:
+                return self.reconcile_seconds
+            return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def _apply(self, statement, values: dict) -> int:
+        with db_session() as conn:
+            cur = conn.cursor()
+            changed = len(statement.execute(cur, values).fetchall())
+            if changed:
+                self.cache.notify(cur, "agents")
+            conn.commit()
+            cur.close()
+        self.transitions += changed
+        return changed
+
+    def reconcile(self) -> int:
+        """Mark every overdue agent Inactive and (re)seed the heap with the Active ones."""
+        changed = self._apply(AGENTS_MARK_ALL_INACTIVE, {"threshold": self.threshold_seconds})
+        with db_session() as conn:
+            cur = conn.cursor()
+            active = ACTIVE_AGENT_DEADLINES.execute(cur).fetchall()
+            cur.close()
+        for agent_uuid, age_seconds in active:
+            with self._lock:
+                known = agent_uuid in self._expected
+            if not known:
+                self.expect(agent_uuid, float(age_seconds))
+        return changed
+
+    def run(self):
+        next_reconcile = 0.0
+        while not self._stop_event.is_set():
+            # Cleared before the work, so an expect() that lands meanwhile still wakes us.
+            self._wakeup.clear()
+            try:
+                now = time.monotonic()
+                if now >= next_reconcile:
+                    changed = self.reconcile()
+                    if changed:
+                        print(f"[INFO] {changed} agent(s) marked Inactive during reconciliation")
+                    next_reconcile = now + self.reconcile_seconds
+                due = self._pop_due(time.monotonic())
+                if due:
+                    self._apply(AGENTS_MARK_INACTIVE, {"threshold": self.threshold_seconds, "uuids": due})
+            except Exception as e:
+                print(f"⚠️ Agent status sweeper error: {e}")
+                self._stop_event.wait(5.0)
+            self._wakeup.wait(min(self._next_wait(), max(0.0, next_reconcile - time.monotonic())))
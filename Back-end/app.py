@@ -1,28 +1,61 @@
-import base64
+import csv
 import hashlib
 import io
+import ipaddress
 import math  # Added for pagination calculation
 import os
 import secrets
-import subprocess
+import zlib
 from contextlib import asynccontextmanager
-from datetime import datetime, timezone
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Literal, Optional
 
-import psycopg2
-import requests
 # 🚀 FIX: Corrected the multi-line import syntax
 from fastapi import Query  # Added Query
 from fastapi import (Depends, FastAPI, Form, HTTPException, Request, Response,
                      status)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import (FileResponse, HTMLResponse, JSONResponse,
-                               RedirectResponse)
+                               PlainTextResponse, RedirectResponse,
+                               StreamingResponse)
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from psycopg2.extras import Json, RealDictCursor
+from markupsafe import Markup
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError
 from pydantic import BaseModel, Field
 
+import admission
+from agent_dedup import AgentDeduplicator
+from db import db_session
+from fragments import RenderedPage, RowFragmentCache
+from history import HistoryPruner, state_at
+from ingest import (INGEST_PATHS, AssetPayload, db_pool_exhausted,
+                    flatten_agent_payload, get_db, start_core_services,
+                    stop_core_services, upsert_asset_record)
+from ingest import router as ingest_router
+from metrics import REGISTRY, MetricsMiddleware
+from profiling import PROFILER
+from queries import (AGENT_ANALYTICS, AGENT_ARCHIVE_FOR_HOST, AGENT_BULK_UPDATE_SQL,
+                     AGENT_BULK_UPDATE_TEMPLATE, AGENT_OUTAGES,
+                     AGENT_STATE_CHANGES, LATEST_AGENT_COUNT_BY_STATUS,
+                     SERVER_DASHBOARD_PAGE_BY_STATUS, HOST_VULNS, VULN_DETAIL,
+                     VULN_HOSTS, VULN_SUMMARY, ASSET_ANALYTICS, ASSET_COUNT, ASSET_PAGE,
+                     ASSET_PAGE_SORTS, EXPORT_COLUMNS, HISTORY_CHANGES,
+                     HISTORY_SNAPSHOTS, LATEST_AGENT_COUNT,
+                     PORT_EXPOSURES, PORT_SUMMARY, PRIORITY_DASHBOARD_PAGE,
+                     PRIORITY_SORT_COLUMNS, QUERY_STATS, SERVER_DASHBOARD_PAGE,
+                     SERVER_DASHBOARD_SUMMARY, SORT_ORDERS,
+                     asset_count_sql, agent_filter_update_sql, asset_export_sql,
+                     asset_page_sql, build_agent_filters, build_asset_filters,
+                     build_port_filters, port_hosts_sql)
+from risk import RISKY_PORTS, RiskSweeper, refresh_risk
+from serialization import Encoded, dumps, fetch_dicts, json_response
+from settings import (ADMISSION_CAPACITY, ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                      BASE_DIR, SERVICE_ROLE, SLOW_QUERY_LOG,
+                      SLOW_QUERY_THRESHOLD_MS, query_cache)
+from vulns import load_feed, normalize_product
+
 # --------------------------------------------------------------------------------------
 # CONFIGURATION
 # --------------------------------------------------------------------------------------
@@ -30,7 +63,7 @@ from pydantic import BaseModel, Field
 # --- Removed Security, JWT, reCAPTCHA, and User Config ---
 
 # --- Directory Config ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# BASE_DIR, LOGS_DIR and everything ingest workers need as well live in settings.py.
 FILES_DIR = os.path.join(BASE_DIR, "files")
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -45,76 +78,79 @@ os.makedirs(STATIC_DIR, exist_ok=True)
 agent_ips = ["http://192.168.1.20:9000/report"]
 ALLOWED_DOWNLOADS = {"windows": "QS-Setup.exe", "ubuntu": "qs-agent_1.0.0_all.deb", "mac": "mac_agent"}
 DOWNLOAD_TOKENS = {}
-DB_CONFIG = {"dbname": "assetdb", "user": "postgres", "password": "root", "host": "localhost", "port": 5432}
-ACTIVE_THRESHOLD_SECONDS = 10
+# Superseded agent UUIDs (reinstalls, renamed hosts) move to agents_archive once silent this long.
+AGENT_DEDUP_GRACE_SECONDS = 3600
+AGENT_DEDUP_INTERVAL_SECONDS = 300
+# Asset history older than this is pruned (one keyframe per host is kept); 0 keeps everything.
+HISTORY_RETENTION_DAYS = int(os.environ.get("QS_HISTORY_RETENTION_DAYS", "180"))
+HISTORY_PRUNE_SECONDS = 6 * 3600
+EXPORT_FETCH_ROWS = 2000  # rows per round trip from the export's server-side cursor
+# Offline KEV/CVE dump loaded by POST /admin/vulns/reload (or `python vulns.py load <file>`).
+VULN_FEED_PATH = os.environ.get("QS_VULN_FEED", os.path.join(BASE_DIR, "data", "kev_feed.json"))
+BULK_UPDATE_MAX_ROWS = 5000  # per /api/agents/bulk_update request
+PRIORITIES = ("High", "Medium", "Low")
+# Seconds between sweeps for hosts whose heartbeat/inventory staleness (and so risk) changed.
+RISK_SWEEP_SECONDS = 60
+
+# --- Fleet Analytics Config ---
+# /api/analytics/summary is recomputed at most once per interval, whatever the write rate.
+ANALYTICS_REFRESH_SECONDS = 30
+MEMORY_BUCKETS_GB = (4, 8, 16, 32, 64, 128)
+DISK_BUCKETS_GB = (128, 256, 512, 1024, 2048, 4096)
+UPTIME_BUCKETS_DAYS = (1, 7, 30, 90, 365)
+
+# --- HTML Dashboard Config ---
+# Templates compile on first render, with their bytecode kept in TEMPLATE_CACHE_DIR across
+# restarts, and are never re-checked on disk; set QS_TEMPLATE_RELOAD=1 while editing them.
+# QS_TEMPLATE_PRECOMPILE=1 compiles them all at startup instead (HTML-serving workers only).
+TEMPLATE_CACHE_DIR = os.path.join(BASE_DIR, ".template_cache")
+TEMPLATE_AUTO_RELOAD = os.environ.get("QS_TEMPLATE_RELOAD") == "1"
+TEMPLATE_PRECOMPILE = os.environ.get("QS_TEMPLATE_PRECOMPILE") == "1"
+FRAGMENT_CACHE_ROWS = 10_000  # rendered table rows kept, across all pages and dashboards
 
 
 # --------------------------------------------------------------------------------------
 # FASTAPI APP LIFESPAN & SETUP
 # --------------------------------------------------------------------------------------
 
-def init_db():
-    """Create required tables if they don't exist."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS agents (
-            agent_uuid TEXT PRIMARY KEY, hostname TEXT, os_name TEXT,
-            machine_type TEXT, ip_address TEXT, first_seen TIMESTAMP NOT NULL DEFAULT NOW(),
-            last_heartbeat TIMESTAMP NOT NULL
-        );
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS assets (
-            hostname TEXT PRIMARY KEY, username TEXT, os TEXT, os_version TEXT,
-            cpu TEXT, memory_gb DOUBLE PRECISION, disk_gb DOUBLE PRECISION,
-            uptime_seconds BIGINT, ip_addresses TEXT, open_ports JSONB,
-            software TEXT, vmware_vms JSONB, ip_reporter TEXT, collected_at TIMESTAMP NOT NULL DEFAULT NOW()
-        );
-    """)
-    
-    # --- MODIFIED MIGRATION BLOCK ---
-    try:
-        cur.execute("""
-            ALTER TABLE agents
-            ADD COLUMN IF NOT EXISTS priority TEXT NOT NULL DEFAULT 'Medium';
-        """)
-        print("✅ Priority column migration checked/applied.")
-        
-        # ADDED: New columns for Internet Facing and Department
-        cur.execute("""
-            ALTER TABLE agents
-            ADD COLUMN IF NOT EXISTS is_internet_facing BOOLEAN NOT NULL DEFAULT FALSE;
-        """)
-        print("✅ 'is_internet_facing' column migration checked/applied.")
-
-        cur.execute("""
-            ALTER TABLE agents
-            ADD COLUMN IF NOT EXISTS department TEXT NOT NULL DEFAULT 'Unassigned';
-        """)
-        print("✅ 'department' column migration checked/applied.")
-        
-    except Exception as e:
-        print(f"⚠️ Error adding new columns: {e}")
-        conn.rollback()
-    # --- END MODIFIED BLOCK ---
+agent_deduplicator: Optional[AgentDeduplicator] = None
+history_pruner: Optional[HistoryPruner] = None
 
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("✅ Database initialized.")
-    
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global agent_deduplicator, history_pruner
     # Code to run on startup
     print("🚀 Server starting up...")
-    init_db()
+    if TEMPLATE_PRECOMPILE:
+        precompile_templates()
+    # With QS_ROLE=query heartbeats go to the ingest workers, which run the status sweeper.
+    services = start_core_services(sweep_status=SERVICE_ROLE == "all")
+    risk_sweeper = RiskSweeper(query_cache, interval_seconds=RISK_SWEEP_SECONDS)
+    risk_sweeper.start()
+    agent_deduplicator = AgentDeduplicator(query_cache, interval_seconds=AGENT_DEDUP_INTERVAL_SECONDS,
+                                           grace_seconds=AGENT_DEDUP_GRACE_SECONDS)
+    agent_deduplicator.start()
+    if HISTORY_RETENTION_DAYS > 0:
+        history_pruner = HistoryPruner(HISTORY_RETENTION_DAYS, interval_seconds=HISTORY_PRUNE_SECONDS)
+        history_pruner.start()
     yield
     # Code to run on shutdown
     print("🛑 Server shutting down...")
+    if history_pruner is not None:
+        history_pruner.stop()
+    agent_deduplicator.stop()
+    risk_sweeper.stop()
+    stop_core_services(services)
 
 app = FastAPI(lifespan=lifespan)
 
+# ==============================================================================
+# ADMISSION CONTROL
+# ==============================================================================
+# Innermost, so a 503 from a full queue still gets CORS headers and is counted in /metrics.
+admission.configure(ADMISSION_CAPACITY, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+app.add_middleware(admission.AdmissionMiddleware)
+
 # ==============================================================================
 # CORS MIDDLEWARE
 # ==============================================================================
@@ -136,48 +172,77 @@ app.add_middleware(
 # ==============================================================================
 
 
-# Mount static files and templates
+# ==============================================================================
+# METRICS MIDDLEWARE
+# ==============================================================================
+app.add_middleware(MetricsMiddleware, ingest_paths=INGEST_PATHS)
+app.add_exception_handler(PoolError, db_pool_exhausted)
+if SERVICE_ROLE == "all":
+    app.include_router(ingest_router)
+# ==============================================================================
+
+
+# Mount static files; templates load on first use (see get_templates)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
-templates = Jinja2Templates(directory=TEMPLATES_DIR)
+
+@lru_cache(maxsize=None)
+def get_templates():
+    """Jinja2 costs ~0.1s to import; only the HTML pages need it."""
+    import jinja2
+    from fastapi.templating import Jinja2Templates
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR), autoescape=True,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(TEMPLATE_CACHE_DIR), auto_reload=TEMPLATE_AUTO_RELOAD,
+    )
+    return Jinja2Templates(env=env)
+
+def precompile_templates():
+    """Compile every template now rather than on the first request for each page (QS_TEMPLATE_PRECOMPILE=1)."""
+    env = get_templates().env
+    for name in env.list_templates(extensions=["html"]):
+        env.get_template(name)
+    print(f"✅ Compiled {len(env.list_templates(extensions=['html']))} templates")
+
+fragment_cache = RowFragmentCache(max_rows=FRAGMENT_CACHE_ROWS)
+
+def render_agent_rows(macro_name: str, agents: list) -> RenderedPage:
+    """One <tr id="agent-<uuid>"> per agent via templates/_rows.html, reusing unchanged rows."""
+    macro = getattr(get_templates().env.get_template("_rows.html").module, macro_name)
+    return fragment_cache.render_page(macro, agents, lambda agent: f"agent-{agent['agent_uuid']}")
 
 
 # --------------------------------------------------------------------------------------
 # PYDANTIC MODELS (FOR DATA VALIDATION)
 # --------------------------------------------------------------------------------------
-class HeartbeatPayload(BaseModel):
+class AgentFields(BaseModel):
+    """Classification fields; a field left out (None) is not changed."""
+    priority: Optional[str] = None
+    department: Optional[str] = None
+    is_internet_facing: Optional[bool] = None
+
+class AgentUpdate(AgentFields):
     agent_uuid: str
-    hostname: Optional[str] = None
+
+class AgentFilter(BaseModel):
+    agent_uuids: Optional[List[str]] = None
+    hostnames: Optional[List[str]] = None
     os_name: Optional[str] = None
-    machine_type: Optional[str] = None
-
-class AssetPayload(BaseModel):
-    hostname: Optional[str] = None
-    username: Optional[str] = None
-    os: Optional[str] = None
-    os_version: Optional[str] = None
-    cpu: Optional[str] = None
-    memory_gb: Optional[float] = Field(None, alias='ram', alias_priority=2)
-    disk_gb: Optional[float] = Field(None, alias='hdd', alias_priority=2)
-    uptime_seconds: Optional[int] = 0
-    ip_addresses: Optional[List[str]] = []
-    software: Optional[List[str]] = []
-    open_ports: Optional[list] = []
-    vmware_vms: Optional[list] = []
+    department: Optional[str] = None
+    priority: Optional[str] = None
+    is_internet_facing: Optional[bool] = None
 
+class BulkAgentUpdate(BaseModel):
+    """Either a list of per-agent `updates`, or a `filter` plus the values to `set`."""
+    updates: List[AgentUpdate] = []
+    filter: Optional[AgentFilter] = None
+    set: Optional[AgentFields] = None
+    all_agents: bool = Field(False, description="Required to run a `set` with an empty filter")
 
 # --------------------------------------------------------------------------------------
 # DB & AUTH DEPENDENCIES
 # --------------------------------------------------------------------------------------
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
-
-def get_db():
-    db = get_db_connection()
-    try:
-        yield db
-    finally:
-        db.close()
-
+# Routes borrow pooled connections through ingest.get_db.
 # --- Removed create_access_token, get_current_user, and get_user_for_html ---
 
 
@@ -190,35 +255,24 @@ def sha256_of_file(path: str) -> str:
         for chunk in iter(lambda: f.read(8192), b""): h.update(chunk)
     return h.hexdigest()
 
-def flatten_agent_payload(data: AssetPayload) -> dict:
-    """Normalize the agent JSON into the schema we store in `assets`."""
-    return {
-        "hostname": data.hostname, "username": data.username, "os": data.os,
-        "os_version": data.os_version, "cpu": data.cpu,
-        "memory_gb": data.memory_gb, "disk_gb": data.disk_gb,
-        "uptime_seconds": data.uptime_seconds,
-        "ip_addresses": ", ".join(data.ip_addresses) if data.ip_addresses else None,
-        "software": ", ".join(data.software) if data.software else None,
-        "open_ports_json": data.open_ports, "vmware_vms_json": data.vmware_vms,
-    }
+def parse_ip_filter(value: Optional[str]):
+    """Split an `ip` query parameter into (exact address, network) for build_asset_filters."""
+    if not value:
+        return None, None
+    try:
+        if "/" in value:
+            return None, str(ipaddress.ip_network(value, strict=False))
+        return str(ipaddress.ip_address(value)), None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid IP or CIDR: {value}")
 
-def upsert_asset_record(flat: dict, reporter_ip: Optional[str] = None, conn=Depends(get_db)):
-    """Insert/update latest info for a hostname into `assets`."""
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO assets (hostname, username, os, os_version, cpu, memory_gb, disk_gb, uptime_seconds, ip_addresses, open_ports, software, vmware_vms, ip_reporter, collected_at)
-        VALUES (%(hostname)s, %(username)s, %(os)s, %(os_version)s, %(cpu)s, %(memory_gb)s, %(disk_gb)s, %(uptime_seconds)s, %(ip_addresses)s, %(open_ports)s, %(software)s, %(vmware_vms)s, %(ip_reporter)s, NOW())
-        ON CONFLICT (hostname) DO UPDATE SET
-            username = EXCLUDED.username, os = EXCLUDED.os, os_version = EXCLUDED.os_version, cpu = EXCLUDED.cpu, memory_gb = EXCLUDED.memory_gb, disk_gb = EXCLUDED.disk_gb, uptime_seconds = EXCLUDED.uptime_seconds, ip_addresses = EXCLUDED.ip_addresses, open_ports = EXCLUDED.open_ports, software = EXCLUDED.software, vmware_vms = EXCLUDED.vmware_vms, ip_reporter = EXCLUDED.ip_reporter, collected_at = NOW();
-    """, {
-        "hostname": flat.get("hostname"), "username": flat.get("username"), "os": flat.get("os"),
-        "os_version": flat.get("os_version"), "cpu": flat.get("cpu"), "memory_gb": flat.get("memory_gb"),
-        "disk_gb": flat.get("disk_gb"), "uptime_seconds": flat.get("uptime_seconds"), "ip_addresses": flat.get("ip_addresses"),
-        "open_ports": Json(flat.get("open_ports_json", [])), "software": flat.get("software"),
-        "vmware_vms": Json(flat.get("vmware_vms_json", [])), "ip_reporter": reporter_ip,
-    })
-    conn.commit()
-    cur.close()
+def utc_now() -> datetime:
+    """Now as naive UTC, like the timestamps stored in the database."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def utc_naive(value: datetime) -> datetime:
+    """Query-string datetimes may carry an offset; stored timestamps are naive UTC."""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
 
 # --------------------------------------------------------------------------------------
 # AUTH & BASIC PAGE ROUTES
@@ -233,55 +287,41 @@ async def home(request: Request):
 # --- Removed /login and /logout routes ---
 
 
+def load_priority_dashboard(page: int, limit: int, sort_by: str, sort_order: str):
+    """Run the priority dashboard queries; results are cached by the caller."""
+    offset = (page - 1) * limit
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        total_records = LATEST_AGENT_COUNT.execute(cur).fetchone()['total']
+        total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
+        PRIORITY_DASHBOARD_PAGE[(sort_by, sort_order)].execute(cur, {"limit": limit, "offset": offset})
+        agents = cur.fetchall()
+        cur.close()
+        return agents, total_pages
+
+def load_priority_dashboard_rows(page: int, limit: int, sort_by: str, sort_order: str):
+    agents, total_pages = load_priority_dashboard(page, limit, sort_by, sort_order)
+    return render_agent_rows("priority_dashboard_row", agents), total_pages
+
 @app.get("/priority_dashboard", response_class=HTMLResponse)
 def priority_dashboard(
     request: Request,
     # user: Optional[dict] = Depends(get_user_for_html), # Removed Auth
-    conn=Depends(get_db),
     page: int = Query(1, ge=1),
     limit: int = Query(50, ge=1, le=200),
-    sort_by: str = Query("priority", enum=["priority", "heartbeat", "hostname", "department", "is_internet_facing"]),
-    sort_order: str = Query("asc", enum=["asc", "desc"])
+    sort_by: str = Query("priority", enum=list(PRIORITY_SORT_COLUMNS)),
+    sort_order: str = Query("asc", enum=list(SORT_ORDERS))
 ):
     # if not user: return RedirectResponse(url="/") # Removed Auth
-    
-    offset = (page - 1) * limit
-    cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    base_query = """
-        FROM agents a INNER JOIN (
-            SELECT hostname, MAX(last_heartbeat) AS max_hb FROM agents GROUP BY hostname
-        ) b ON a.hostname = b.hostname AND a.last_heartbeat = b.max_hb
-    """
-    cur.execute(f"SELECT COUNT(a.agent_uuid) AS total {base_query};")
-    total_records = cur.fetchone()['total']
-    total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
-    sort_column_map = {
-        "priority": "a.priority", "heartbeat": "a.last_heartbeat",
-        "hostname": "a.hostname", "department": "a.department",
-        "is_internet_facing": "a.is_internet_facing"
-    }
-    primary_sort = sort_column_map.get(sort_by, "a.priority")
-    secondary_sort = "a.last_heartbeat DESC"
-    if sort_by == "priority": secondary_sort = "a.last_heartbeat DESC"
-    elif sort_by == "heartbeat": secondary_sort = "a.priority ASC"
-    elif sort_by == "hostname": secondary_sort = "a.priority ASC"
-    elif sort_by == "department": secondary_sort = "a.priority ASC"
-    elif sort_by == "is_internet_facing": secondary_sort = "a.priority ASC"
-    order = "ASC" if sort_order == "asc" else "DESC"
-    order_by_clause = f"ORDER BY {primary_sort} {order}, {secondary_sort}"
-    cur.execute(f"SELECT a.* {base_query} {order_by_clause} LIMIT %s OFFSET %s;", (limit, offset))
-    agents = cur.fetchall()
-    cur.close()
-    now_utc = datetime.now(timezone.utc)
-    for agent in agents:
-        last_hb_aware = agent["last_heartbeat"].replace(tzinfo=timezone.utc)
-        diff = (now_utc - last_hb_aware).total_seconds()
-        agent["status"] = "Active" if diff <= ACTIVE_THRESHOLD_SECONDS else "Inactive"
+    rows, total_pages = query_cache.get_or_load(
+        ("priority_dashboard", page, limit, sort_by, sort_order), ("agents",),
+        lambda: load_priority_dashboard_rows(page, limit, sort_by, sort_order),
+    )
 
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "priority_dashboard.html", {
-            "request": request, "agents": agents,
+            "request": request, "rows_html": rows.html,
             "current_page": page, "total_pages": total_pages,
             "limit": limit, "user": None, # Set user to None
             "sort_by": sort_by, "sort_order": sort_order
@@ -316,9 +356,12 @@ def update_agent_details(
             UPDATE agents 
             SET priority = %s, department = %s, is_internet_facing = %s 
             WHERE agent_uuid = %s
+            RETURNING hostname
             """,
             (priority, clean_department, is_facing_bool, agent_uuid)
         )
+        refresh_risk(cur, [row[0] for row in cur.fetchall()])
+        query_cache.notify(cur, "agents")
         conn.commit()
         cur.close()
     except Exception as e:
@@ -328,11 +371,79 @@ def update_agent_details(
     referer = request.headers.get("referer", "/priority_dashboard")
     return RedirectResponse(url=referer, status_code=status.HTTP_303_SEE_OTHER)
 
+def clean_agent_fields(fields: AgentFields) -> Optional[dict]:
+    """Validate like /update_agent_details does; returns None if a value is not allowed."""
+    if fields.priority is not None and fields.priority not in PRIORITIES:
+        return None
+    department = fields.department
+    if department is not None:
+        department = department.strip() or "Unassigned"
+    return {"priority": fields.priority, "department": department, "is_internet_facing": fields.is_internet_facing}
+
+@app.post("/api/agents/bulk_update", response_class=JSONResponse)
+def bulk_update_agents(payload: BulkAgentUpdate, conn=Depends(get_db)):
+    """Apply many classification changes in one transaction and one cache invalidation."""
+    if bool(payload.updates) == (payload.set is not None):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Send either `updates` or `filter` + `set`")
+    if len(payload.updates) > BULK_UPDATE_MAX_ROWS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {BULK_UPDATE_MAX_ROWS} updates per request")
+
+    cur = conn.cursor()
+    results = []
+    if payload.updates:
+        # Per-row mode: bad rows are reported, not fatal. Rows for the same uuid are
+        # merged (later non-null fields win) since VALUES may only match a row once.
+        rows = {}
+        for index, update in enumerate(payload.updates):
+            fields = clean_agent_fields(update)
+            if fields is None:
+                results.append({"index": index, "agent_uuid": update.agent_uuid, "status": "invalid",
+                                "detail": "priority must be one of High, Medium, Low"})
+                continue
+            indexes, merged = rows.setdefault(update.agent_uuid, ([], {}))
+            indexes.append(index)
+            merged.update({name: value for name, value in fields.items() if value is not None})
+        updated = {}
+        if rows:
+            returned = execute_values(
+                cur, AGENT_BULK_UPDATE_SQL,
+                [(uuid, f.get("priority"), f.get("department"), f.get("is_internet_facing"))
+                 for uuid, (_, f) in rows.items()],
+                template=AGENT_BULK_UPDATE_TEMPLATE, page_size=1000, fetch=True,
+            )
+            updated = dict(returned)
+        for uuid, (indexes, _) in rows.items():
+            row_status = "updated" if uuid in updated else "not_found"
+            results.extend({"index": index, "agent_uuid": uuid, "status": row_status} for index in indexes)
+        results.sort(key=lambda r: r["index"])
+    else:
+        fields = clean_agent_fields(payload.set)
+        if fields is None:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="priority must be one of High, Medium, Low")
+        where_clause, params = build_agent_filters(**(payload.filter.model_dump() if payload.filter else {}))
+        if not where_clause and not payload.all_agents:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="Empty filter: pass all_agents=true to update every agent")
+        cur.execute(agent_filter_update_sql(where_clause),
+                    {**params, **{f"set_{name}": value for name, value in fields.items()}})
+        updated = dict(cur.fetchall())
+        results = [{"agent_uuid": uuid, "status": "updated"} for uuid in updated]
+
+    if updated:
+        refresh_risk(cur, updated.values())
+        query_cache.notify(cur, "agents")
+    conn.commit()
+    cur.close()
+    return {"updated": len(updated), "results": results}
+
 # --------------------------------------------------------------------------------------
 # DASHBOARD & DATA ROUTES
 # --------------------------------------------------------------------------------------
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(
+def dashboard(
     request: Request,
     # user: Optional[dict] = Depends(get_user_for_html), # Removed Auth
     conn=Depends(get_db),
@@ -357,7 +468,7 @@ async def dashboard(
     assets = cur.fetchall()
     cur.close()
 
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "dashboard.html",
         {
             "request": request, "assets": assets,
@@ -374,137 +485,540 @@ async def dashboard(
 @app.get("/api/assets", response_class=JSONResponse)
 def get_assets_data(
     # user: Optional[dict] = Depends(get_current_user), # Removed Auth
-    conn=Depends(get_db),
     page: int = Query(1, ge=1),
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    os_name: Optional[str] = Query(None, alias="os"),
+    department: Optional[str] = None,
+    risk: Optional[str] = Query(None, enum=["High", "Medium", "Low"]),
+    min_risk_score: Optional[int] = Query(None, ge=0, le=100),
+    is_internet_facing: Optional[bool] = None,
+    ip: Optional[str] = Query(None, description="An address, or a CIDR to match any address inside it"),
+    username: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=2, description="Free text over hostname, user, OS and IPs"),
+    sort: str = Query("hostname", enum=list(ASSET_PAGE_SORTS)),
 ):
+    exact_ip, cidr = parse_ip_filter(ip)
+    filters = {
+        "os_name": os_name, "department": department, "risk": risk, "min_risk_score": min_risk_score,
+        "is_internet_facing": is_internet_facing, "ip": exact_ip, "cidr": cidr, "username": username, "search": q,
+    }
+    assets_json, total_pages = query_cache.get_or_load(
+        ("api_assets", page, limit, sort, tuple(sorted(filters.items()))), ("assets", "agents"),
+        lambda: load_assets_page(page, limit, filters, sort),
+    )
+
+    return json_response(assets=assets_json, current_page=page, total_pages=total_pages)
+
+def load_assets_page(page: int, limit: int, filters: Optional[dict] = None, sort: str = "hostname"):
+    """Run the /api/assets queries; the rows come back already JSON-encoded for the cache."""
     offset = (page - 1) * limit
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # First, get the total count of assets
-    cur.execute("SELECT COUNT(*) AS total FROM assets;")
-    total_records = cur.fetchone()['total']
+    where_clause, params = build_asset_filters(**(filters or {}))
+    with db_session() as conn:
+        cur = conn.cursor()
+        if not where_clause:
+            # Unfiltered pages are the dashboards' poll: use the prepared statements.
+            total_records = ASSET_COUNT.execute(cur).fetchone()[0]
+            # 🚀 Joins assets with their materialized risk score (see queries.ASSET_PAGE).
+            ASSET_PAGE[sort].execute(cur, {"limit": limit, "offset": offset})
+        else:
+            cur.execute(asset_count_sql(where_clause), params)
+            total_records = cur.fetchone()[0]
+            cur.execute(asset_page_sql(where_clause, sort), {**params, "limit": limit, "offset": offset})
+        assets = fetch_dicts(cur)
+        cur.close()
     total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
-    
-    # 🚀 MODIFIED QUERY:
-    # This query joins the assets table with the latest priority from the agents table.
-    # COALESCE is used to set a default 'risk' if no agent record is found.
-    cur.execute(
-        """
-        SELECT 
-            ast.hostname, ast.username, ast.os, ast.os_version, ast.cpu, 
-            ast.memory_gb, ast.disk_gb, ast.uptime_seconds, ast.ip_addresses, 
-            ast.collected_at,
-            COALESCE(latest_agent.priority, 'Medium') AS risk 
-        FROM 
-            assets ast
-        LEFT JOIN (
-            -- Subquery to get only the latest priority for each hostname
-            SELECT DISTINCT ON (hostname) 
-                   hostname, priority
-            FROM agents
-            ORDER BY hostname, last_heartbeat DESC
-        ) AS latest_agent ON ast.hostname = latest_agent.hostname
-        ORDER BY 
-            ast.hostname ASC 
-        LIMIT %s OFFSET %s;
-        """,
-        (limit, offset)
+    return Encoded(dumps(assets)), total_pages
+# 🚀 =============================================================================
+# 🚀 END OF MODIFIED ENDPOINT
+# 🚀 =============================================================================
+
+
+def stream_asset_export(where_clause: str, params: dict, fmt: str, expand_software: bool, compress: bool):
+    """Yield the export body chunk by chunk from a server-side cursor.
+
+    The connection is borrowed here rather than via Depends(get_db): dependency
+    cleanup runs before a StreamingResponse body is sent, and the cursor must stay
+    open until the last row has gone out.
+    """
+    columns = EXPORT_COLUMNS + (("package",) if expand_software else ())
+    gzipper = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    def encode(data: bytes) -> bytes:
+        return gzipper.compress(data) if gzipper else data
+
+    with db_session() as conn:
+        cur = conn.cursor(name="asset_export")
+        cur.itersize = EXPORT_FETCH_ROWS
+        cur.execute(asset_export_sql(where_clause, expand_software), params)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if fmt == "csv":
+            writer.writerow(columns)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_ROWS)
+            if not rows:
+                break
+            if fmt == "csv":
+                writer.writerows(rows)
+                data = buf.getvalue().encode()
+                buf.seek(0)
+                buf.truncate()
+            else:
+                # orjson (serialization.dumps) returns bytes, so NDJSON skips the text buffer.
+                data = b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+            chunk = encode(data)
+            if chunk:
+                yield chunk
+        if fmt == "csv" and buf.tell():
+            yield encode(buf.getvalue().encode())
+        cur.close()
+    if gzipper:
+        yield gzipper.flush()
+
+@app.get("/api/assets/export")
+def export_assets(
+    # user: Optional[dict] = Depends(get_current_user), # Removed Auth
+    fmt: str = Query("csv", alias="format", enum=["csv", "ndjson"]),
+    os_name: Optional[str] = Query(None, alias="os", description="Match assets.os (case-insensitive)"),
+    department: Optional[str] = None,
+    priority: Optional[str] = Query(None, enum=["High", "Medium", "Low"]),
+    risk: Optional[str] = Query(None, enum=["High", "Medium", "Low"]),
+    is_internet_facing: Optional[bool] = None,
+    ip: Optional[str] = Query(None, description="An address, or a CIDR to match any address inside it"),
+    username: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=2),
+    expand_software: bool = Query(False, description="One row per installed package"),
+    gzip: bool = Query(False, description="Compress the stream on the fly"),
+):
+    """Stream the full inventory (or a filtered slice) with constant memory."""
+    exact_ip, cidr = parse_ip_filter(ip)
+    where_clause, params = build_asset_filters(
+        os_name=os_name, department=department, priority=priority, is_internet_facing=is_internet_facing,
+        ip=exact_ip, cidr=cidr, username=username, search=q, risk=risk)
+    filename = f"assets.{fmt}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        stream_asset_export(where_clause, params, fmt, expand_software, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
-    assets = cur.fetchall()
-    cur.close()
 
+def load_server_dashboard(page: int, limit: int, status: Optional[str] = None) -> dict:
+    """Run the server dashboard queries shared by the HTML page and its JSON poll."""
+    offset = (page - 1) * limit
+    with db_session() as conn:
+        cur = conn.cursor()
+        if status:
+            total_records = LATEST_AGENT_COUNT_BY_STATUS.execute(cur, {"status": status}).fetchone()[0]
+            SERVER_DASHBOARD_PAGE_BY_STATUS.execute(cur, {"limit": limit, "offset": offset, "status": status})
+        else:
+            total_records = LATEST_AGENT_COUNT.execute(cur).fetchone()[0]
+            SERVER_DASHBOARD_PAGE.execute(cur, {"limit": limit, "offset": offset})
+        agents = fetch_dicts(cur)
+        total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
+        latest_heartbeat, unique_ips = SERVER_DASHBOARD_SUMMARY.execute(cur).fetchone()
+        cur.close()
     return {
-        "assets": assets,
-        "current_page": page,
+        "agents": agents,
+        # Encoded once per cache fill; the 5s JSON poll then just splices it in.
+        "agents_json": Encoded(dumps(agents)),
+        "total_records": total_records,
         "total_pages": total_pages,
+        "unique_ips": unique_ips,
+        "latest_download_time": latest_heartbeat.strftime('%Y-%m-%d %H:%M:%S') if latest_heartbeat else "N/A",
     }
-# 🚀 =============================================================================
-# 🚀 END OF MODIFIED ENDPOINT
-# 🚀 =============================================================================
 
+def cached_server_dashboard(page: int, limit: int, status: Optional[str] = None) -> dict:
+    return query_cache.get_or_load(
+        ("server_dashboard", page, limit, status), ("agents",),
+        lambda: load_server_dashboard(page, limit, status),
+    )
+
+def cached_server_dashboard_rows(page: int, limit: int, status: Optional[str] = None) -> RenderedPage:
+    return query_cache.get_or_load(
+        ("server_dashboard_rows", page, limit, status), ("agents",),
+        lambda: render_agent_rows("server_dashboard_row", cached_server_dashboard(page, limit, status)["agents"]),
+    )
 
 @app.get("/server_dashboard", response_class=HTMLResponse)
 def server_dashboard(
     request: Request,
     # user: Optional[dict] = Depends(get_user_for_html), # Removed Auth
-    conn=Depends(get_db),
     page: int = Query(1, ge=1),
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    status: Optional[Literal["Active", "Inactive"]] = None
 ):
     # if not user: return RedirectResponse(url="/") # Removed Auth
 
-    offset = (page - 1) * limit
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    base_query = """
-        FROM agents a INNER JOIN (
-            SELECT hostname, MAX(last_heartbeat) AS max_hb FROM agents GROUP BY hostname
-        ) b ON a.hostname = b.hostname AND a.last_heartbeat = b.max_hb
-    """
-    cur.execute(f"SELECT COUNT(a.agent_uuid) AS total {base_query};")
-    total_records = cur.fetchone()['total']
-    total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
-    cur.execute(f"SELECT a.* {base_query} ORDER BY a.last_heartbeat DESC LIMIT %s OFFSET %s;", (limit, offset))
-    agents = cur.fetchall()
-    cur.execute("SELECT MAX(last_heartbeat) as latest_hb FROM agents;")
-    latest_heartbeat_record = cur.fetchone()
-    latest_heartbeat = latest_heartbeat_record['latest_hb'] if latest_heartbeat_record else None
-    cur.execute("SELECT COUNT(DISTINCT ip_address) as unique_ips FROM agents;")
-    unique_ips = cur.fetchone()['unique_ips']
-    cur.close()
-    now_utc = datetime.now(timezone.utc)
-    for agent in agents:
-        last_hb_aware = agent["last_heartbeat"].replace(tzinfo=timezone.utc)
-        diff = (now_utc - last_hb_aware).total_seconds()
-        agent["status"] = "Active" if diff <= ACTIVE_THRESHOLD_SECONDS else "Inactive"
+    data = cached_server_dashboard(page, limit, status)
+    rows = cached_server_dashboard_rows(page, limit, status)
 
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "server_dashboard.html", {
-            "request": request, "logs": agents, "unique_ips": unique_ips,
-            "latest_download_time": latest_heartbeat.strftime('%Y-%m-%d %H:%M:%S') if latest_heartbeat else "N/A",
-            "current_page": page, "total_pages": total_pages, "limit": limit, "user": None # Set user to None
+            "request": request, "rows_html": rows.html, "page_version": rows.version,
+            "total_records": data["total_records"], "unique_ips": data["unique_ips"],
+            "latest_download_time": data["latest_download_time"],
+            "current_page": page, "total_pages": data["total_pages"], "limit": limit, "user": None # Set user to None
         })
 
 @app.get("/server_dashboard/data", response_class=JSONResponse)
 def server_dashboard_data(
     # user: Optional[dict] = Depends(get_current_user), # Removed Auth
-    conn=Depends(get_db),
     page: int = Query(1, ge=1),
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    status: Optional[Literal["Active", "Inactive"]] = None
 ):
-    offset = (page - 1) * limit
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    base_query = """
-        FROM agents a INNER JOIN (
-            SELECT hostname, MAX(last_heartbeat) AS max_hb FROM agents GROUP BY hostname
-        ) b ON a.hostname = b.hostname AND a.last_heartbeat = b.max_hb
+    data = cached_server_dashboard(page, limit, status)
+
+    return json_response(
+        logs=data["agents_json"],
+        total_downloads=data["total_records"],
+        unique_ips=data["unique_ips"],
+        latest_download_time=data["latest_download_time"],
+        current_page=page,
+        total_pages=data["total_pages"],
+    )
+
+@app.get("/server_dashboard/rows", response_class=HTMLResponse)
+def server_dashboard_rows(
+    request: Request,
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=200),
+    status: Optional[Literal["Active", "Inactive"]] = None,
+    since: Optional[str] = Query(None, max_length=32),
+):
+    """The table's changed <tr>s since page version `since` (every row if unknown), for the page's poll.
+
+    The body starts with a <template> carrying the page version, the row order and the
+    summary cards; 304 when the page is unchanged (ETag is the page version).
     """
-    cur.execute(f"SELECT COUNT(a.agent_uuid) AS total {base_query};")
-    total_records = cur.fetchone()['total']
-    total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
-    cur.execute(f"SELECT a.* {base_query} ORDER BY a.last_heartbeat DESC LIMIT %s OFFSET %s;", (limit, offset))
-    agents = cur.fetchall()
-    cur.execute("SELECT MAX(last_heartbeat) as latest_hb FROM agents;")
-    latest_heartbeat_record = cur.fetchone()
-    latest_heartbeat = latest_heartbeat_record['latest_hb'] if latest_heartbeat_record else None
-    cur.execute("SELECT COUNT(DISTINCT ip_address) as unique_ips FROM agents;")
-    unique_ips = cur.fetchone()['unique_ips']
+    rows = cached_server_dashboard_rows(page, limit, status)
+    etag = f'"{rows.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    data = cached_server_dashboard(page, limit, status)
+    changed = fragment_cache.changed_since(rows, since)
+    if changed is None:
+        changed = rows.rows
+    meta = Markup(
+        '<template data-page-version="{}" data-order="{}" data-total="{}" data-unique-ips="{}" data-latest="{}"></template>'
+    ).format(rows.version, " ".join(rows.order), data["total_records"], data["unique_ips"], data["latest_download_time"])
+    return HTMLResponse(meta + "\n" + Markup("\n").join(html for _, _, html in changed),
+                        headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/agents/outages", response_class=JSONResponse)
+def agent_outages(
+    hours: int = Query(24, ge=1, le=24 * 90),
+    limit: int = Query(500, ge=1, le=5000)
+):
+    """Active -> Inactive periods that started in the last `hours`; back_online is null while still down."""
+    since = utc_now() - timedelta(hours=hours)
+    return run_cached(("agent_outages", hours, limit), ("agents",), AGENT_OUTAGES, {"since": since, "limit": limit})
+
+@app.get("/api/agents/{agent_uuid}/state_changes", response_class=JSONResponse)
+def agent_state_changes(agent_uuid: str, limit: int = Query(100, ge=1, le=1000)):
+    """Most recent status transitions for one agent, newest first."""
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        rows = AGENT_STATE_CHANGES.execute(cur, {"agent_uuid": agent_uuid, "limit": limit}).fetchall()
+        cur.close()
+    return rows
+
+# --------------------------------------------------------------------------------------
+# OPEN PORT ROUTES
+# --------------------------------------------------------------------------------------
+def load_port_summary(limit: int) -> list:
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        rows = PORT_SUMMARY.execute(cur, {"limit": limit}).fetchall()
+        cur.close()
+    for row in rows:
+        row["risky"] = row["port"] in RISKY_PORTS
+    return rows
+
+@app.get("/api/ports", response_class=JSONResponse)
+def port_summary(limit: int = Query(100, ge=1, le=1000)):
+    """Listeners across the fleet: hosts per (port, process), busiest first."""
+    ports = query_cache.get_or_load(("port_summary", limit), ("assets", "agents"), lambda: load_port_summary(limit))
+    return {"ports": ports}
+
+def load_port_hosts(page: int, limit: int, filters: tuple) -> dict:
+    where_clause, params = build_port_filters(*filters)
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(port_hosts_sql(where_clause), {**params, "limit": limit, "offset": (page - 1) * limit})
+        hosts = cur.fetchall()
+        cur.close()
+    total_records = hosts[0]["total"] if hosts else 0
+    for host in hosts:
+        del host["total"]
+    return {"hosts": hosts, "total_pages": math.ceil(total_records / limit) if total_records > 0 else 1}
+
+@app.get("/api/ports/hosts", response_class=JSONResponse)
+def port_hosts(
+    port: Optional[int] = Query(None, ge=0, le=65535),
+    process: Optional[str] = None,
+    wildcard_only: bool = Query(False, description="Only listeners bound to 0.0.0.0 / ::"),
+    is_internet_facing: Optional[bool] = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(100, ge=1, le=500),
+):
+    """Hosts listening on a port and/or process."""
+    if port is None and not process:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Pass a port or a process")
+    filters = (port, process, wildcard_only, is_internet_facing)
+    data = query_cache.get_or_load(
+        ("port_hosts", page, limit, filters), ("assets", "agents"),
+        lambda: load_port_hosts(page, limit, filters),
+    )
+    return {**data, "current_page": page}
+
+def load_port_exposures() -> list:
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        rows = PORT_EXPOSURES.execute(cur, {"ports": list(RISKY_PORTS)}).fetchall()
+        cur.close()
+    for row in rows:
+        row["service"] = RISKY_PORTS[row["port"]]
+    return rows
+
+@app.get("/api/ports/exposures", response_class=JSONResponse)
+def port_exposures():
+    """Internet-facing agents with a risky port listening on every interface."""
+    exposures = query_cache.get_or_load(("port_exposures",), ("assets", "agents"), load_port_exposures)
+    return {
+        "exposures": exposures,
+        "exposed_hosts": len({row["hostname"] for row in exposures}),
+        "risky_ports": RISKY_PORTS,
+    }
+
+# --------------------------------------------------------------------------------------
+# FLEET ANALYTICS
+# --------------------------------------------------------------------------------------
+def bucket_labels(edges: tuple) -> list:
+    """Labels for width_bucket() results 0..len(edges)."""
+    return [f"<{edges[0]}"] + [f"{lo}-{hi}" for lo, hi in zip(edges, edges[1:])] + [f"{edges[-1]}+"]
+
+def load_analytics_summary() -> dict:
+    """All dashboard chart series from two grouped scans (one per table)."""
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        agent_rows = AGENT_ANALYTICS.execute(cur).fetchall()
+        asset_rows = ASSET_ANALYTICS.execute(cur, {
+            "memory_edges": list(MEMORY_BUCKETS_GB), "disk_edges": list(DISK_BUCKETS_GB),
+            "uptime_edges": list(UPTIME_BUCKETS_DAYS),
+        }).fetchall()
+        cur.close()
+
+    agents = {"total": 0, "active": 0, "active_ratio": 0.0,
+              "by_os_name": {}, "by_priority": {}, "by_department": {}, "by_machine_type": {},
+              "by_is_internet_facing": {}}
+    for row in agent_rows:
+        if row["dimension"] == "total":
+            agents["total"], agents["active"] = row["agents"], row["active"]
+            agents["active_ratio"] = round(row["active"] / row["agents"], 4) if row["agents"] else 0.0
+        else:
+            agents[f"by_{row['dimension']}"][row["value"] or "Unknown"] = {"count": row["agents"], "active": row["active"]}
+
+    edges = {"memory_gb": MEMORY_BUCKETS_GB, "disk_gb": DISK_BUCKETS_GB, "uptime_days": UPTIME_BUCKETS_DAYS}
+    histograms = {name: dict.fromkeys(bucket_labels(e) + ["unknown"], 0) for name, e in edges.items()}
+    assets = {"total": 0, "by_os": {}, **histograms}
+    for row in asset_rows:
+        dimension = row["dimension"]
+        if dimension == "total":
+            assets.update({
+                "total": row["assets"],
+                "memory_gb_total": row["memory_gb_sum"], "memory_gb_avg": row["memory_gb_avg"],
+                "disk_gb_total": row["disk_gb_sum"], "disk_gb_avg": row["disk_gb_avg"],
+                "uptime_days_avg": row["uptime_seconds_avg"] / 86400 if row["uptime_seconds_avg"] is not None else None,
+            })
+        elif dimension == "os":
+            assets["by_os"][row["value"] or "Unknown"] = row["assets"]
+        else:
+            label = "unknown" if row["bucket"] is None else bucket_labels(edges[dimension])[row["bucket"]]
+            assets[dimension][label] = row["assets"]
+
+    return {"agents": agents, "assets": assets, "generated_at": datetime.now(timezone.utc).isoformat()}
+
+@app.get("/api/analytics/summary", response_class=JSONResponse)
+def analytics_summary():
+    """Fleet-level aggregates for the dashboard charts, in one request."""
+    # Not tagged for invalidation: heartbeats would evict it constantly; the refresh interval bounds staleness.
+    summary = query_cache.get_or_load(
+        ("analytics_summary",), (), load_analytics_summary, ttl_seconds=ANALYTICS_REFRESH_SECONDS)
+    return {**summary, "refresh_seconds": ANALYTICS_REFRESH_SECONDS}
+
+# --------------------------------------------------------------------------------------
+# VULNERABILITY ROUTES
+# --------------------------------------------------------------------------------------
+def run_cached(key: tuple, tags: tuple, statement, values: dict, one: bool = False):
+    """Execute a prepared read through the query cache."""
+    def load():
+        with db_session() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            statement.execute(cur, values)
+            rows = cur.fetchone() if one else cur.fetchall()
+            cur.close()
+        return rows
+    return query_cache.get_or_load(key, tags, load)
+
+@app.get("/api/vulns", response_class=JSONResponse)
+def vuln_summary(kev_only: bool = False, limit: int = Query(100, ge=1, le=1000)):
+    """CVEs that match at least one host, known-exploited first, then by hosts affected."""
+    vulns = run_cached(("vuln_summary", kev_only, limit), ("vulns", "assets"), VULN_SUMMARY,
+                       {"kev_only": kev_only, "limit": limit})
+    return {"vulnerabilities": vulns}
+
+@app.get("/api/vulns/{cve_id}/hosts", response_class=JSONResponse)
+def vuln_hosts(cve_id: str):
+    cve_id = cve_id.upper()
+    vuln = run_cached(("vuln_detail", cve_id), ("vulns",), VULN_DETAIL, {"cve_id": cve_id}, one=True)
+    if vuln is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{cve_id} is not in the loaded feed")
+    hosts = run_cached(("vuln_hosts", cve_id), ("vulns", "assets"), VULN_HOSTS, {"cve_id": cve_id})
+    return {"vulnerability": vuln, "hosts": hosts}
+
+@app.get("/api/assets/{hostname}/vulns", response_class=JSONResponse)
+def host_vulns(hostname: str):
+    vulns = run_cached(("host_vulns", hostname), ("vulns", "assets"), HOST_VULNS, {"hostname": hostname})
+    return {"hostname": hostname, "vulnerabilities": vulns}
+
+# --------------------------------------------------------------------------------------
+# ASSET HISTORY ROUTES
+# --------------------------------------------------------------------------------------
+@app.get("/api/assets/{hostname}/state", response_class=JSONResponse)
+def asset_state_at(hostname: str, at: Optional[datetime] = None):
+    """The host's inventory as of `at` (UTC, default now), rebuilt from its snapshot chain."""
+    at = utc_naive(at) if at else utc_now()
+    with db_session() as conn:
+        cur = conn.cursor()
+        found = state_at(cur, hostname, at)
+        cur.close()
+    if found is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No history for {hostname} at {at}")
+    taken_at, state = found
+    # A full inventory is thousands of strings: encode with orjson, not jsonable_encoder.
+    return json_response(hostname=hostname, at=at, snapshot_taken_at=taken_at, state=state)
+
+@app.get("/api/assets/{hostname}/history", response_class=JSONResponse)
+def asset_history(
+    hostname: str,
+    days: int = Query(30, ge=1, le=3650),
+    limit: int = Query(200, ge=1, le=5000)
+):
+    """Snapshots stored for the host (metadata only) and the changes they recorded."""
+    since = utc_now() - timedelta(days=days)
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        snapshots = HISTORY_SNAPSHOTS.execute(cur, {"hostname": hostname, "since": since, "limit": limit}).fetchall()
+        changes = HISTORY_CHANGES.execute(cur, {
+            "since": since, "hostname": hostname, "field": None, "item": None, "change": None, "limit": limit,
+        }).fetchall()
+        cur.close()
+    return {"hostname": hostname, "snapshots": snapshots, "changes": changes}
+
+@app.get("/api/history/changes", response_class=JSONResponse)
+def history_changes(
+    days: int = Query(7, ge=1, le=3650),
+    hostname: Optional[str] = None,
+    field: Optional[str] = Query(None, enum=["software", "port", "ip", "memory_gb", "disk_gb", "os_version", "os", "cpu", "username"]),
+    item: Optional[str] = Query(None, description="Package name (lower-case) or port number"),
+    change: Optional[str] = Query(None, enum=["added", "removed", "changed"]),
+    limit: int = Query(500, ge=1, le=5000)
+):
+    """Fleet-wide change feed, e.g. field=software&item=openssh-server&change=added&days=7."""
+    since = utc_now() - timedelta(days=days)
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        rows = HISTORY_CHANGES.execute(cur, {
+            "since": since, "hostname": hostname, "field": field,
+            "item": normalize_product(item) if item and field == "software" else item,
+            "change": change, "limit": limit,
+        }).fetchall()
+        cur.close()
+    return rows
+
+@app.get("/api/vulns/feed", response_class=JSONResponse)
+def vuln_feed_info(conn=Depends(get_db)):
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT source, entries, loaded_at FROM vuln_feed WHERE id = 1;")
+    feed = cur.fetchone()
     cur.close()
-    now_utc = datetime.now(timezone.utc)
-    for agent in agents:
-        agent["last_heartbeat_str"] = agent["last_heartbeat"].strftime('%Y-%m-%d %H:%M:%S')
-        diff = (now_utc - agent["last_heartbeat"].replace(tzinfo=timezone.utc)).total_seconds()
-        agent["status"] = "Active" if diff <= ACTIVE_THRESHOLD_SECONDS else "Inactive"
+    return {"feed": feed, "default_path": VULN_FEED_PATH}
+
+@app.post("/admin/vulns/reload", response_class=JSONResponse)
+def reload_vuln_feed(conn=Depends(get_db)):
+    """Load the offline feed at VULN_FEED_PATH, rematch every host and rescore risk, in one transaction.
+
+    Only the configured file: other files are loaded with `python vulns.py load <file>`.
+    """
+    if not os.path.exists(VULN_FEED_PATH):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Feed file not found (see QS_VULN_FEED)")
+    try:
+        summary = load_feed(conn, VULN_FEED_PATH)
+        cur = conn.cursor()
+        query_cache.notify(cur, "vulns", "assets")
+        conn.commit()
+        cur.close()
+    except (ValueError, KeyError, TypeError) as e:
+        conn.rollback()
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid feed: {e}")
+    print(f"[INFO] Vulnerability feed loaded: {summary}")
+    return summary
+
+@app.post("/admin/agents/dedup", response_class=JSONResponse)
+def run_agent_dedup():
+    """Run a full deduplication pass now instead of waiting for the background job."""
+    if agent_deduplicator is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Deduplicator not running")
+    summary = agent_deduplicator.dedup(full=True)
+    if summary is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A deduplication pass is already running")
+    return summary
 
+@app.get("/api/hosts/{hostname}/agent_history", response_class=JSONResponse)
+def agent_history(hostname: str, limit: int = Query(100, ge=1, le=1000)):
+    """Archived (superseded) agent UUIDs for a host, newest first."""
+    with db_session() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        rows = AGENT_ARCHIVE_FOR_HOST.execute(cur, {"hostname": hostname, "limit": limit}).fetchall()
+        cur.close()
+    return rows
+
+@app.get("/api/cache/stats", response_class=JSONResponse)
+def cache_stats():
+    """Hit/miss counters for the dashboard query cache."""
+    return query_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint. Async on purpose: it must answer even when the threadpool is saturated."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/query_stats", response_class=JSONResponse)
+def query_stats():
+    """Per-statement call counts and timings for the prepared hot-path queries."""
+    return QUERY_STATS.snapshot()
+
+@app.get("/admin/slow_queries", response_class=JSONResponse)
+def slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = Query("total_ms", enum=["total_ms", "max_ms", "avg_ms", "count"])
+):
+    """Top slow statements seen by this worker since start (or the last reset)."""
     return {
-        "logs": agents,
-        "total_downloads": total_records,
-        "unique_ips": unique_ips,
-        "latest_download_time": latest_heartbeat.strftime('%Y-%m-%d %H:%M:%S') if latest_heartbeat else "N/A",
-        "current_page": page,
-        "total_pages": total_pages,
+        "enabled": PROFILER.enabled,
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "log_file": SLOW_QUERY_LOG,
+        "statements": PROFILER.top(limit, order_by),
     }
 
+@app.delete("/admin/slow_queries", response_class=JSONResponse)
+def reset_slow_queries():
+    PROFILER.reset()
+    return {"status": "reset"}
+
 
 # --------------------------------------------------------------------------------------
 # AGENT & ACTION ROUTES
@@ -540,34 +1054,12 @@ def download_file(filename: str, token: str):
         
     return FileResponse(path=filepath, filename=filename, media_type='application/octet-stream')
 
-@app.post("/agent_heartbeat")
-def agent_heartbeat(payload: HeartbeatPayload, request: Request, conn=Depends(get_db)):
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO agents (agent_uuid, hostname, os_name, machine_type, ip_address, last_heartbeat)
-        VALUES (%(uuid)s, %(host)s, %(os)s, %(type)s, %(ip)s, (NOW() at time zone 'utc'))
-        ON CONFLICT (agent_uuid) DO UPDATE SET
-            hostname = EXCLUDED.hostname, os_name = EXCLUDED.os_name, machine_type = EXCLUDED.machine_type,
-            ip_address = EXCLUDED.ip_address, last_heartbeat = (NOW() at time zone 'utc');
-    """, {
-        "uuid": payload.agent_uuid, "host": payload.hostname, "os": payload.os_name,
-        "type": payload.machine_type, "ip": request.client.host
-    })
-    conn.commit()
-    cur.close()
-    return {"status": "heartbeat received"}
-
-@app.post("/agent_assets")
-def agent_assets(payload: AssetPayload, request: Request, conn=Depends(get_db)):
-    flat = flatten_agent_payload(payload)
-    upsert_asset_record(flat, reporter_ip=request.client.host, conn=conn)
-    print(f"[INFO] Asset data stored for {flat.get('hostname')}")
-    return {"status": "asset stored"}
-
 @app.post("/gather_assets")
 def gather_assets(conn=Depends(get_db)): # Removed Auth
     # if not user: return RedirectResponse("/") # Removed Auth
         
+    import requests  # only this route polls agents
+
     count_ok = 0
     for url in agent_ips:
         try:
@@ -585,7 +1077,8 @@ def gather_assets(conn=Depends(get_db)): # Removed Auth
 @app.post("/nmap_scan", response_class=HTMLResponse)
 def nmap_scan(request: Request, subnet: str = Form("192.168.1.0/24"), conn=Depends(get_db)): # Removed Auth
     # if not user: return RedirectResponse("/") # Removed Auth
-        
+    import subprocess
+
     try:
         result = subprocess.check_output(["nmap", "-sn", subnet], stderr=subprocess.STDOUT).decode()
     except (subprocess.CalledProcessError, FileNotFoundError) as e:
@@ -595,5 +1088,5 @@ def nmap_scan(request: Request, subnet: str = Form("192.168.1.0/24"), conn=Depen
     cur.execute("SELECT * FROM assets ORDER BY hostname ASC LIMIT 50 OFFSET 0;")
     assets = cur.fetchall()
     cur.close()
-    return templates.TemplateResponse("dashboard.html", {"request": request, "assets": assets, "scan_result": result, "user": None}) # Set user to None
+    return get_templates().TemplateResponse("dashboard.html", {"request": request, "assets": assets, "scan_result": result, "user": None}) # Set user to None
 
@@ -0,0 +1,238 @@
+"""
+Fleet simulator: how many agents can one server instance handle?
+
+Simulates N agents sending the same payloads as files/*_agent.py (heartbeats
+shaped like send_heartbeat(), asset reports shaped like collect_info()) at
+configurable rates, while dashboard clients poll /server_dashboard/rows (with
+If-None-Match and `since`, so an unchanged page is a 304) and /api/assets the way
+the UI does. Load is open-loop: requests are scheduled on a
+fixed timetable, so a slow server shows up as latency and lag instead of quietly
+lowering the offered rate.
+
+    uvicorn app:app --port 8000
+    python bench/agent_sim.py --agents 2000 --duration 60 --json results.json
+
+Reports p50/p95/p99 latency, throughput and error rate per endpoint, plus the
+peak number of Postgres connections (from pg_stat_activity) while it ran.
+Simulated agents use the "sim-" prefix for agent_uuid, hostname and host_id.
+host_id is fixed per simulated host while agent_uuid is new every run, so a
+repeated run looks like a fleet reinstall and exercises agent deduplication.
+"""
+import argparse
+import heapq
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import requests
+
+from mixed_load import Stats, percentile
+
+SOFTWARE_POOL = [f"pkg-{i:04d} {random.randint(0, 9)}.{random.randint(0, 30)}.{random.randint(0, 99)}" for i in range(8000)]
+PORT_POOL = [
+    (22, "sshd"), (80, "nginx"), (443, "nginx"), (3306, "mysqld"), (5432, "postgres"),
+    (3389, "svchost.exe"), (8080, "java"), (9100, "node_exporter"), (53, "systemd-resolve"),
+]
+
+
+class SimAgent:
+    def __init__(self, index: int, software_count: int):
+        self.agent_uuid = f"sim-{uuid.uuid4()}"
+        self.hostname = f"sim-host-{index:06d}"
+        self.host_id = f"sim-{uuid.uuid5(uuid.NAMESPACE_DNS, self.hostname).hex}"
+        self.os_name = random.choice(["windows", "ubuntu", "mac"])
+        self.software = random.sample(SOFTWARE_POOL, min(software_count, len(SOFTWARE_POOL)))
+        self.ports = random.sample(PORT_POOL, random.randint(1, 5))
+        self.booted_at = time.time() - random.randint(60, 30 * 86400)
+
+    def heartbeat_payload(self) -> dict:
+        # Same keys as send_heartbeat()
+        return {
+            "agent_uuid": self.agent_uuid, "hostname": self.hostname,
+            "os_name": self.os_name, "machine_type": "Virtual", "host_id": self.host_id,
+        }
+
+    def asset_payload(self) -> dict:
+        # Same keys as collect_info()
+        return {
+            "hostname": self.hostname,
+            "username": "sim",
+            "os": {"windows": "Windows", "ubuntu": "Linux", "mac": "Darwin"}[self.os_name],
+            "os_version": "sim-1.0",
+            "cpu": "x86_64",
+            "memory_gb": 16.0,
+            "disk_gb": 512.0,
+            "uptime_seconds": int(time.time() - self.booted_at),
+            "open_ports": [{"port": port, "ip": "0.0.0.0", "process": proc} for port, proc in self.ports],
+            "software": self.software,
+            "ip_addresses": [f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"],
+            "vmware_vms": [],
+            "collected_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class DashboardViewer:
+    """One open server dashboard: a fixed page and the page version it is showing."""
+
+    def __init__(self, pages: int):
+        self.page = random.randint(1, pages)
+        self.version = None
+        self.not_modified = 0
+
+    def poll_headers(self) -> dict:
+        return {"If-None-Match": f'"{self.version}"'} if self.version else {}
+
+
+class ConnectionSampler(threading.Thread):
+    """Samples pg_stat_activity once a second and keeps the peak connection count."""
+
+    def __init__(self, dsn: str, stop: threading.Event):
+        super().__init__(daemon=True)
+        self.dsn = dsn
+        self.stop_event = stop
+        self.samples = []
+        self.error = None
+
+    def run(self):
+        try:
+            conn = psycopg2.connect(self.dsn)
+            conn.autocommit = True
+        except Exception as e:
+            self.error = str(e)
+            return
+        with conn, conn.cursor() as cur:
+            while not self.stop_event.wait(1.0):
+                cur.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database();")
+                self.samples.append(cur.fetchone()[0])
+        conn.close()
+
+
+def run(args):
+    agents = [SimAgent(i, args.software) for i in range(args.agents)]
+    stats = {name: Stats() for name in ("heartbeat", "assets", "server_dashboard", "api_assets")}
+    local = threading.local()
+    lag = Stats()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def fire(kind, agent, scheduled_at):
+        lag.record(max(0.0, time.monotonic() - scheduled_at), True)
+        start = time.perf_counter()
+        try:
+            if kind == "heartbeat":
+                r = session().post(f"{args.url}/agent_heartbeat", json=agent.heartbeat_payload(), timeout=args.timeout)
+            elif kind == "assets":
+                r = session().post(f"{args.url}/agent_assets", json=agent.asset_payload(), timeout=args.timeout)
+            elif kind == "server_dashboard":
+                # Same request as the page's poll in templates/server_dashboard.html.
+                viewer = agent
+                params = {"page": viewer.page, "limit": 50, **({"since": viewer.version} if viewer.version else {})}
+                r = session().get(f"{args.url}/server_dashboard/rows", params=params,
+                                  headers=viewer.poll_headers(), timeout=args.timeout)
+                if r.status_code == 304:
+                    viewer.not_modified += 1
+                elif r.ok:
+                    viewer.version = r.headers.get("ETag", "").strip('"') or None
+            else:
+                r = session().get(f"{args.url}/api/assets?page={random.randint(1, args.pages)}&limit=50", timeout=args.timeout)
+            ok = r.status_code < 400
+        except requests.RequestException:
+            ok = False
+        stats[kind].record(time.perf_counter() - start, ok)
+
+    # (due_time, seq, kind, agent, interval) -- agents start spread across one interval
+    now = time.monotonic()
+    schedule, seq = [], 0
+    for agent in agents:
+        for kind, interval in (("heartbeat", args.heartbeat_interval), ("assets", args.asset_interval)):
+            heapq.heappush(schedule, (now + random.uniform(0, interval), seq, kind, agent, interval))
+            seq += 1
+    viewers = [DashboardViewer(args.pages) for _ in range(args.dashboards)]
+    for viewer in viewers:
+        for kind in ("server_dashboard", "api_assets"):
+            heapq.heappush(schedule, (now + random.uniform(0, args.dashboard_interval), seq, kind, viewer, args.dashboard_interval))
+            seq += 1
+
+    stop = threading.Event()
+    sampler = ConnectionSampler(args.dsn, stop)
+    sampler.start()
+    deadline = now + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        while schedule and schedule[0][0] < deadline:
+            due, _, kind, agent, interval = heapq.heappop(schedule)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, kind, agent, due)
+            heapq.heappush(schedule, (due + interval, seq, kind, agent, interval))
+            seq += 1
+    elapsed = time.monotonic() - now
+    stop.set()
+    sampler.join(timeout=2)
+
+    report = {
+        "url": args.url, "agents": args.agents, "dashboards": args.dashboards,
+        "duration_s": round(elapsed, 1),
+        "endpoints": {},
+        "scheduler_lag_p99_ms": round(percentile(lag.latencies, 99) * 1000, 1),
+        "server_dashboard_not_modified": sum(viewer.not_modified for viewer in viewers),
+        "db_connections_peak": max(sampler.samples) if sampler.samples else None,
+        "db_connections_avg": round(sum(sampler.samples) / len(sampler.samples), 1) if sampler.samples else None,
+    }
+    for name, s in stats.items():
+        n = len(s.latencies)
+        report["endpoints"][name] = {
+            "requests": n,
+            "throughput_rps": round(n / elapsed, 1),
+            "error_rate": round(s.errors / n, 4) if n else 0.0,
+            "p50_ms": round(percentile(s.latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(s.latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(s.latencies, 99) * 1000, 1),
+        }
+    if sampler.error:
+        report["db_connections_error"] = sampler.error
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--dsn", default="dbname=assetdb user=postgres password=root host=localhost port=5432",
+                        help="used only to sample pg_stat_activity")
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--heartbeat-interval", type=float, default=5.0, help="seconds, agents default to 5")
+    parser.add_argument("--asset-interval", type=float, default=300.0, help="seconds, agents default to 3600")
+    parser.add_argument("--software", type=int, default=1500, help="packages per simulated host")
+    parser.add_argument("--dashboards", type=int, default=5, help="concurrent dashboard viewers")
+    parser.add_argument("--dashboard-interval", type=float, default=5.0, help="seconds between polls, the UI uses 5")
+    parser.add_argument("--pages", type=int, default=3, help="dashboard pages viewers spread across")
+    parser.add_argument("--concurrency", type=int, default=200, help="max in-flight requests")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(f"{args.agents} agents, {args.dashboards} dashboard viewers, {report['duration_s']}s against {args.url}")
+    for name, r in report["endpoints"].items():
+        print(f"  {name:<17} {r['requests']:>7} req {r['throughput_rps']:>8.1f} req/s  "
+              f"p50 {r['p50_ms']:>7.1f}  p95 {r['p95_ms']:>7.1f}  p99 {r['p99_ms']:>7.1f} ms  "
+              f"errors {r['error_rate'] * 100:.2f}%")
+    print(f"  server_dashboard polls answered 304: {report['server_dashboard_not_modified']}")
+    print(f"  scheduler lag p99 {report['scheduler_lag_p99_ms']} ms "
+          f"(high values mean the client, not the server, is the bottleneck)")
+    print(f"  db connections peak {report['db_connections_peak']}, avg {report['db_connections_avg']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
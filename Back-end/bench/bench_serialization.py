@@ -0,0 +1,168 @@
+"""
+Serialization micro-benchmarks: agent payloads in, dashboard JSON out.
+
+Times each case in-process (no server, no network), on a synthetic inventory
+shaped like files/*_agent.py's collect_info() with --packages installed packages:
+
+  ingest    an /agent_assets body -> AssetPayload, FastAPI's default path
+            (json.loads, then model_validate), pydantic's model_validate_json,
+            and ingest.parse_payload() (orjson, then model_validate)
+  respond   /api/assets and /server_dashboard/data pages (--rows rows) and a
+            host state with every package: jsonable_encoder + json.dumps (what
+            FastAPI does with a returned dict) against serialization.dumps(),
+            and against splicing rows the cache already holds encoded
+  fetch     with --dsn only: one /api/assets page through RealDictCursor
+            against a plain cursor + fetch_dicts()
+
+    python bench/bench_serialization.py
+    python bench/bench_serialization.py --packages 5000 --rows 200 --json serialization.json
+    python bench/bench_serialization.py --dsn "dbname=assetdb user=postgres password=root host=localhost"
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from ingest import AssetPayload, parse_payload  # noqa: E402
+from serialization import Encoded, dumps, fetch_dicts, json_object  # noqa: E402
+
+
+def inventory(packages: int) -> dict:
+    rng = random.Random(42)
+    return {
+        "hostname": "bench-host-0001", "username": "svc-bench", "os": "Linux",
+        "os_version": "#35~22.04.1-Ubuntu SMP PREEMPT_DYNAMIC", "cpu": "x86_64",
+        "ram": 31.27, "hdd": 1000.2, "uptime_seconds": 864213,
+        "open_ports": [{"port": port, "ip": "0.0.0.0", "process": f"proc-{port}"}
+                       for port in rng.sample(range(1, 65535), 40)],
+        "software": [f"lib{name}-{i:04d} {rng.randint(0, 9)}.{rng.randint(0, 40)}.{rng.randint(0, 99)}-{rng.randint(1, 9)}ubuntu0.22.04.{rng.randint(1, 5)}"
+                     for i, name in enumerate(rng.choice(("ssl", "gtk", "python3", "x11", "gnome")) for _ in range(packages))],
+        "ip_addresses": [f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}" for _ in range(6)],
+        "vmware_vms": [],
+        "collected_at": "2026-01-05 10:00:00",
+    }
+
+
+def asset_rows(count: int) -> list:
+    now = datetime(2026, 1, 5, 10, 0, 0)
+    return [{
+        "hostname": f"host-{i:05d}", "username": "svc", "os": "Linux", "os_version": "6.5.0-35-generic",
+        "cpu": "x86_64", "memory_gb": 31.27, "disk_gb": 1000.2, "uptime_seconds": 864213 + i,
+        "ip_addresses": f"10.0.{i // 250}.{i % 250 + 1}, 172.17.0.1", "collected_at": now - timedelta(seconds=i),
+        "risk": ("High", "Medium", "Low")[i % 3], "risk_score": (i * 7) % 100,
+    } for i in range(count)]
+
+
+def agent_rows(count: int) -> list:
+    now = datetime(2026, 1, 5, 10, 0, 0)
+    return [{
+        "agent_uuid": f"6f1c2a9e-0000-4000-8000-{i:012d}", "hostname": f"host-{i:05d}", "os_name": "ubuntu",
+        "machine_type": "Virtual", "ip_address": f"10.0.{i // 250}.{i % 250 + 1}",
+        "first_seen": now - timedelta(days=30), "last_heartbeat": now - timedelta(seconds=i),
+        "priority": "Medium", "is_internet_facing": bool(i % 5 == 0), "department": "IT", "status": "Active",
+        "last_heartbeat_str": (now - timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+    } for i in range(count)]
+
+
+def fastapi_default(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def timed(fn, number: int, repeat: int) -> float:
+    """Median microseconds per call."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    return statistics.median(samples)
+
+
+def compare(title: str, cases: list, number: int, repeat: int) -> dict:
+    results = {name: round(timed(fn, number, repeat), 1) for name, fn in cases}
+    baseline = results[cases[0][0]]
+    print(f"\n{title}")
+    for name, micros in results.items():
+        print(f"  {name:<32} {micros:>10.1f} us   x{baseline / micros:.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--packages", type=int, default=5000, help="installed packages per inventory")
+    parser.add_argument("--rows", type=int, default=200, help="rows per dashboard page (the API maximum)")
+    parser.add_argument("--number", type=int, default=50, help="calls per timing sample")
+    parser.add_argument("--repeat", type=int, default=7, help="timing samples per case (median reported)")
+    parser.add_argument("--dsn", help="also time row fetching against this database")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    n, r = args.number, args.repeat
+
+    body = json.dumps(inventory(args.packages)).encode()
+    print(f"inventory: {args.packages} packages, {len(body) / 1024:.0f} KiB body; pages of {args.rows} rows")
+    results = {"ingest": compare("ingest: /agent_assets body -> AssetPayload", [
+        ("json.loads + model_validate", lambda: AssetPayload.model_validate(json.loads(body))),
+        ("model_validate_json", lambda: AssetPayload.model_validate_json(body)),
+        ("parse_payload (orjson)", lambda: parse_payload(AssetPayload, body)),
+    ], n, r)}
+
+    assets, agents = asset_rows(args.rows), agent_rows(args.rows)
+    assets_encoded, agents_encoded = Encoded(dumps(assets)), Encoded(dumps(agents))
+    results["api_assets"] = compare("respond: /api/assets page", [
+        ("jsonable_encoder + json.dumps", lambda: fastapi_default({"assets": assets, "current_page": 1, "total_pages": 9})),
+        ("orjson", lambda: json_object(assets=assets, current_page=1, total_pages=9)),
+        ("cached, pre-encoded rows", lambda: json_object(assets=assets_encoded, current_page=1, total_pages=9)),
+    ], n, r)
+    envelope = {"total_downloads": 2000, "unique_ips": 1900, "latest_download_time": "2026-01-05 10:00:00",
+                "current_page": 1, "total_pages": 10}
+    results["server_dashboard_data"] = compare("respond: /server_dashboard/data page", [
+        ("jsonable_encoder + json.dumps", lambda: fastapi_default({"logs": agents, **envelope})),
+        ("orjson", lambda: json_object(logs=agents, **envelope)),
+        ("cached, pre-encoded rows", lambda: json_object(logs=agents_encoded, **envelope)),
+    ], n, r)
+    state = AssetPayload.model_validate_json(body).model_dump()
+    results["host_state"] = compare("respond: host state with every package", [
+        ("jsonable_encoder + json.dumps", lambda: fastapi_default({"hostname": "bench-host-0001", "state": state})),
+        ("orjson", lambda: json_object(hostname="bench-host-0001", state=state)),
+    ], n, r)
+
+    if args.dsn:
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+        conn = psycopg2.connect(args.dsn)
+        sql = """SELECT ast.hostname, ast.username, ast.os, ast.os_version, ast.cpu, ast.memory_gb, ast.disk_gb,
+                        ast.uptime_seconds, ast.ip_addresses, ast.collected_at,
+                        COALESCE(r.level, 'Medium') AS risk, COALESCE(r.score, 0) AS risk_score
+                 FROM assets ast LEFT JOIN asset_risk r ON r.hostname = ast.hostname
+                 ORDER BY ast.hostname LIMIT %s"""
+
+        def fetch(cursor_factory=None):
+            cur = conn.cursor(cursor_factory=cursor_factory)
+            cur.execute(sql, (args.rows,))
+            rows = cur.fetchall() if cursor_factory else fetch_dicts(cur)
+            cur.close()
+            return rows
+
+        results["fetch"] = compare(f"fetch: /api/assets page ({len(fetch())} rows in the database)", [
+            ("RealDictCursor", lambda: fetch(RealDictCursor)),
+            ("tuple cursor + fetch_dicts", fetch),
+        ], max(1, n // 5), r)
+        conn.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Agent software inventory: `dpkg -l` text parsing against reading dpkg's status database.
+
+Builds a synthetic dpkg database with --packages installed packages (stanzas
+shaped like real ones: multi-line descriptions, conffiles, multi-arch libs), or
+uses a real one with --admindir, and times three ways to list it the way
+files/ubuntu_agent.py reports software:
+
+  dpkg -l        what the agent did before: spawn `dpkg -l` and parse its columns
+  status file    ubuntu_agent.read_dpkg_status(): parse the status file in-process
+  cached         ubuntu_agent.get_installed_software() with the database unchanged
+                 since the last report (one stat)
+
+Reports median wall time and CPU time (this process plus children) per listing,
+and checks that all three produce the same list. Needs dpkg-query on PATH.
+
+    python bench/bench_software.py
+    python bench/bench_software.py --packages 8000 --repeat 9
+    python bench/bench_software.py --admindir /var/lib/dpkg
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files")
+
+
+def load_agent():
+    """Import files/ubuntu_agent.py from a scratch directory (it writes agent_uuid.txt on import)."""
+    sys.path.insert(0, FILES_DIR)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            import ubuntu_agent
+        finally:
+            os.chdir(cwd)
+    return ubuntu_agent
+
+
+def write_admindir(packages: int) -> str:
+    rng = random.Random(42)
+    admindir = tempfile.mkdtemp(prefix="qs-dpkg-")
+    os.makedirs(os.path.join(admindir, "info"))
+    open(os.path.join(admindir, "available"), "w").close()
+    stanzas = []
+    for i in range(packages):
+        name = f"lib{rng.choice(('ssl', 'gtk', 'python3', 'x11', 'gnome'))}-{i:05d}"
+        multi_arch = rng.random() < 0.3
+        stanzas.append("\n".join([
+            f"Package: {'dpkg' if i == 0 else name}",
+            f"Status: {'install ok installed' if rng.random() < 0.97 else 'deinstall ok config-files'}",
+            "Priority: optional",
+            "Section: libs",
+            f"Installed-Size: {rng.randint(10, 90000)}",
+            "Maintainer: Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>",
+            f"Architecture: {'amd64' if multi_arch or i == 0 else rng.choice(('amd64', 'all'))}",
+            *(["Multi-Arch: same"] if multi_arch else []),
+            f"Version: {rng.randint(0, 9)}.{rng.randint(0, 40)}.{rng.randint(0, 99)}-{rng.randint(1, 9)}ubuntu0.22.04.{rng.randint(1, 5)}",
+            "Depends: libc6 (>= 2.34), libgcc-s1 (>= 3.0)",
+            "Conffiles:",
+            *[f" /etc/{name}/conf.d/{n}.conf {rng.getrandbits(128):032x}" for n in range(rng.randint(0, 4))],
+            f"Description: synthetic package {i}",
+            *[f" Line {n} of a long description that dpkg keeps for every installed package." for n in range(6)],
+        ]))
+    with open(os.path.join(admindir, "status"), "w") as f:
+        f.write("\n\n".join(stanzas) + "\n")
+    return admindir
+
+
+def dpkg_list(admindir: str) -> list:
+    """The agent's previous collector, pointed at `admindir`."""
+    output = subprocess.check_output(["dpkg-query", f"--admindir={admindir}", "-l"],
+                                     universal_newlines=True, stderr=subprocess.DEVNULL,
+                                     env={**os.environ, "COLUMNS": "200"})
+    software = []
+    for line in output.splitlines()[5:]:
+        parts = line.split()
+        if len(parts) >= 3:
+            software.append(f"{parts[1]} {parts[2]}")
+    return software
+
+
+def cpu_seconds() -> float:
+    """User + system time of this process and its finished children."""
+    return sum(usage.ru_utime + usage.ru_stime for usage in (
+        resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+def timed(fn, repeat: int) -> tuple:
+    """(median wall ms, median CPU ms, last result) over `repeat` calls."""
+    walls, cpus, result = [], [], None
+    for _ in range(repeat):
+        before_cpu, before_wall = cpu_seconds(), time.perf_counter()
+        result = fn()
+        walls.append((time.perf_counter() - before_wall) * 1e3)
+        cpus.append((cpu_seconds() - before_cpu) * 1e3)
+    return statistics.median(walls), statistics.median(cpus), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--packages", type=int, default=5000, help="packages in the synthetic database")
+    parser.add_argument("--admindir", help="use this dpkg database (e.g. /var/lib/dpkg) instead")
+    parser.add_argument("--repeat", type=int, default=7, help="timed listings per case (median reported)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    agent = load_agent()
+    admindir = args.admindir or write_admindir(args.packages)
+    status = os.path.join(admindir, "status")
+    print(f"dpkg database: {status} ({os.path.getsize(status) / 1024:.0f} KiB)")
+
+    agent.DPKG_STATUS = status
+    agent.SNAPD_STATE = os.path.join(admindir, "no-snapd")
+    agent.cached_by_mtime(status, lambda: agent.read_dpkg_status(status))  # warm the cache
+
+    cases = [
+        ("dpkg -l", lambda: dpkg_list(admindir)),
+        ("status file", lambda: agent.read_dpkg_status(status)),
+        ("cached", agent.get_installed_software),
+    ]
+    results, outputs = {}, {}
+    try:
+        for name, fn in cases:
+            wall, cpu, outputs[name] = timed(fn, args.repeat)
+            results[name] = {"wall_ms": round(wall, 2), "cpu_ms": round(cpu, 2), "packages": len(outputs[name])}
+    finally:
+        if not args.admindir:
+            shutil.rmtree(admindir, ignore_errors=True)
+    baseline = results["dpkg -l"]["wall_ms"]
+    for name, result in results.items():
+        print(f"  {name:<12} {result['wall_ms']:>9.2f} ms wall {result['cpu_ms']:>9.2f} ms CPU"
+              f"   x{baseline / max(result['wall_ms'], 1e-3):.0f}   {result['packages']} packages")
+
+    same = outputs["dpkg -l"] == outputs["status file"] == outputs["cached"]
+    print("same list from all three:", same)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
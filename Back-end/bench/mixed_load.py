@@ -0,0 +1,132 @@
+"""
+Mixed heartbeat + dashboard load test.
+
+Runs agent heartbeats and dashboard reads against a running server at the same
+time and reports throughput and latency for each side, so you can compare the
+same workload across two builds (e.g. before and after a change to the data
+access layer):
+
+    uvicorn app:app --port 8000 --workers 1
+    python bench/mixed_load.py --url http://localhost:8000 --duration 30
+
+or against split ingestion and query services:
+
+    uvicorn ingest:create_ingest_app --factory --port 8001 --workers 2
+    QS_ROLE=query uvicorn app:app --port 8000 --workers 2
+    python bench/mixed_load.py --url http://localhost:8000 --ingest-url http://localhost:8001
+
+Responses other than 200 (including 503s from admission control) count as errors.
+
+Heartbeats use synthetic agent UUIDs prefixed with "loadtest-" so they are easy
+to delete afterwards.
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+import requests
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self.lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def summary(self, name, duration):
+        n = len(self.latencies)
+        return (
+            f"{name:<10} {n:>7} req  {n / duration:>8.1f} req/s  "
+            f"p50 {percentile(self.latencies, 50) * 1000:>7.1f} ms  "
+            f"p95 {percentile(self.latencies, 95) * 1000:>7.1f} ms  "
+            f"p99 {percentile(self.latencies, 99) * 1000:>7.1f} ms  "
+            f"mean {(statistics.fmean(self.latencies) if n else 0) * 1000:>7.1f} ms  "
+            f"errors {self.errors}"
+        )
+
+
+def heartbeat_worker(base_url, deadline, stats, agents):
+    session = requests.Session()
+    # Each client cycles through its own agents, so no single agent_uuid exceeds the server's
+    # per-agent heartbeat rate limit.
+    payloads = []
+    for _ in range(agents):
+        agent_uuid = f"loadtest-{uuid.uuid4()}"
+        payloads.append({
+            "agent_uuid": agent_uuid, "hostname": f"loadtest-{agent_uuid[9:17]}",
+            "os_name": "ubuntu", "machine_type": "Virtual",
+        })
+    sent = 0
+    while time.monotonic() < deadline:
+        payload = payloads[sent % agents]
+        sent += 1
+        start = time.perf_counter()
+        try:
+            ok = session.post(f"{base_url}/agent_heartbeat", json=payload, timeout=10).status_code == 200
+        except requests.RequestException:
+            ok = False
+        stats.record(time.perf_counter() - start, ok)
+
+
+def dashboard_worker(base_url, path, deadline, stats):
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            ok = session.get(f"{base_url}{path}", timeout=10).status_code == 200
+        except requests.RequestException:
+            ok = False
+        stats.record(time.perf_counter() - start, ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--ingest-url", help="where heartbeats go (default: --url)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+    parser.add_argument("--heartbeat-clients", type=int, default=32)
+    parser.add_argument("--agents-per-client", type=int, default=1000,
+                        help="agent UUIDs each heartbeat client rotates through")
+    parser.add_argument("--dashboard-clients", type=int, default=8)
+    parser.add_argument("--dashboard-path", default="/server_dashboard/data?page=1&limit=200")
+    args = parser.parse_args()
+
+    heartbeat_stats, dashboard_stats = Stats(), Stats()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=heartbeat_worker, args=(args.ingest_url or args.url, deadline, heartbeat_stats, args.agents_per_client))
+        for _ in range(args.heartbeat_clients)
+    ] + [
+        threading.Thread(target=dashboard_worker, args=(args.url, args.dashboard_path, deadline, dashboard_stats))
+        for _ in range(args.dashboard_clients)
+    ]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    print(f"{args.heartbeat_clients} heartbeat + {args.dashboard_clients} dashboard clients, {elapsed:.1f}s against {args.url}")
+    print(heartbeat_stats.summary("heartbeat", elapsed))
+    print(dashboard_stats.summary("dashboard", elapsed))
+
+
+if __name__ == "__main__":
+    main()
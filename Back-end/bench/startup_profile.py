@@ -0,0 +1,97 @@
+"""
+Startup profile: how long does a new worker take before it can serve?
+
+For each target, runs a fresh interpreter with `python -X importtime` several
+times, then reports the median wall time to import the module and build the
+app, plus the modules with the largest cumulative import time (median across
+runs). No database is needed: lifespan (schema check, pool) is not run.
+
+    python bench/startup_profile.py
+    python bench/startup_profile.py --runs 9 --top 25 --target app:app
+    python bench/startup_profile.py --json startup.json
+
+Targets are "module:attribute"; an attribute ending in "()" is called, as
+uvicorn --factory would.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGETS = ["app:app", "ingest:create_ingest_app()"]
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+PROBE = """
+import importlib, time
+started = time.perf_counter()
+module = importlib.import_module({module!r})
+target = getattr(module, {attr!r})
+if {call!r}:
+    target = target()
+print("QS_STARTUP_SECONDS", time.perf_counter() - started)
+"""
+
+
+def profile_once(target: str) -> tuple:
+    """(seconds to import + build, {module: cumulative microseconds}) for one fresh interpreter."""
+    module, _, attr = target.partition(":")
+    call = attr.endswith("()")
+    code = PROBE.format(module=module, attr=attr.rstrip("()"), call=call)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    seconds = float(next(line.split()[1] for line in result.stdout.splitlines()
+                         if line.startswith("QS_STARTUP_SECONDS")))
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return seconds, cumulative
+
+
+def profile(target: str, runs: int, top: int) -> dict:
+    timings, per_module = [], {}
+    for _ in range(runs):
+        seconds, cumulative = profile_once(target)
+        timings.append(seconds)
+        for name, micros in cumulative.items():
+            per_module.setdefault(name, []).append(micros)
+    medians = {name: statistics.median(values) for name, values in per_module.items()}
+    # Top-level packages only ("fastapi", not "fastapi.routing"), so the list shows what to cut.
+    packages = {name: micros for name, micros in medians.items() if "." not in name}
+    return {
+        "target": target,
+        "runs": runs,
+        "median_seconds": round(statistics.median(timings), 4),
+        "min_seconds": round(min(timings), 4),
+        "modules_imported": len(medians),
+        "top_packages_ms": [(name, round(micros / 1000, 1))
+                            for name, micros in sorted(packages.items(), key=lambda kv: -kv[1])[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", help="module:attribute (repeatable)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = [profile(target, args.runs, args.top) for target in args.target or DEFAULT_TARGETS]
+    for result in results:
+        print(f"\n{result['target']}: median {result['median_seconds']}s, min {result['min_seconds']}s, "
+              f"{result['modules_imported']} modules")
+        for name, ms in result["top_packages_ms"]:
+            print(f"  {ms:>8.1f} ms  {name}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Read-through query cache for the dashboard endpoints.
+
+Entries are keyed by route + query parameters and tagged with the tables they
+were built from ("agents", "assets"). Writers publish the tables they touched
+with ``pg_notify`` inside their transaction; a background LISTEN connection
+evicts the matching entries as soon as the change commits, in every worker.
+The TTL is the upper bound on staleness if a notification is ever missed.
+"""
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+CACHE_CHANNEL = "qs_cache_invalidate"
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry TTL and tag-based invalidation."""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, tags, value)
+        self._generations = {}  # tag -> bumped on every invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, tags, loader, ttl_seconds=None):
+        """Return the cached value for `key`, calling `loader()` on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            generations = tuple(self._generations.get(tag, 0) for tag in tags)
+
+        value = loader()
+
+        with self._lock:
+            # A write landed while we were loading: serve the result but don't keep it.
+            if generations != tuple(self._generations.get(tag, 0) for tag in tags):
+                return value
+            ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+            self._entries[key] = (time.monotonic() + ttl, frozenset(tags), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *tags):
+        """Drop every entry built from any of `tags`."""
+        tags = {tag for tag in tags if tag}
+        if not tags:
+            return
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale = [key for key, entry in self._entries.items() if entry[1] & tags]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            for tag in self._generations:
+                self._generations[tag] += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def notify(self, cur, *tags):
+        """Publish a change to `tags` from inside the writer's transaction.
+
+        The local cache is invalidated immediately so the writer's own next read
+        is fresh; other workers (and this one, again) are invalidated by the
+        NOTIFY, which Postgres only delivers once the transaction commits.
+        """
+        cur.execute("SELECT pg_notify(%s, %s);", (CACHE_CHANNEL, ",".join(tags)))
+        self.invalidate(*tags)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class CacheInvalidationListener(threading.Thread):
+    """Background thread that LISTENs on CACHE_CHANNEL and invalidates `cache`."""
+
+    def __init__(self, cache: QueryCache, db_config: dict, poll_seconds: float = 5.0):
+        super().__init__(name="cache-invalidation-listener", daemon=True)
+        self.cache = cache
+        self.db_config = db_config
+        self.poll_seconds = poll_seconds
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CACHE_CHANNEL};")
+                # Anything could have changed while we weren't listening.
+                self.cache.clear()
+                backoff = 1.0
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], self.poll_seconds) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        self.cache.invalidate(*notification.payload.split(","))
+            except Exception as e:
+                print(f"⚠️ Cache listener error: {e}")
+                self.cache.clear()
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,146 @@
+"""
+Pooled Postgres connections shared by every route.
+
+Routes are plain `def` functions, so FastAPI runs them on its worker threadpool
+and a blocking psycopg2 call never holds up the event loop. The pool bounds how
+many of those threads can be talking to Postgres at once; the rest wait for a
+free connection instead of opening (and tearing down) one per request.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2.extensions import connection as _pg_connection
+from psycopg2.extensions import cursor as _pg_cursor
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+from metrics import record_db_time
+from profiling import PROFILER
+
+
+class _TimedExecute:
+    """Cursor mixin that charges execute() time to the current request's DB time
+    and hands slow statements to the profiler when it is enabled."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            record_db_time(time.perf_counter() - start)
+            raise
+        elapsed = time.perf_counter() - start
+        record_db_time(elapsed)
+        if PROFILER.enabled:
+            PROFILER.observe(self, query, vars, elapsed)
+        return result
+
+
+class TimedCursor(_TimedExecute, _pg_cursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedExecute, RealDictCursor):
+    pass
+
+
+_TIMED_CURSORS = {None: TimedCursor, _pg_cursor: TimedCursor, RealDictCursor: TimedRealDictCursor}
+
+
+class PooledConnection(_pg_connection):
+    """psycopg2 connection that remembers which statements it has PREPAREd
+    and hands out cursors that report their execution time."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        cursor_factory = _TIMED_CURSORS.get(cursor_factory, cursor_factory)
+        return super().cursor(*args, cursor_factory=cursor_factory, **kwargs)
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool that waits for a free connection instead of raising."""
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 10.0, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._waiting_lock = threading.Lock()
+        self.timeout = timeout
+        self.waiting = 0
+        super().__init__(minconn, maxconn, **kwargs)
+
+    def getconn(self, key=None):
+        with self._waiting_lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._waiting_lock:
+                self.waiting -= 1
+        if not acquired:
+            raise PoolError(f"no database connection available after {self.timeout}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        # The base class rolls back any open transaction and drops broken connections.
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    @property
+    def in_use(self) -> int:
+        return len(self._used)
+
+    @property
+    def idle(self) -> int:
+        return len(self._pool)
+
+
+_pool = None
+
+
+def open_pool(db_config: dict, minconn: int, maxconn: int, timeout: float = 10.0):
+    global _pool
+    if _pool is None:
+        _pool = BlockingConnectionPool(
+            minconn, maxconn, timeout=timeout, connection_factory=PooledConnection, **db_config
+        )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def pool_stats():
+    """Connection counts for /metrics, or None before the pool is opened."""
+    if _pool is None:
+        return None
+    return {"in_use": _pool.in_use, "idle": _pool.idle, "waiting": _pool.waiting, "max": _pool.maxconn}
+
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("Database pool is not open; call open_pool() at startup.")
+    return _pool
+
+
+@contextmanager
+def db_session():
+    """Borrow a pooled connection for the duration of the block."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
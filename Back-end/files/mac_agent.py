@@ -1,6 +1,9 @@
 import getpass
+import hashlib
 import os
 import platform
+import plistlib
+import random
 import shutil
 import socket
 import subprocess
@@ -13,9 +16,27 @@ import requests
 
 
 
+def get_host_id():
+    """Stable machine identity: the hardware IOPlatformUUID."""
+    try:
+        output = subprocess.check_output(
+            ["ioreg", "-rd1", "-c", "IOPlatformExpertDevice"], stderr=subprocess.DEVNULL).decode()
+        for line in output.splitlines():
+            if "IOPlatformUUID" in line:
+                return line.split("=", 1)[1].strip().strip('"') or None
+    except Exception:
+        pass
+    return None
+
 # Add this new function near the top of the script
 def get_or_create_agent_uuid():
-    """Gets the agent's unique ID from a file, or creates it if it doesn't exist."""
+    """Gets the agent's unique ID: a random UUID minted once per install and kept in agent_uuid.txt.
+
+    It is deliberately not derived from the host ID: a VM cloned without resetting
+    its machine ID (and keeping its hostname) would otherwise share its twin's
+    identity. The host ID is only reported alongside, as a hint the server uses to
+    spot a reinstall on the same machine.
+    """
     uuid_file = "agent_uuid.txt"
     if os.path.exists(uuid_file):
         with open(uuid_file, "r") as f:
@@ -29,6 +50,7 @@ def get_or_create_agent_uuid():
 
 SERVER_URL = "http://122.173.132.183:8888" # Make sure this IP is correct
 HOSTNAME = socket.gethostname()
+HOST_ID = get_host_id()
 AGENT_UUID = get_or_create_agent_uuid() # This now defines the agent's identity
 
 # --- NEW FUNCTION TO DETECT VM ---
@@ -54,46 +76,102 @@ def get_machine_type():
         pass # Ignore errors if commands fail
     return "Physical"
 
+# --- Installed software: read app bundles' Info.plist directly, re-read only when one changes ---
+APPLICATION_DIRS = ("/Applications", "/System/Applications", os.path.expanduser("~/Applications"))
+APP_SEARCH_DEPTH = 2  # /Applications/Utilities, vendor folders like /Applications/Microsoft Office
+_app_cache = {}  # Info.plist path -> ((mtime_ns, size), "Name version" or None)
+
+def find_app_bundles(root, depth=APP_SEARCH_DEPTH):
+    try:
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.endswith(".app"):
+            yield entry.path
+        elif depth > 1 and entry.is_dir(follow_symlinks=False):
+            yield from find_app_bundles(entry.path, depth - 1)
+
+def read_app_version(bundle):
+    """"Name version" from an app bundle's Info.plist, or None if it has no version."""
+    plist_path = os.path.join(bundle, "Contents", "Info.plist")
+    try:
+        st = os.stat(plist_path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _app_cache.get(plist_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(plist_path, "rb") as f:
+            info = plistlib.load(f)
+        version = info.get("CFBundleShortVersionString") or info.get("CFBundleVersion")
+    except Exception:
+        version = None
+    # Named like system_profiler: the bundle's name without ".app".
+    result = f"{os.path.basename(bundle)[:-4]} {version}".strip() if version else None
+    _app_cache[plist_path] = (stamp, result)
+    return result
+
 def get_installed_software():
     software = []
     try:
         if platform.system() == "Darwin":  # macOS
-            # Get installed applications
-            try:
-                output = subprocess.check_output(
-                    ["system_profiler", "SPApplicationsDataType"],
-                    universal_newlines=True,
-                    stderr=subprocess.DEVNULL
-                )
-                app_name = None
-                for line in output.splitlines():
-                    line = line.strip()
-                    if line.endswith(":") and not line.startswith(" "):
-                        app_name = line[:-1]
-                    elif line.startswith("Version:") and app_name:
-                        version = line.split(":", 1)[1].strip()
-                        software.append(f"{app_name} {version}")
-                        app_name = None
-            except Exception as e:
-                software.append(f"Error reading applications: {e}")
+            # system_profiler SPApplicationsDataType takes tens of seconds; stat + plistlib takes milliseconds.
+            for root in APPLICATION_DIRS:
+                for bundle in find_app_bundles(root):
+                    app = read_app_version(bundle)
+                    if app:
+                        software.append(app)
     except Exception as e:
         software.append(f"Error: {str(e)}")
     return software
 
+def software_stamp():
+    """Every app bundle's path and Info.plist mtime: one stat per app, no plist parsing."""
+    stamps = []
+    for root in APPLICATION_DIRS:
+        for bundle in find_app_bundles(root):
+            try:
+                stamps.append((bundle, os.stat(os.path.join(bundle, "Contents", "Info.plist")).st_mtime_ns))
+            except OSError:
+                stamps.append((bundle, None))
+    return stamps
+
+# --- Listening sockets: filter to listeners first, look up each owning process once ---
+def process_name(pid, names):
+    """Name of `pid`, looked up at most once per collection (`names` is that collection's cache)."""
+    if pid not in names:
+        try:
+            names[pid] = psutil.Process(pid).name() if pid else "Unknown"
+        except psutil.Error:
+            names[pid] = "Unknown"  # exited since the socket table was read
+    return names[pid]
+
 def get_open_ports():
     ports = []
     try:
-        for conn in psutil.net_connections(kind='inet'):
-            if conn.status == psutil.CONN_LISTEN:
-                ports.append({
-                    "port": conn.laddr.port,
-                    "ip": conn.laddr.ip,
-                    "process": psutil.Process(conn.pid).name() if conn.pid else "Unknown"
-                })
+        names = {}
+        # Only TCP sockets listen, so the UDP table isn't fetched at all.
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.status != psutil.CONN_LISTEN:
+                continue
+            ports.append({
+                "port": conn.laddr.port,
+                "ip": conn.laddr.ip,
+                "process": process_name(conn.pid, names)
+            })
     except Exception as e:
         ports.append({"error": str(e)})
     return ports
 
+def listener_changes(previous, current):
+    """(opened, closed) listeners as (port, ip, process) between two get_open_ports() results."""
+    before = {(p["port"], p["ip"], p["process"]) for p in previous if "port" in p}
+    after = {(p["port"], p["ip"], p["process"]) for p in current if "port" in p}
+    return sorted(after - before), sorted(before - after)
+
 def get_vmware_vms():
     vms_info = []
     vmrun_path = shutil.which("vmrun")
@@ -130,16 +208,19 @@ def get_vmware_vms():
 
     return vms_info
 
-def collect_info():
+def get_ip_addresses():
     try:
-        ip_list = [
+        return [
             ni.address
             for ni_list in psutil.net_if_addrs().values()
             for ni in ni_list
             if ni.family.name == 'AF_INET'
         ]
     except Exception:
-        ip_list = []
+        return []
+
+def collect_info():
+    ip_list = get_ip_addresses()
 
     uptime_seconds = int(time.time() - psutil.boot_time())
 
@@ -163,6 +244,15 @@ def collect_info():
     print("[DEBUG] Collected asset data:", data)
     return data
 
+def next_delay(response, interval):
+    """Seconds until the next post: `interval`, or the server's Retry-After when it throttled us."""
+    if response is not None and response.status_code in (429, 503):
+        try:
+            return max(1.0, float(response.headers.get("Retry-After", interval)))
+        except ValueError:
+            pass
+    return interval
+
 # --- UPDATED HEARTBEAT FUNCTION ---
 def send_heartbeat():
     # Determine the os_name just once
@@ -176,12 +266,14 @@ def send_heartbeat():
         os_name = "mac"
 
     while True:
+        r = None
         try:
             machine_type = get_machine_type()
             
             # This payload is now much more robust
             payload = {
                 "agent_uuid": AGENT_UUID,
+                "host_id": HOST_ID,
                 "hostname": HOSTNAME,
                 "os_name": os_name,
                 "machine_type": machine_type
@@ -191,18 +283,73 @@ def send_heartbeat():
             print(f"[{time.strftime('%H:%M:%S')}] Heartbeat: {r.status_code} (UUID: {AGENT_UUID[:8]}...)")
         except Exception as e:
             print(f"Heartbeat error: {e}")
-        time.sleep(5)
+        # Never faster than every 5s; longer if the server asked us to back off.
+        time.sleep(max(5, next_delay(r, 5)))
+
+# --- Asset reporting: "watch" reports as soon as something changed, "interval" every hour ---
+ASSET_REPORT_MODE = os.environ.get("QS_ASSET_MODE", "watch")
+ASSET_REPORT_INTERVAL = 3600  # "interval": seconds between reports
+CHANGE_CHECK_INTERVAL = 60  # "watch": seconds between change checks
+ASSET_MIN_INTERVAL = 300  # "watch": changes within this long of the last report wait for the next one
+ASSET_MAX_INTERVAL = 24 * 3600  # "watch": report at least this often, changed or not
+
+def change_fingerprint():
+    """Cheap signals for what a full asset report would change: packages, listeners, addresses and VMs."""
+    listeners = sorted((p["port"], p["ip"], p["process"]) for p in get_open_ports() if "port" in p)
+    state = (software_stamp(), listeners, sorted(get_ip_addresses()), get_vmware_vms())
+    return hashlib.blake2b(repr(state).encode(), digest_size=16).hexdigest()
+
+def failure_delay(failures):
+    """Seconds before retrying after `failures` failed reports in a row: doubling, capped at ASSET_REPORT_INTERVAL.
+
+    Jittered, so agents that lost the server at the same moment don't all come back at once.
+    """
+    delay = min(ASSET_REPORT_INTERVAL, CHANGE_CHECK_INTERVAL * 2 ** failures)
+    return random.uniform(delay / 2, delay)
 
 def send_assets():
+    watch = ASSET_REPORT_MODE == "watch"
+    failures = 0  # failed reports in a row (errors and non-throttling error responses)
+    reported_ports = None  # open_ports of the last report the server stored
+    reported_fingerprint = None  # change_fingerprint() taken just before that report
+    reported_at = None
     while True:
+        r = None
         try:
+            if watch:
+                fingerprint = change_fingerprint()
+                if reported_at is not None:
+                    since_report = time.monotonic() - reported_at
+                    due = since_report >= ASSET_MAX_INTERVAL or (
+                        fingerprint != reported_fingerprint and since_report >= ASSET_MIN_INTERVAL)
+                    if not due:
+                        time.sleep(CHANGE_CHECK_INTERVAL)
+                        continue
             data = collect_info()
+            if reported_ports is not None:
+                opened, closed = listener_changes(reported_ports, data["open_ports"])
+                if opened or closed:
+                    print(f"[INFO] Listeners since last report: opened {opened}, closed {closed}")
             r = requests.post(f"{SERVER_URL}/agent_assets", json=data, timeout=10)
             print(f"[{time.strftime('%H:%M:%S')}] Asset report: {r.status_code}")
             print("[DEBUG] Server response:", r.text)
+            if r.ok:
+                reported_ports = data["open_ports"]
+                if watch:
+                    reported_fingerprint, reported_at = fingerprint, time.monotonic()
         except Exception as e:
             print(f"Asset report error: {e}")
-        time.sleep(3600)  # every hour
+        interval = CHANGE_CHECK_INTERVAL if watch else ASSET_REPORT_INTERVAL
+        if r is not None and r.status_code in (429, 503):
+            # A throttled report was not stored: retry when told to rather than at the next interval.
+            time.sleep(next_delay(r, interval))
+        elif r is None or not r.ok:
+            # Server or network down: back off instead of re-sending a full report every check.
+            failures += 1
+            time.sleep(failure_delay(failures) if watch else interval)
+        else:
+            failures = 0
+            time.sleep(interval)
 
 if __name__ == "__main__":
     threading.Thread(target=send_heartbeat, daemon=True).start()
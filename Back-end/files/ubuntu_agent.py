@@ -1,9 +1,13 @@
 import getpass
+import hashlib
 import os
 import platform
+import random
+import re
 import shutil
 import socket
 import subprocess
+import sys
 import threading
 import time
 import uuid
@@ -14,9 +18,27 @@ import requests
 
 
 
+def get_host_id():
+    """Stable machine identity: systemd's machine-id, which survives agent reinstalls."""
+    for path in ("/etc/machine-id", "/var/lib/dbus/machine-id"):
+        try:
+            with open(path, "r") as f:
+                machine_id = f.read().strip()
+            if machine_id:
+                return machine_id
+        except OSError:
+            continue
+    return None
+
 # Add this new function near the top of the script
 def get_or_create_agent_uuid():
-    """Gets the agent's unique ID from a file, or creates it if it doesn't exist."""
+    """Gets the agent's unique ID: a random UUID minted once per install and kept in agent_uuid.txt.
+
+    It is deliberately not derived from the host ID: a VM cloned without resetting
+    its machine ID (and keeping its hostname) would otherwise share its twin's
+    identity. The host ID is only reported alongside, as a hint the server uses to
+    spot a reinstall on the same machine.
+    """
     uuid_file = "agent_uuid.txt"
     if os.path.exists(uuid_file):
         with open(uuid_file, "r") as f:
@@ -29,6 +51,7 @@ def get_or_create_agent_uuid():
 
 SERVER_URL = "http://192.168.1.22:8000" # Make sure this IP is correct
 HOSTNAME = socket.gethostname()
+HOST_ID = get_host_id()
 AGENT_UUID = get_or_create_agent_uuid() # This now defines the agent's identity
 
 # --- NEW FUNCTION TO DETECT VM ---
@@ -51,33 +74,95 @@ def get_machine_type():
             pass # Ignore if this command also fails
     return "Physical"
 
+# --- Installed software: read the package databases directly, re-read only when they change ---
+DPKG_STATUS = "/var/lib/dpkg/status"
+SNAPD_STATE = "/var/lib/snapd/state.json"  # rewritten by snapd on every install/refresh/remove
+SNAP_MOUNTS = "/snap"
+_software_cache = {}
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def cached_by_mtime(path, loader):
+    """loader()'s result, called again only once `path` has changed (mtime or size)."""
+    stamp = file_stamp(path)
+    cached = _software_cache.get(path)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1]
+    result = loader()
+    _software_cache[path] = (stamp, result)
+    return result
+
+# Anchored on a literal newline rather than ^ with re.MULTILINE: several times faster on a large file.
+DPKG_FIELD = re.compile(r"\n(Package|Status|Architecture|Multi-Arch|Version):([^\n]*)")
+
+def read_dpkg_status(path=DPKG_STATUS):
+    """"name version" for every package `dpkg -l` lists, parsed from dpkg's status database."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = "\n" + f.read()
+    # One regex pass picks out the few fields needed; "Package:" starts each stanza.
+    stanzas = []
+    for key, value in DPKG_FIELD.findall(text):
+        value = value.strip()
+        if key == "Package":
+            stanzas.append({"Package": value})
+        elif stanzas:
+            stanzas[-1][key] = value
+
+    packages = []
+    native_arch = None
+    for fields in stanzas:
+        want, _, status = (fields.get("Status", "").split() + ["", "", ""])[:3]
+        if status == "not-installed" and want not in ("install", "hold"):
+            continue
+        if fields["Package"] == "dpkg":
+            native_arch = fields.get("Architecture")
+        packages.append((fields["Package"], fields.get("Architecture", ""), fields.get("Multi-Arch", ""),
+                         fields.get("Version") or "<none>"))
+
+    software = []
+    for name, arch, multi_arch, version in sorted(packages):
+        # Same name qualification as dpkg -l: "Multi-Arch: same" and foreign packages get ":arch".
+        if multi_arch == "same" or arch not in ("all", native_arch, ""):
+            name = f"{name}:{arch}"
+        software.append(f"{name} {version}")
+    return software
+
+def read_snaps(root=SNAP_MOUNTS):
+    """"name version" for each installed snap's current revision, as `snap list` shows them."""
+    software = []
+    try:
+        names = sorted(os.listdir(root))
+    except OSError:
+        return software
+    for name in names:
+        try:
+            with open(os.path.join(root, name, "current", "meta", "snap.yaml"), "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith("version:"):
+                        version = line.split(":", 1)[1].strip().strip("'\"")
+                        software.append(f"{name} {version}")
+                        break
+        except OSError:
+            continue  # /snap/bin, or a snap being installed
+    return software
+
 def get_installed_software():
     software = []
     try:
         if platform.system() == "Linux":
-            # Try apt/dpkg first
             try:
-                output = subprocess.check_output(
-                    ["dpkg", "-l"], universal_newlines=True, stderr=subprocess.DEVNULL
-                )
-                for line in output.splitlines()[5:]:
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        name, version = parts[1], parts[2]
-                        software.append(f"{name} {version}")
+                software.extend(cached_by_mtime(DPKG_STATUS, read_dpkg_status))
             except Exception:
                 software.append("Error reading dpkg list")
 
-            # Try snap packages (if installed)
+            # Snap packages (if snapd is installed)
             try:
-                output = subprocess.check_output(
-                    ["snap", "list"], universal_newlines=True, stderr=subprocess.DEVNULL
-                )
-                for line in output.splitlines()[1:]:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        name, version = parts[0], parts[1]
-                        software.append(f"{name} {version}")
+                software.extend(cached_by_mtime(SNAPD_STATE, read_snaps))
             except Exception:
                 pass
 
@@ -85,20 +170,98 @@ def get_installed_software():
         software.append(f"Error: {str(e)}")
     return software
 
+def software_stamp():
+    """Changes whenever dpkg or snapd writes its database, i.e. on any install, upgrade or removal."""
+    return file_stamp(DPKG_STATUS), file_stamp(SNAPD_STATE)
+
+# --- Listening sockets: read the kernel's TCP tables, look up each owning process once ---
+PROC_NET_TCP = ("/proc/net/tcp", "/proc/net/tcp6")
+TCP_LISTEN = "0A"
+_socket_owners = {}  # listening socket inode -> owning pid (None if not visible), kept while the socket exists
+
+def decode_proc_address(hex_addr):
+    """IP from /proc/net/tcp's hex form, where each 32-bit word is in host byte order."""
+    raw = bytes.fromhex(hex_addr)
+    if sys.byteorder == "little":
+        raw = b"".join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw)
+
+def read_tcp_listeners(paths=PROC_NET_TCP):
+    """(ip, port, socket inode) for every listening TCP socket; other states are skipped unparsed."""
+    listeners = []
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                next(f, None)  # header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[3] != TCP_LISTEN:
+                        continue
+                    address, port = fields[1].split(":")
+                    listeners.append((decode_proc_address(address), int(port, 16), int(fields[9])))
+        except OSError:
+            continue  # no IPv6
+    return listeners
+
+def find_socket_owners(inodes):
+    """pid owning each socket inode. Only sockets not seen last time are searched for in /proc/<pid>/fd."""
+    owners = {}
+    for inode in inodes:
+        pid = _socket_owners.get(inode, 0)
+        if pid is None or (pid and os.path.exists(f"/proc/{pid}")):
+            owners[inode] = pid
+    wanted = {f"socket:[{inode}]": inode for inode in inodes if inode not in owners}
+    if wanted:
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            fd_dir = f"/proc/{pid}/fd"
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                continue  # exited, or not ours to look at
+            for fd in fds:
+                try:
+                    inode = wanted.pop(os.readlink(f"{fd_dir}/{fd}"), None)
+                except OSError:
+                    continue
+                if inode is not None:
+                    owners[inode] = int(pid)
+            if not wanted:
+                break
+        for inode in wanted.values():
+            owners[inode] = None  # another namespace or no permission; don't search again
+    _socket_owners.clear()
+    _socket_owners.update(owners)
+    return owners
+
+def process_name(pid, names):
+    """Name of `pid`, looked up at most once per collection (`names` is that collection's cache)."""
+    if pid not in names:
+        try:
+            names[pid] = psutil.Process(pid).name() if pid else "Unknown"
+        except psutil.Error:
+            names[pid] = "Unknown"  # exited since the socket table was read
+    return names[pid]
+
 def get_open_ports():
     ports = []
     try:
-        for conn in psutil.net_connections(kind="inet"):
-            if conn.status == psutil.CONN_LISTEN:
-                ports.append({
-                    "port": conn.laddr.port,
-                    "ip": conn.laddr.ip,
-                    "process": psutil.Process(conn.pid).name() if conn.pid else "Unknown"
-                })
+        listeners = read_tcp_listeners()
+        owners = find_socket_owners({inode for _, _, inode in listeners})
+        names = {}
+        for ip, port, inode in listeners:
+            ports.append({"port": port, "ip": ip, "process": process_name(owners.get(inode), names)})
     except Exception as e:
         ports.append({"error": str(e)})
     return ports
 
+def listener_changes(previous, current):
+    """(opened, closed) listeners as (port, ip, process) between two get_open_ports() results."""
+    before = {(p["port"], p["ip"], p["process"]) for p in previous if "port" in p}
+    after = {(p["port"], p["ip"], p["process"]) for p in current if "port" in p}
+    return sorted(after - before), sorted(before - after)
+
 def get_vmware_vms():
     vms_info = []
     vmrun_path = shutil.which("vmrun")
@@ -127,16 +290,19 @@ def get_vmware_vms():
 
     return vms_info
 
-def collect_info():
+def get_ip_addresses():
     try:
-        ip_list = [
+        return [
             ni.address
             for ni_list in psutil.net_if_addrs().values()
             for ni in ni_list
             if ni.family.name == "AF_INET"
         ]
     except Exception:
-        ip_list = []
+        return []
+
+def collect_info():
+    ip_list = get_ip_addresses()
 
     uptime_seconds = int(time.time() - psutil.boot_time())
 
@@ -160,6 +326,15 @@ def collect_info():
     print("[DEBUG] Collected asset data:", data)
     return data
 
+def next_delay(response, interval):
+    """Seconds until the next post: `interval`, or the server's Retry-After when it throttled us."""
+    if response is not None and response.status_code in (429, 503):
+        try:
+            return max(1.0, float(response.headers.get("Retry-After", interval)))
+        except ValueError:
+            pass
+    return interval
+
 # --- UPDATED HEARTBEAT FUNCTION ---
 def send_heartbeat():
     # Determine the os_name just once
@@ -173,12 +348,14 @@ def send_heartbeat():
         os_name = "mac"
 
     while True:
+        r = None
         try:
             machine_type = get_machine_type()
             
             # This payload is now much more robust
             payload = {
                 "agent_uuid": AGENT_UUID,
+                "host_id": HOST_ID,
                 "hostname": HOSTNAME,
                 "os_name": os_name,
                 "machine_type": machine_type
@@ -188,18 +365,73 @@ def send_heartbeat():
             print(f"[{time.strftime('%H:%M:%S')}] Heartbeat: {r.status_code} (UUID: {AGENT_UUID[:8]}...)")
         except Exception as e:
             print(f"Heartbeat error: {e}")
-        time.sleep(5)
+        # Never faster than every 5s; longer if the server asked us to back off.
+        time.sleep(max(5, next_delay(r, 5)))
+
+# --- Asset reporting: "watch" reports as soon as something changed, "interval" every hour ---
+ASSET_REPORT_MODE = os.environ.get("QS_ASSET_MODE", "watch")
+ASSET_REPORT_INTERVAL = 3600  # "interval": seconds between reports
+CHANGE_CHECK_INTERVAL = 60  # "watch": seconds between change checks
+ASSET_MIN_INTERVAL = 300  # "watch": changes within this long of the last report wait for the next one
+ASSET_MAX_INTERVAL = 24 * 3600  # "watch": report at least this often, changed or not
+
+def change_fingerprint():
+    """Cheap signals for what a full asset report would change: packages, listeners, addresses and VMs."""
+    listeners = sorted((p["port"], p["ip"], p["process"]) for p in get_open_ports() if "port" in p)
+    state = (software_stamp(), listeners, sorted(get_ip_addresses()), get_vmware_vms())
+    return hashlib.blake2b(repr(state).encode(), digest_size=16).hexdigest()
+
+def failure_delay(failures):
+    """Seconds before retrying after `failures` failed reports in a row: doubling, capped at ASSET_REPORT_INTERVAL.
+
+    Jittered, so agents that lost the server at the same moment don't all come back at once.
+    """
+    delay = min(ASSET_REPORT_INTERVAL, CHANGE_CHECK_INTERVAL * 2 ** failures)
+    return random.uniform(delay / 2, delay)
 
 def send_assets():
+    watch = ASSET_REPORT_MODE == "watch"
+    failures = 0  # failed reports in a row (errors and non-throttling error responses)
+    reported_ports = None  # open_ports of the last report the server stored
+    reported_fingerprint = None  # change_fingerprint() taken just before that report
+    reported_at = None
     while True:
+        r = None
         try:
+            if watch:
+                fingerprint = change_fingerprint()
+                if reported_at is not None:
+                    since_report = time.monotonic() - reported_at
+                    due = since_report >= ASSET_MAX_INTERVAL or (
+                        fingerprint != reported_fingerprint and since_report >= ASSET_MIN_INTERVAL)
+                    if not due:
+                        time.sleep(CHANGE_CHECK_INTERVAL)
+                        continue
             data = collect_info()
+            if reported_ports is not None:
+                opened, closed = listener_changes(reported_ports, data["open_ports"])
+                if opened or closed:
+                    print(f"[INFO] Listeners since last report: opened {opened}, closed {closed}")
             r = requests.post(f"{SERVER_URL}/agent_assets", json=data, timeout=10)
             print(f"[{time.strftime('%H:%M:%S')}] Asset report: {r.status_code}")
             print("[DEBUG] Server response:", r.text)
+            if r.ok:
+                reported_ports = data["open_ports"]
+                if watch:
+                    reported_fingerprint, reported_at = fingerprint, time.monotonic()
         except Exception as e:
             print(f"Asset report error: {e}")
-        time.sleep(3600)
+        interval = CHANGE_CHECK_INTERVAL if watch else ASSET_REPORT_INTERVAL
+        if r is not None and r.status_code in (429, 503):
+            # A throttled report was not stored: retry when told to rather than at the next interval.
+            time.sleep(next_delay(r, interval))
+        elif r is None or not r.ok:
+            # Server or network down: back off instead of re-sending a full report every check.
+            failures += 1
+            time.sleep(failure_delay(failures) if watch else interval)
+        else:
+            failures = 0
+            time.sleep(interval)
 
 if __name__ == "__main__":
     threading.Thread(target=send_heartbeat, daemon=True).start()
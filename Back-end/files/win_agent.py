@@ -1,6 +1,8 @@
 import getpass
+import hashlib
 import os
 import platform
+import random
 import shutil
 import socket
 import subprocess
@@ -14,9 +16,28 @@ import requests
 
 
 
+def get_host_id():
+    """Stable machine identity: the MachineGuid Windows generates at install time."""
+    try:
+        import winreg
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Cryptography",
+                             0, winreg.KEY_READ | winreg.KEY_WOW64_64KEY)
+        try:
+            return str(winreg.QueryValueEx(key, "MachineGuid")[0]).strip() or None
+        finally:
+            winreg.CloseKey(key)
+    except Exception:
+        return None
+
 # Add this new function near the top of the script
 def get_or_create_agent_uuid():
-    """Gets the agent's unique ID from a file, or creates it if it doesn't exist."""
+    """Gets the agent's unique ID: a random UUID minted once per install and kept in agent_uuid.txt.
+
+    It is deliberately not derived from the host ID: a VM cloned without resetting
+    its machine ID (and keeping its hostname) would otherwise share its twin's
+    identity. The host ID is only reported alongside, as a hint the server uses to
+    spot a reinstall on the same machine.
+    """
     uuid_file = "agent_uuid.txt"
     if os.path.exists(uuid_file):
         with open(uuid_file, "r") as f:
@@ -30,6 +51,7 @@ def get_or_create_agent_uuid():
 
 SERVER_URL = "http://192.168.1.22:8000" # Make sure this IP is correct
 HOSTNAME = socket.gethostname()
+HOST_ID = get_host_id()
 AGENT_UUID = get_or_create_agent_uuid() # This now defines the agent's identity
 
 
@@ -67,59 +89,101 @@ def get_machine_type():
     # If no VM indicators are found, it's very likely physical
     return "Physical"    
 
+# --- Installed software: the same three uninstall hives Programs and Features reads ---
+UNINSTALL_KEYS = (
+    ("HKEY_LOCAL_MACHINE", r"Software\Microsoft\Windows\CurrentVersion\Uninstall"),
+    ("HKEY_LOCAL_MACHINE", r"Software\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall"),
+    ("HKEY_CURRENT_USER", r"Software\Microsoft\Windows\CurrentVersion\Uninstall"),
+)
+
+def read_uninstall_key(winreg, hive, path):
+    """"DisplayName DisplayVersion" for each entry under one uninstall key that has both."""
+    software = []
+    access = winreg.KEY_READ | winreg.KEY_WOW64_64KEY
+    try:
+        key = winreg.OpenKey(getattr(winreg, hive), path, 0, access)
+    except OSError:
+        return software  # e.g. no Wow6432Node on 32-bit Windows
+    try:
+        for i in range(winreg.QueryInfoKey(key)[0]):
+            try:
+                with winreg.OpenKey(key, winreg.EnumKey(key, i), 0, access) as entry:
+                    name = winreg.QueryValueEx(entry, "DisplayName")[0]
+                    version = winreg.QueryValueEx(entry, "DisplayVersion")[0]
+            except OSError:
+                continue
+            if name and version:
+                software.append(f"{name} {version}".strip())
+    finally:
+        winreg.CloseKey(key)
+    return software
+
 def get_installed_software():
     software = []
     try:
         if platform.system() == "Windows":
-            powershell_script = r"""
-$paths = @(
-    'HKLM:\Software\Microsoft\Windows\CurrentVersion\Uninstall',
-    'HKLM:\Software\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall',
-    'HKCU:\Software\Microsoft\Windows\CurrentVersion\Uninstall'
-)
-foreach ($path in $paths) {
-    try {
-        Get-ChildItem $path | ForEach-Object {
-            try {
-                $item = Get-ItemProperty $_.PSPath
-                if ($item.DisplayName -and $item.DisplayVersion) {
-                    Write-Output "$($item.DisplayName) $($item.DisplayVersion)"
-                }
-            } catch {
-                continue
-            }
-        }
-    } catch {
-        Write-Output "Could not access path: $path"
-    }
-}
-"""
-            output = subprocess.check_output(
-                ["powershell", "-Command", powershell_script],
-                universal_newlines=True,
-                stderr=subprocess.DEVNULL
-            )
-            for line in output.splitlines():
-                if line.strip():
-                    software.append(line.strip())
+            # Read through winreg in-process: no PowerShell start-up, a few ms for thousands of entries.
+            import winreg
+            for hive, path in UNINSTALL_KEYS:
+                software.extend(read_uninstall_key(winreg, hive, path))
     except Exception as e:
         software.append(f"Error: {str(e)}")
     return software
 
+def software_stamp():
+    """Entry count and last-write time of each uninstall key; installs and uninstalls change them.
+
+    An upgrade that only rewrites its own entry's DisplayVersion doesn't, and is picked up
+    by the next report ASSET_MAX_INTERVAL guarantees.
+    """
+    import winreg
+    stamps = []
+    for hive, path in UNINSTALL_KEYS:
+        try:
+            key = winreg.OpenKey(getattr(winreg, hive), path, 0, winreg.KEY_READ | winreg.KEY_WOW64_64KEY)
+        except OSError:
+            stamps.append(None)
+            continue
+        try:
+            subkeys, _, modified = winreg.QueryInfoKey(key)
+            stamps.append((subkeys, modified))
+        finally:
+            winreg.CloseKey(key)
+    return stamps
+
+# --- Listening sockets: filter to listeners first, look up each owning process once ---
+def process_name(pid, names):
+    """Name of `pid`, looked up at most once per collection (`names` is that collection's cache)."""
+    if pid not in names:
+        try:
+            names[pid] = psutil.Process(pid).name() if pid else "Unknown"
+        except psutil.Error:
+            names[pid] = "Unknown"  # exited since the socket table was read
+    return names[pid]
+
 def get_open_ports():
     ports = []
     try:
-        for conn in psutil.net_connections(kind='inet'):
-            if conn.status == psutil.CONN_LISTEN:
-                ports.append({
-                    "port": conn.laddr.port,
-                    "ip": conn.laddr.ip,
-                    "process": psutil.Process(conn.pid).name() if conn.pid else "Unknown"
-                })
+        names = {}
+        # Only TCP sockets listen, so the UDP table isn't fetched at all.
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.status != psutil.CONN_LISTEN:
+                continue
+            ports.append({
+                "port": conn.laddr.port,
+                "ip": conn.laddr.ip,
+                "process": process_name(conn.pid, names)
+            })
     except Exception as e:
         ports.append({"error": str(e)})
     return ports
 
+def listener_changes(previous, current):
+    """(opened, closed) listeners as (port, ip, process) between two get_open_ports() results."""
+    before = {(p["port"], p["ip"], p["process"]) for p in previous if "port" in p}
+    after = {(p["port"], p["ip"], p["process"]) for p in current if "port" in p}
+    return sorted(after - before), sorted(before - after)
+
 def get_vmware_vms():
     vms_info = []
     vmrun_path = shutil.which("vmrun")
@@ -157,16 +221,19 @@ def get_vmware_vms():
 
     return vms_info
 
-def collect_info():
+def get_ip_addresses():
     try:
-        ip_list = [
+        return [
             ni.address
             for ni_list in psutil.net_if_addrs().values()
             for ni in ni_list
             if ni.family.name == 'AF_INET'
         ]
     except Exception:
-        ip_list = []
+        return []
+
+def collect_info():
+    ip_list = get_ip_addresses()
 
     uptime_seconds = int(time.time() - psutil.boot_time())
 
@@ -190,6 +257,15 @@ def collect_info():
     print("[DEBUG] Collected asset data:", data)  # DEBUG LOG
     return data
 
+def next_delay(response, interval):
+    """Seconds until the next post: `interval`, or the server's Retry-After when it throttled us."""
+    if response is not None and response.status_code in (429, 503):
+        try:
+            return max(1.0, float(response.headers.get("Retry-After", interval)))
+        except ValueError:
+            pass
+    return interval
+
 # --- UPDATED HEARTBEAT FUNCTION ---
 def send_heartbeat():
     # Determine the os_name just once
@@ -203,12 +279,14 @@ def send_heartbeat():
         os_name = "mac"
 
     while True:
+        r = None
         try:
             machine_type = get_machine_type()
             
             # This payload is now much more robust
             payload = {
                 "agent_uuid": AGENT_UUID,
+                "host_id": HOST_ID,
                 "hostname": HOSTNAME,
                 "os_name": os_name,
                 "machine_type": machine_type
@@ -218,18 +296,73 @@ def send_heartbeat():
             print(f"[{time.strftime('%H:%M:%S')}] Heartbeat: {r.status_code} (UUID: {AGENT_UUID[:8]}...)")
         except Exception as e:
             print(f"Heartbeat error: {e}")
-        time.sleep(5)
+        # Never faster than every 5s; longer if the server asked us to back off.
+        time.sleep(max(5, next_delay(r, 5)))
+
+# --- Asset reporting: "watch" reports as soon as something changed, "interval" every hour ---
+ASSET_REPORT_MODE = os.environ.get("QS_ASSET_MODE", "watch")
+ASSET_REPORT_INTERVAL = 3600  # "interval": seconds between reports
+CHANGE_CHECK_INTERVAL = 60  # "watch": seconds between change checks
+ASSET_MIN_INTERVAL = 300  # "watch": changes within this long of the last report wait for the next one
+ASSET_MAX_INTERVAL = 24 * 3600  # "watch": report at least this often, changed or not
+
+def change_fingerprint():
+    """Cheap signals for what a full asset report would change: packages, listeners, addresses and VMs."""
+    listeners = sorted((p["port"], p["ip"], p["process"]) for p in get_open_ports() if "port" in p)
+    state = (software_stamp(), listeners, sorted(get_ip_addresses()), get_vmware_vms())
+    return hashlib.blake2b(repr(state).encode(), digest_size=16).hexdigest()
+
+def failure_delay(failures):
+    """Seconds before retrying after `failures` failed reports in a row: doubling, capped at ASSET_REPORT_INTERVAL.
+
+    Jittered, so agents that lost the server at the same moment don't all come back at once.
+    """
+    delay = min(ASSET_REPORT_INTERVAL, CHANGE_CHECK_INTERVAL * 2 ** failures)
+    return random.uniform(delay / 2, delay)
 
 def send_assets():
+    watch = ASSET_REPORT_MODE == "watch"
+    failures = 0  # failed reports in a row (errors and non-throttling error responses)
+    reported_ports = None  # open_ports of the last report the server stored
+    reported_fingerprint = None  # change_fingerprint() taken just before that report
+    reported_at = None
     while True:
+        r = None
         try:
+            if watch:
+                fingerprint = change_fingerprint()
+                if reported_at is not None:
+                    since_report = time.monotonic() - reported_at
+                    due = since_report >= ASSET_MAX_INTERVAL or (
+                        fingerprint != reported_fingerprint and since_report >= ASSET_MIN_INTERVAL)
+                    if not due:
+                        time.sleep(CHANGE_CHECK_INTERVAL)
+                        continue
             data = collect_info()
+            if reported_ports is not None:
+                opened, closed = listener_changes(reported_ports, data["open_ports"])
+                if opened or closed:
+                    print(f"[INFO] Listeners since last report: opened {opened}, closed {closed}")
             r = requests.post(f"{SERVER_URL}/agent_assets", json=data, timeout=10)
             print(f"[{time.strftime('%H:%M:%S')}] Asset report: {r.status_code}")
             print("[DEBUG] Server response:", r.text)
+            if r.ok:
+                reported_ports = data["open_ports"]
+                if watch:
+                    reported_fingerprint, reported_at = fingerprint, time.monotonic()
         except Exception as e:
             print(f"Asset report error: {e}")
-        time.sleep(3600)  # send every hour
+        interval = CHANGE_CHECK_INTERVAL if watch else ASSET_REPORT_INTERVAL
+        if r is not None and r.status_code in (429, 503):
+            # A throttled report was not stored: retry when told to rather than at the next interval.
+            time.sleep(next_delay(r, interval))
+        elif r is None or not r.ok:
+            # Server or network down: back off instead of re-sending a full report every check.
+            failures += 1
+            time.sleep(failure_delay(failures) if watch else interval)
+        else:
+            failures = 0
+            time.sleep(interval)
 
 if __name__ == "__main__":
     threading.Thread(target=send_heartbeat, daemon=True).start()
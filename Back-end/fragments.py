@@ -0,0 +1,91 @@
+"""
+Server-rendered table rows, cached per row and diffed per page.
+
+The HTML dashboards render their tables from one Jinja macro per row
+(templates/_rows.html). Each row's *version* is a short hash of its values; the
+rendered <tr> is cached under (macro, version), so a page is mostly dict lookups
+and a join. Only rows whose data changed since any operator last saw them are
+rendered again.
+
+A page's version is a hash over its rows' ids and versions, the same in every
+worker. It is the ETag of the /server_dashboard/rows fragment endpoint: a poll
+with an unchanged page gets a 304. A poll that names the version it holds gets
+only the rows that differ from it, if this worker still remembers that version,
+and the full table otherwise.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from markupsafe import Markup
+
+
+def row_version(row: dict) -> str:
+    return hashlib.blake2b(repr(tuple(row.values())).encode(), digest_size=8).hexdigest()
+
+
+class RenderedPage:
+    def __init__(self, version: str, rows: list):
+        self.version = version
+        self.rows = rows  # [(row_id, row_version, html)] in display order
+
+    @property
+    def html(self) -> Markup:
+        return Markup("\n").join(html for _, _, html in self.rows)
+
+    @property
+    def order(self) -> list:
+        return [row_id for row_id, _, _ in self.rows]
+
+
+class RowFragmentCache:
+    def __init__(self, max_rows: int = 10_000, max_pages: int = 1024):
+        self.max_rows = max_rows
+        self.max_pages = max_pages
+        self._rows = OrderedDict()  # (macro name, row version) -> Markup
+        self._pages = OrderedDict()  # page version -> {row_id: row version}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render_page(self, macro, rows: list, id_of) -> RenderedPage:
+        """Render `rows` through `macro(row, row_id, version)`, reusing every unchanged row."""
+        rendered = []
+        for row in rows:
+            row_id, version = id_of(row), row_version(row)
+            key = (macro.name, version)
+            with self._lock:
+                html = self._rows.get(key)
+                if html is not None:
+                    self._rows.move_to_end(key)
+                    self.hits += 1
+            if html is None:
+                html = macro(row, row_id, version)
+                with self._lock:
+                    self.misses += 1
+                    self._rows[key] = html
+                    while len(self._rows) > self.max_rows:
+                        self._rows.popitem(last=False)
+            rendered.append((row_id, version, html))
+
+        page_version = hashlib.blake2b(
+            "".join(f"{row_id}:{version};" for row_id, version, _ in rendered).encode(), digest_size=8).hexdigest()
+        with self._lock:
+            self._pages[page_version] = {row_id: version for row_id, version, _ in rendered}
+            self._pages.move_to_end(page_version)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return RenderedPage(page_version, rendered)
+
+    def changed_since(self, page: RenderedPage, since: Optional[str]) -> Optional[list]:
+        """Rows of `page` that differ from page version `since`, or None if `since` is unknown here."""
+        with self._lock:
+            seen = self._pages.get(since) if since else None
+        if seen is None:
+            return None
+        return [row for row in page.rows if seen.get(row[0]) != row[1]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rows": len(self._rows), "pages": len(self._pages), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,205 @@
+"""
+Asset history: what each host looked like over time.
+
+`assets` only holds the latest upload. Every upload is also reduced to a
+canonical state (volatile fields such as uptime and collection time left out)
+and hashed; when the hash differs from the host's previous one a snapshot is
+written to `asset_snapshots`, zlib-compressed:
+
+- a *keyframe* holds the full state,
+- a *delta* holds only what changed since the previous snapshot: scalar fields
+  that were set, and items added to / removed from the list fields.
+
+A keyframe is written every KEYFRAME_EVERY snapshots, or sooner when a delta
+would not be much smaller, so rebuilding any point in time reads one short
+chain. Software, listener and IP changes are also written as rows to
+`asset_changes` so "which hosts got package Y this week" is an index scan.
+The first snapshot of a host records no change rows.
+
+With 20k hosts uploading hourly most uploads change nothing and cost one
+primary-key lookup on `asset_history_heads`.
+"""
+import hashlib
+import json
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from db import db_session
+from queries import (HISTORY_CHAIN_AT, HISTORY_CHANGES_INSERT, HISTORY_HEAD,
+                     HISTORY_PRUNE, HISTORY_SNAPSHOT_INSERT)
+from vulns import split_package
+
+SCALAR_FIELDS = ("username", "os", "os_version", "cpu", "memory_gb", "disk_gb", "vmware_vms")
+LIST_FIELDS = ("software", "ip_addresses", "open_ports")
+KEYFRAME_EVERY = 24
+DELTA_MAX_RATIO = 0.5  # a delta bigger than this share of the full state becomes a keyframe
+COMPRESSION_LEVEL = 6
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+
+
+def _pack(value) -> bytes:
+    return zlib.compress(_dumps(value), COMPRESSION_LEVEL)
+
+
+def _unpack(payload) -> dict:
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def _item_key(item):
+    return tuple(item) if isinstance(item, list) else item
+
+
+def snapshot_state(flat: dict, listeners: list) -> dict:
+    """Canonical, order-independent state for one upload (see flatten_agent_payload)."""
+    state = {field: flat.get(field) for field in SCALAR_FIELDS if field != "vmware_vms"}
+    state["vmware_vms"] = flat.get("vmware_vms_json") or []
+    state["software"] = sorted(set(flat.get("software_list") or []))
+    state["ip_addresses"] = sorted(set(flat.get("ip_inet") or []))
+    state["open_ports"] = sorted([port, ip, process] for port, ip, process in listeners)
+    return state
+
+
+def content_hash(state: dict) -> bytes:
+    return hashlib.blake2b(_dumps(state), digest_size=16).digest()
+
+
+def diff_states(old: dict, new: dict) -> dict:
+    delta = {"set": {}, "add": {}, "del": {}}
+    for field in SCALAR_FIELDS:
+        if old.get(field) != new.get(field):
+            delta["set"][field] = new.get(field)
+    for field in LIST_FIELDS:
+        before = {_item_key(i): i for i in old.get(field) or []}
+        after = {_item_key(i): i for i in new.get(field) or []}
+        added = [after[k] for k in after.keys() - before.keys()]
+        removed = [before[k] for k in before.keys() - after.keys()]
+        if added:
+            delta["add"][field] = sorted(added)
+        if removed:
+            delta["del"][field] = sorted(removed)
+    return delta
+
+
+def apply_delta(state: dict, delta: dict) -> dict:
+    state = dict(state)
+    state.update(delta.get("set", {}))
+    for field in LIST_FIELDS:
+        removed = {_item_key(i) for i in delta.get("del", {}).get(field, [])}
+        items = [i for i in state.get(field) or [] if _item_key(i) not in removed]
+        items.extend(delta.get("add", {}).get(field, []))
+        state[field] = sorted(items)
+    return state
+
+
+def change_rows(delta: dict) -> list:
+    """(field, item, change, detail) rows for asset_changes.
+
+    A package both removed and added (new version) is one "changed" row.
+    """
+    rows = []
+    added = {}
+    for entry in delta["add"].get("software", []):
+        name, version = split_package(entry) or (entry, None)
+        added[name] = version
+    removed = {}
+    for entry in delta["del"].get("software", []):
+        name, version = split_package(entry) or (entry, None)
+        removed[name] = version
+    for name, version in added.items():
+        if name in removed:
+            rows.append(("software", name, "changed", f"{removed[name]} -> {version}"))
+        else:
+            rows.append(("software", name, "added", version))
+    rows.extend(("software", name, "removed", version) for name, version in removed.items() if name not in added)
+    for change, key in (("added", "add"), ("removed", "del")):
+        for port, ip, process in delta[key].get("open_ports", []):
+            rows.append(("port", str(port), change, f"{ip} {process or ''}".strip()))
+        for ip in delta[key].get("ip_addresses", []):
+            rows.append(("ip", ip, change, None))
+    for field in ("memory_gb", "disk_gb", "os_version", "os", "cpu", "username"):
+        if field in delta["set"]:
+            rows.append((field, None, "changed", None if delta["set"][field] is None else str(delta["set"][field])))
+    return rows
+
+
+def record_snapshot(cur, hostname: str, state: dict):
+    """Store `state` for `hostname` if it differs from the last one; returns the snapshot id or None."""
+    digest = content_hash(state)
+    head = HISTORY_HEAD.execute(cur, {"hostname": hostname}).fetchone()
+    if head is not None and bytes(head[0]) == digest:
+        return None
+
+    full = _pack(state)
+    kind, payload, keyframe_id, chain_length, delta = "full", full, None, 0, None
+    if head is not None:
+        _, _, head_keyframe, head_chain, head_state = head
+        delta = diff_states(_unpack(head_state), state)
+        packed = _pack(delta)
+        if head_chain + 1 < KEYFRAME_EVERY and len(packed) <= len(full) * DELTA_MAX_RATIO:
+            kind, payload, keyframe_id, chain_length = "delta", packed, head_keyframe, head_chain + 1
+
+    snapshot_id = HISTORY_SNAPSHOT_INSERT.execute(cur, {
+        "hostname": hostname, "kind": kind, "content_hash": digest, "payload": payload,
+        "keyframe_id": keyframe_id, "chain_length": chain_length, "state": full,
+    }).fetchone()[0]
+    rows = change_rows(delta) if delta is not None else []
+    if rows:
+        HISTORY_CHANGES_INSERT.execute(cur, {
+            "hostname": hostname, "snapshot_id": snapshot_id,
+            "fields": [r[0] for r in rows], "items": [r[1] for r in rows],
+            "changes": [r[2] for r in rows], "details": [r[3] for r in rows],
+        })
+    return snapshot_id
+
+
+def state_at(cur, hostname: str, at: datetime):
+    """(snapshot taken_at, state) as of `at` (UTC), or None if the host has no snapshot by then."""
+    chain = HISTORY_CHAIN_AT.execute(cur, {"hostname": hostname, "at": at}).fetchall()
+    if not chain:
+        return None
+    state, taken_at = None, None
+    for _, taken_at, kind, payload in chain:
+        state = _unpack(payload) if kind == "full" else apply_delta(state, _unpack(payload))
+    return taken_at, state
+
+
+def prune_history(cur, retention_days: int) -> dict:
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    row = HISTORY_PRUNE.execute(cur, {"cutoff": cutoff}).fetchone()
+    return {"snapshots": row[0], "changes": row[1]}
+
+
+class HistoryPruner(threading.Thread):
+    """Drops history older than the retention period (keeping one keyframe per host)."""
+
+    def __init__(self, retention_days: int, interval_seconds: float = 6 * 3600):
+        super().__init__(name="history-pruner", daemon=True)
+        self.retention_days = retention_days
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def prune(self) -> dict:
+        with db_session() as conn:
+            cur = conn.cursor()
+            removed = prune_history(cur, self.retention_days)
+            conn.commit()
+            cur.close()
+        return removed
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                removed = self.prune()
+                if removed["snapshots"] or removed["changes"]:
+                    print(f"[INFO] Pruned {removed['snapshots']} snapshot(s) and {removed['changes']} "
+                          f"change row(s) older than {self.retention_days} days")
+            except Exception as e:
+                print(f"⚠️ History pruner error: {e}")
+            self._stop_event.wait(self.interval_seconds)
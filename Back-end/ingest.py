@@ -0,0 +1,311 @@
+"""
+Agent ingestion: /agent_heartbeat and /agent_assets, as an APIRouter.
+
+app.py includes the router in the full API. For dedicated ingestion workers,
+`create_ingest_app()` builds an app with only these routes, started with
+
+    uvicorn ingest:create_ingest_app --factory --workers 4
+
+It skips the dashboards, templates, exports and admin routes and their
+imports, and runs only the background work ingestion needs (pool, cache
+invalidation listener, agent status sweeper). The periodic jobs (risk sweep,
+UUID dedup, history pruning) stay with the API processes, which then run with
+QS_ROLE=query so people and agents never share a worker, pool or threadpool.
+"""
+import ipaddress
+import math
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import anyio.to_thread
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse
+from psycopg2.extras import Json
+from psycopg2.pool import PoolError
+from pydantic import BaseModel, Field, ValidationError
+
+import admission
+from agent_status import AgentStatusSweeper
+from cache import CacheInvalidationListener
+from db import close_pool, db_session, open_pool, pool_stats
+from history import record_snapshot, snapshot_state
+from metrics import REGISTRY, Gauge, MetricsMiddleware
+from migrations import ensure_schema
+from profiling import PROFILER
+from queries import ASSET_PORTS_SYNC, ASSET_UPSERT, HEARTBEAT_UPSERT
+from ratelimit import ThrottledAgentsCollector, TokenBucketLimiter
+from risk import refresh_risk
+from serialization import loads
+from settings import (ACTIVE_THRESHOLD_SECONDS, ADMISSION_CAPACITY,
+                      ADMISSION_QUEUE_TIMEOUT_SECONDS, ASSET_BURST_PER_HOST,
+                      ASSET_RATE_GLOBAL, ASSET_RATE_PER_HOST, DB_CONFIG,
+                      DB_POOL_MAX, DB_POOL_MIN, DB_POOL_TIMEOUT_SECONDS,
+                      HEARTBEAT_BURST_PER_AGENT, HEARTBEAT_RATE_GLOBAL,
+                      HEARTBEAT_RATE_PER_AGENT, RATE_LIMIT_MAX_KEYS,
+                      SCHEMA_AUTO_MIGRATE, SLOW_QUERY_LOG,
+                      SLOW_QUERY_PROFILING, SLOW_QUERY_THRESHOLD_MS,
+                      STATUS_RECONCILE_SECONDS, THREADPOOL_SIZE, query_cache)
+from vulns import load_index, sync_host_vulns
+
+INGEST_PATHS = ("/agent_heartbeat", "/agent_assets")
+
+router = APIRouter()
+status_sweeper: Optional[AgentStatusSweeper] = None
+
+heartbeat_limiter = TokenBucketLimiter(
+    "/agent_heartbeat", HEARTBEAT_RATE_PER_AGENT, HEARTBEAT_BURST_PER_AGENT,
+    HEARTBEAT_RATE_GLOBAL, HEARTBEAT_RATE_GLOBAL, max_keys=RATE_LIMIT_MAX_KEYS)
+asset_limiter = TokenBucketLimiter(
+    "/agent_assets", ASSET_RATE_PER_HOST, ASSET_BURST_PER_HOST,
+    ASSET_RATE_GLOBAL, ASSET_RATE_GLOBAL, max_keys=RATE_LIMIT_MAX_KEYS)
+
+
+# --------------------------------------------------------------------------------------
+# PROCESS SERVICES (shared by the full API and ingest-only workers)
+# --------------------------------------------------------------------------------------
+def start_core_services(sweep_status: bool = True) -> list:
+    """Schema check, pool, threadpool size, cache listener and (where heartbeats arrive) the
+    status sweeper; returns what stop_core_services() stops. Call from the running event loop."""
+    global status_sweeper
+    schema_version = ensure_schema(DB_CONFIG, auto_migrate=SCHEMA_AUTO_MIGRATE)
+    print(f"✅ Database schema v{schema_version}.")
+    PROFILER.configure(SLOW_QUERY_PROFILING, SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_LOG)
+    open_pool(DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, timeout=DB_POOL_TIMEOUT_SECONDS)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    cache_listener = CacheInvalidationListener(query_cache, DB_CONFIG)
+    cache_listener.start()
+    services = [cache_listener]
+    if sweep_status:
+        status_sweeper = AgentStatusSweeper(query_cache, ACTIVE_THRESHOLD_SECONDS,
+                                            reconcile_seconds=STATUS_RECONCILE_SECONDS)
+        status_sweeper.start()
+        services.append(status_sweeper)
+    return services
+
+def stop_core_services(services: list):
+    for service in reversed(services):
+        service.stop()
+    close_pool()
+
+def get_db():
+    with db_session() as db:
+        yield db
+
+async def db_pool_exhausted(request: Request, exc: PoolError):
+    # Every pooled connection stayed busy for DB_POOL_TIMEOUT_SECONDS.
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": "Database busy, retry shortly"})
+
+def _threadpool_stats():
+    return anyio.to_thread.current_default_thread_limiter().statistics()
+
+REGISTRY.register(Gauge("qs_db_pool_connections_in_use", "Pooled connections checked out.",
+                        lambda: (pool_stats() or {}).get("in_use")))
+REGISTRY.register(Gauge("qs_db_pool_connections_idle", "Pooled connections idle.",
+                        lambda: (pool_stats() or {}).get("idle")))
+REGISTRY.register(Gauge("qs_db_pool_waiting", "Requests waiting for a pooled connection.",
+                        lambda: (pool_stats() or {}).get("waiting")))
+REGISTRY.register(Gauge("qs_threadpool_busy", "Worker threads running sync routes.",
+                        lambda: _threadpool_stats().borrowed_tokens))
+REGISTRY.register(Gauge("qs_threadpool_waiting", "Sync route calls queued for a worker thread.",
+                        lambda: _threadpool_stats().tasks_waiting))
+REGISTRY.register(Gauge("qs_agent_status_pending", "Agents the status sweeper expects a heartbeat from.",
+                        lambda: status_sweeper.pending() if status_sweeper else None))
+REGISTRY.register(Gauge("qs_agent_status_transitions_total", "Active -> Inactive transitions applied by this worker.",
+                        lambda: status_sweeper.transitions if status_sweeper else None, kind="counter"))
+REGISTRY.register(Gauge("qs_cache_hits_total", "Dashboard query cache hits.",
+                        lambda: query_cache.hits, kind="counter"))
+REGISTRY.register(Gauge("qs_cache_misses_total", "Dashboard query cache misses.",
+                        lambda: query_cache.misses, kind="counter"))
+REGISTRY.register(ThrottledAgentsCollector([heartbeat_limiter, asset_limiter]))
+
+
+# --------------------------------------------------------------------------------------
+# PAYLOADS
+# --------------------------------------------------------------------------------------
+class HeartbeatPayload(BaseModel):
+    agent_uuid: str
+    host_id: Optional[str] = None  # machine-id / MachineGuid / IOPlatformUUID; older agents omit it
+    hostname: Optional[str] = None
+    os_name: Optional[str] = None
+    machine_type: Optional[str] = None
+
+class AssetPayload(BaseModel):
+    hostname: Optional[str] = None
+    username: Optional[str] = None
+    os: Optional[str] = None
+    os_version: Optional[str] = None
+    cpu: Optional[str] = None
+    memory_gb: Optional[float] = Field(None, alias='ram', alias_priority=2)
+    disk_gb: Optional[float] = Field(None, alias='hdd', alias_priority=2)
+    uptime_seconds: Optional[int] = 0
+    ip_addresses: Optional[List[str]] = []
+    software: Optional[List[str]] = []
+    open_ports: Optional[list] = []
+    vmware_vms: Optional[list] = []
+
+
+def parse_payload(model, body: bytes):
+    """Decode a raw request body with orjson, then validate it against the model's compiled schema.
+
+    Measured on a 5,000-package upload (bench/bench_serialization.py), FastAPI's default
+    json.loads spends more time than validation does, and pydantic's own JSON parser
+    (model_validate_json) is slower than orjson here. Errors keep FastAPI's 422 shape.
+    """
+    try:
+        data = loads(body)
+    except ValueError as exc:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body", getattr(exc, "pos", 0)),
+                                       "msg": "JSON decode error", "input": {}, "ctx": {"error": str(exc)}}], body=body)
+    try:
+        return model.model_validate(data)
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in exc.errors(include_url=False)], body=body)
+
+async def heartbeat_payload(request: Request) -> HeartbeatPayload:
+    return parse_payload(HeartbeatPayload, await request.body())
+
+async def asset_payload(request: Request) -> AssetPayload:
+    return parse_payload(AssetPayload, await request.body())
+
+def body_schema(model) -> dict:
+    """openapi_extra for routes that read their body through parse_payload()."""
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": model.model_json_schema(by_alias=True)}}}}
+
+
+# --------------------------------------------------------------------------------------
+# HELPERS
+# --------------------------------------------------------------------------------------
+def parse_ip_list(addresses: Optional[List[str]]) -> list:
+    """Keep the addresses that parse as IPs; agents occasionally report junk."""
+    parsed = []
+    for addr in addresses or []:
+        try:
+            parsed.append(str(ipaddress.ip_address(addr.strip())))
+        except ValueError:
+            continue
+    return parsed
+
+def flatten_agent_payload(data: AssetPayload) -> dict:
+    """Normalize the agent JSON into the schema we store in `assets`."""
+    return {
+        "hostname": data.hostname, "username": data.username, "os": data.os,
+        "os_version": data.os_version, "cpu": data.cpu,
+        "memory_gb": data.memory_gb, "disk_gb": data.disk_gb,
+        "uptime_seconds": data.uptime_seconds,
+        "ip_addresses": ", ".join(data.ip_addresses) if data.ip_addresses else None,
+        "ip_inet": parse_ip_list(data.ip_addresses),
+        "software": ", ".join(data.software) if data.software else None,
+        "open_ports_json": data.open_ports, "vmware_vms_json": data.vmware_vms,
+        "software_list": data.software or [],
+    }
+
+def normalize_open_ports(open_ports: Optional[list]) -> list:
+    """(port, ip, process) per distinct listener; drops the agents' {"error": ...} entries."""
+    listeners = {}
+    for entry in open_ports or []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            port = int(entry.get("port"))
+        except (TypeError, ValueError):
+            continue
+        ip = str(entry.get("ip") or "")
+        listeners[(port, ip)] = entry.get("process")
+    return [(port, ip, process) for (port, ip), process in listeners.items()]
+
+def enforce_rate_limit(limiter: TokenBucketLimiter, key: str):
+    """429 before any database work when `key` (or the whole worker) is over its rate."""
+    wait = limiter.check(key)
+    if wait > 0:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded",
+                            headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+def cached_vuln_index(cur):
+    """Product -> version-range index, rebuilt only after a feed reload ("vulns" tag)."""
+    return query_cache.get_or_load(("vuln_index",), ("vulns",), lambda: load_index(cur), ttl_seconds=3600)
+
+def upsert_asset_record(flat: dict, reporter_ip: Optional[str] = None, conn=Depends(get_db)):
+    """Insert/update latest info for a hostname into `assets`."""
+    cur = conn.cursor()
+    ASSET_UPSERT.execute(cur, {
+        "hostname": flat.get("hostname"), "username": flat.get("username"), "os": flat.get("os"),
+        "os_version": flat.get("os_version"), "cpu": flat.get("cpu"), "memory_gb": flat.get("memory_gb"),
+        "disk_gb": flat.get("disk_gb"), "uptime_seconds": flat.get("uptime_seconds"), "ip_addresses": flat.get("ip_addresses"),
+        "ip_inet": flat.get("ip_inet", []), "open_ports": Json(flat.get("open_ports_json", [])), "software": flat.get("software"),
+        "software_list": flat.get("software_list", []), "vmware_vms": Json(flat.get("vmware_vms_json", [])), "ip_reporter": reporter_ip,
+    })
+    listeners = normalize_open_ports(flat.get("open_ports_json"))
+    ASSET_PORTS_SYNC.execute(cur, {
+        "hostname": flat.get("hostname"),
+        "ports": [l[0] for l in listeners], "ips": [l[1] for l in listeners], "processes": [l[2] for l in listeners],
+    })
+    record_snapshot(cur, flat.get("hostname"), snapshot_state(flat, listeners))
+    # Only this host's software changed, so only this host is rematched.
+    sync_host_vulns(cur, flat.get("hostname"), cached_vuln_index(cur).match(flat.get("software_list")))
+    refresh_risk(cur, [flat.get("hostname")])
+    query_cache.notify(cur, "assets")
+    conn.commit()
+    cur.close()
+
+
+# --------------------------------------------------------------------------------------
+# ROUTES
+# --------------------------------------------------------------------------------------
+# The routes borrow a pooled connection only once the rate limit has let the request through.
+@router.post("/agent_heartbeat", openapi_extra=body_schema(HeartbeatPayload))
+def agent_heartbeat(request: Request, payload: HeartbeatPayload = Depends(heartbeat_payload)):
+    enforce_rate_limit(heartbeat_limiter, payload.agent_uuid)
+    with db_session() as conn:
+        cur = conn.cursor()
+        HEARTBEAT_UPSERT.execute(cur, {
+            "uuid": payload.agent_uuid, "host": payload.hostname, "os": payload.os_name,
+            "type": payload.machine_type, "ip": request.client.host, "threshold": ACTIVE_THRESHOLD_SECONDS,
+            "host_id": payload.host_id
+        })
+        if cur.fetchone()[0]:
+            # First heartbeat, changed fields or a return from Inactive: the host's inputs moved.
+            refresh_risk(cur, [payload.hostname])
+            query_cache.notify(cur, "agents")
+        conn.commit()
+        cur.close()
+    if status_sweeper is not None:
+        status_sweeper.expect(payload.agent_uuid)
+    return {"status": "heartbeat received"}
+
+@router.post("/agent_assets", openapi_extra=body_schema(AssetPayload))
+def agent_assets(request: Request, payload: AssetPayload = Depends(asset_payload)):
+    enforce_rate_limit(asset_limiter, payload.hostname or request.client.host)
+    flat = flatten_agent_payload(payload)
+    with db_session() as conn:
+        upsert_asset_record(flat, reporter_ip=request.client.host, conn=conn)
+    print(f"[INFO] Asset data stored for {flat.get('hostname')}")
+    return {"status": "asset stored"}
+
+
+# --------------------------------------------------------------------------------------
+# INGEST-ONLY APP
+# --------------------------------------------------------------------------------------
+@asynccontextmanager
+async def ingest_lifespan(app: FastAPI):
+    print("🚀 Ingest worker starting up...")
+    services = start_core_services()
+    yield
+    print("🛑 Ingest worker shutting down...")
+    stop_core_services(services)
+
+async def ingest_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def create_ingest_app() -> FastAPI:
+    """An app serving only the agent ingestion routes (plus /metrics); no OpenAPI docs."""
+    app = FastAPI(lifespan=ingest_lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+    admission.configure(ADMISSION_CAPACITY, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+    app.add_middleware(admission.AdmissionMiddleware)
+    app.add_middleware(MetricsMiddleware, ingest_paths=INGEST_PATHS)
+    app.add_exception_handler(PoolError, db_pool_exhausted)
+    app.include_router(router)
+    app.add_api_route("/metrics", ingest_metrics, methods=["GET"], response_class=PlainTextResponse)
+    return app
@@ -0,0 +1,208 @@
+"""
+In-process request metrics with a Prometheus text exposition.
+
+`MetricsMiddleware` times every HTTP request and splits it into time spent in
+Postgres (accumulated by the pooled cursors in db.py via `record_db_time`) and
+everything else. Collectors are plain dicts behind one lock per metric, so
+recording an observation costs a bisect and a few additions.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Per-request accumulator for database time. The middleware binds a fresh
+# one-element list; threadpool workers inherit a copy of the context that still
+# points at the same list, so their additions are visible to the middleware.
+_db_time = contextvars.ContextVar("qs_db_time", default=None)
+
+
+def record_db_time(seconds: float):
+    acc = _db_time.get()
+    if acc is not None:
+        acc[0] += seconds
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values) -> str:
+    """`{name="value",...}` for one sample line; also used by collectors defined elsewhere."""
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """A value read from `callback()` at scrape time, or inc'd/dec'd directly.
+
+    Pass kind="counter" to expose a callback that reads a monotonic total kept elsewhere.
+    """
+
+    def __init__(self, name: str, help_text: str, callback=None, kind: str = "gauge"):
+        self.name, self.help, self.callback, self.kind = name, help_text, callback, kind
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def render(self):
+        value = self.callback() if self.callback is not None else self.value
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                yield f"{self.name}_bucket{format_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {_format_value(series[-1])}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._collectors = []
+
+    def register(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines = []
+        for collector in self._collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "qs_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "qs_http_request_duration_seconds", "Total request latency.", LATENCY_BUCKETS, ("route", "method")))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "qs_http_request_db_seconds", "Time per request spent executing SQL.", LATENCY_BUCKETS, ("route",)))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "qs_http_request_handler_seconds", "Time per request outside of SQL (validation, Python, rendering).",
+    LATENCY_BUCKETS, ("route",)))
+REQUEST_BYTES = REGISTRY.register(Histogram(
+    "qs_http_request_size_bytes", "Request body size.", SIZE_BUCKETS, ("route",)))
+RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "qs_http_response_size_bytes", "Response body size.", SIZE_BUCKETS, ("route",)))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "qs_http_requests_in_flight", "Requests currently being served."))
+INGEST_IN_FLIGHT = REGISTRY.register(Gauge(
+    "qs_ingest_requests_in_flight", "Agent ingestion requests accepted but not yet answered (queue depth)."))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency, DB time and payload sizes."""
+
+    def __init__(self, app, ingest_paths=()):
+        self.app = app
+        self.ingest_paths = frozenset(ingest_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        db_time = [0.0]
+        token = _db_time.set(db_time)
+        response = {"status": 500, "bytes": 0}
+        is_ingest = scope["path"] in self.ingest_paths
+        IN_FLIGHT.inc()
+        if is_ingest:
+            INGEST_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _db_time.reset(token)
+            IN_FLIGHT.dec()
+            if is_ingest:
+                INGEST_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # Label by route template, not raw path, to keep cardinality bounded.
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            REQUESTS.inc((path, method, str(response["status"])))
+            REQUEST_SECONDS.observe((path, method), elapsed)
+            DB_SECONDS.observe((path,), db_time[0])
+            HANDLER_SECONDS.observe((path,), max(0.0, elapsed - db_time[0]))
+            RESPONSE_BYTES.observe((path,), response["bytes"])
+            for name, value in scope.get("headers", ()):
+                if name == b"content-length":
+                    REQUEST_BYTES.observe((path,), int(value))
+                    break
@@ -0,0 +1,361 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and is recorded in
+`schema_version`. Startup only compares `MAX(version)` with LATEST_VERSION, so
+a rolling restart takes no DDL locks on the live tables. Apply migrations
+ahead of a deploy with:
+
+    python migrations.py migrate
+    python migrations.py status
+
+or let the first worker apply them at startup (QS_AUTO_MIGRATE, on by
+default); an advisory lock makes the other workers wait and then find
+nothing to do. DDL runs with a short lock_timeout so a migration that cannot
+get its lock on `agents` gives up (and is retried) instead of queueing every
+heartbeat behind it.
+
+Migrations 1-9 use IF NOT EXISTS throughout, so databases created by the old
+boot-time init_db() pick them up without changes. New migrations go at the
+end of MIGRATIONS with the next version number; never edit an applied one.
+Migrations are frozen: they spell out their SQL and constants rather than
+importing them from queries.py or calling application code, so a later change
+there cannot alter what an old migration does.
+"""
+import argparse
+import ipaddress
+import sys
+import time
+
+import psycopg2
+
+MIGRATION_LOCK_KEY = 0x51_534D_4947  # pg_advisory_lock key shared by all workers
+LOCK_TIMEOUT = "5s"
+LOCK_RETRIES = 5
+
+
+def _baseline(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS agents (
+            agent_uuid TEXT PRIMARY KEY, hostname TEXT, os_name TEXT,
+            machine_type TEXT, ip_address TEXT, first_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+            last_heartbeat TIMESTAMP NOT NULL
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS assets (
+            hostname TEXT PRIMARY KEY, username TEXT, os TEXT, os_version TEXT,
+            cpu TEXT, memory_gb DOUBLE PRECISION, disk_gb DOUBLE PRECISION,
+            uptime_seconds BIGINT, ip_addresses TEXT, open_ports JSONB,
+            software TEXT, vmware_vms JSONB, ip_reporter TEXT, collected_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("""
+        ALTER TABLE agents
+            ADD COLUMN IF NOT EXISTS priority TEXT NOT NULL DEFAULT 'Medium',
+            ADD COLUMN IF NOT EXISTS is_internet_facing BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS department TEXT NOT NULL DEFAULT 'Unassigned';
+    """)
+
+
+def _asset_search(cur):
+    # inet[] copy of ip_addresses plus the indexes behind the /api/assets filters.
+    cur.execute("ALTER TABLE assets ADD COLUMN IF NOT EXISTS ip_inet INET[];")
+    # Backfill in Python so a malformed stored address is skipped rather than failing the cast.
+    cur.execute("SELECT hostname, ip_addresses FROM assets WHERE ip_inet IS NULL AND ip_addresses IS NOT NULL;")
+    for hostname, ip_addresses in cur.fetchall():
+        parsed = []
+        for addr in ip_addresses.split(","):
+            try:
+                parsed.append(str(ipaddress.ip_address(addr.strip())))
+            except ValueError:
+                continue
+        cur.execute("UPDATE assets SET ip_inet = %s::text[]::inet[] WHERE hostname = %s;", (parsed, hostname))
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assets_ip_inet ON assets USING GIN (ip_inet);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assets_os_lower ON assets (lower(os));")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assets_username_lower ON assets (lower(username));")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_hostname_hb ON agents (hostname, last_heartbeat DESC);")
+
+
+def _trigram_search(cur):
+    # Needs the pg_trgm contrib extension; without it `q` still works, just by sequential scan.
+    cur.execute("SAVEPOINT trgm;")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        # Must stay identical to queries.asset_search_expr() for the planner to use it.
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_assets_search_trgm
+            ON assets USING GIN ((
+                COALESCE(hostname, '') || ' ' || COALESCE(username, '') || ' ' || COALESCE(os, '')
+                || ' ' || COALESCE(os_version, '') || ' ' || COALESCE(ip_addresses, '')
+            ) gin_trgm_ops);
+        """)
+        cur.execute("RELEASE SAVEPOINT trgm;")
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT trgm;")
+        print(f"⚠️ Trigram search index not available, skipped: {e}")
+
+
+def _open_ports(cur):
+    # Normalized copy of assets.open_ports so "who listens on 3389" is an index lookup.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asset_ports (
+            hostname TEXT NOT NULL REFERENCES assets(hostname) ON DELETE CASCADE,
+            port INTEGER NOT NULL, ip TEXT NOT NULL, process TEXT,
+            wildcard BOOLEAN GENERATED ALWAYS AS (ip IN ('0.0.0.0', '::', '*')) STORED,
+            PRIMARY KEY (hostname, port, ip)
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_ports_port ON asset_ports (port, hostname);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_ports_wildcard ON asset_ports (port) WHERE wildcard;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_ports_process ON asset_ports (lower(process));")
+    # Backfill from the JSONB column for hosts reported before the table existed.
+    cur.execute("""
+        INSERT INTO asset_ports (hostname, port, ip, process)
+        SELECT a.hostname, (p->>'port')::int, COALESCE(p->>'ip', ''), p->>'process'
+        FROM assets a, jsonb_array_elements(a.open_ports) AS p
+        WHERE jsonb_typeof(a.open_ports) = 'array' AND (p->>'port') ~ '^[0-9]+$'
+          AND NOT EXISTS (SELECT 1 FROM asset_ports)
+        ON CONFLICT DO NOTHING;
+    """)
+
+
+def _vulnerabilities(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vulnerabilities (
+            cve_id TEXT PRIMARY KEY, vendor TEXT, product TEXT, name TEXT,
+            severity TEXT NOT NULL DEFAULT 'unknown', is_kev BOOLEAN NOT NULL DEFAULT FALSE,
+            date_added DATE, description TEXT, affected JSONB
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asset_vulns (
+            hostname TEXT NOT NULL REFERENCES assets(hostname) ON DELETE CASCADE,
+            cve_id TEXT NOT NULL REFERENCES vulnerabilities(cve_id) ON DELETE CASCADE,
+            package TEXT NOT NULL, version TEXT,
+            PRIMARY KEY (hostname, cve_id, package)
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_vulns_cve ON asset_vulns (cve_id, hostname);")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vuln_feed (
+            id INTEGER PRIMARY KEY CHECK (id = 1), source TEXT, entries INTEGER, loaded_at TIMESTAMP
+        );
+    """)
+
+
+def _risk_scores(cur):
+    # Materialized per-host scores (see risk.py), kept current by the write paths. Existing
+    # hosts are scored by the running app (RiskSweeper's first pass), not here.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asset_risk (
+            hostname TEXT PRIMARY KEY, score INTEGER NOT NULL, level TEXT NOT NULL,
+            factors JSONB NOT NULL DEFAULT '{}'::jsonb,
+            stale_heartbeat BOOLEAN NOT NULL DEFAULT FALSE, stale_inventory BOOLEAN NOT NULL DEFAULT FALSE,
+            computed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_risk_score ON asset_risk (score DESC, hostname);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_risk_level ON asset_risk (level);")
+
+
+def _agent_status(cur):
+    # Persisted Active/Inactive plus a log of every transition (see agent_status.py).
+    cur.execute("""
+        ALTER TABLE agents
+            ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'Inactive',
+            ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_status ON agents (status, last_heartbeat DESC);")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS agent_state_changes (
+            id BIGSERIAL PRIMARY KEY, agent_uuid TEXT NOT NULL, hostname TEXT,
+            from_status TEXT, to_status TEXT NOT NULL, changed_at TIMESTAMP NOT NULL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_state_changes_agent ON agent_state_changes (agent_uuid, changed_at DESC);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_state_changes_time ON agent_state_changes (changed_at);")
+
+
+def _agent_identity(cur):
+    # host_id is the machine's own stable ID as reported by the agent; rows superseded by a
+    # newer agent_uuid on the same machine are moved to agents_archive (see agent_dedup.py).
+    cur.execute("ALTER TABLE agents ADD COLUMN IF NOT EXISTS host_id TEXT;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_host_id ON agents (host_id) WHERE host_id IS NOT NULL;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_first_seen ON agents (first_seen);")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS agents_archive (
+            agent_uuid TEXT PRIMARY KEY, hostname TEXT, host_id TEXT, os_name TEXT, machine_type TEXT,
+            ip_address TEXT, first_seen TIMESTAMP, last_heartbeat TIMESTAMP, priority TEXT,
+            department TEXT, is_internet_facing BOOLEAN, superseded_by TEXT,
+            archived_at TIMESTAMP NOT NULL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_agents_archive_hostname ON agents_archive (hostname, last_heartbeat DESC);")
+
+
+def _asset_history(cur):
+    # Compressed keyframe/delta snapshots per content change, plus queryable change rows (see history.py).
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asset_snapshots (
+            id BIGSERIAL PRIMARY KEY, hostname TEXT NOT NULL, taken_at TIMESTAMP NOT NULL,
+            kind TEXT NOT NULL, keyframe_id BIGINT NOT NULL, content_hash BYTEA NOT NULL, payload BYTEA NOT NULL
+        );
+    """)
+    # Payloads are zlib-compressed already; don't let TOAST try again.
+    cur.execute("ALTER TABLE asset_snapshots ALTER COLUMN payload SET STORAGE EXTERNAL;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_snapshots_host_time ON asset_snapshots (hostname, taken_at DESC);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_snapshots_chain ON asset_snapshots (keyframe_id, id);")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asset_history_heads (
+            hostname TEXT PRIMARY KEY, content_hash BYTEA NOT NULL, snapshot_id BIGINT NOT NULL,
+            keyframe_id BIGINT NOT NULL, chain_length INTEGER NOT NULL, state BYTEA NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        );
+    """)
+    cur.execute("ALTER TABLE asset_history_heads ALTER COLUMN state SET STORAGE EXTERNAL;")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS asset_changes (
+            id BIGSERIAL PRIMARY KEY, hostname TEXT NOT NULL, snapshot_id BIGINT NOT NULL,
+            changed_at TIMESTAMP NOT NULL, field TEXT NOT NULL, item TEXT, change TEXT NOT NULL, detail TEXT
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_changes_item ON asset_changes (field, item, changed_at DESC);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_changes_host ON asset_changes (hostname, changed_at DESC);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_changes_time ON asset_changes (changed_at);")
+
+
+def _software_list(cur):
+    # The agent's package list as reported, so the export can unnest it without re-splitting `software`.
+    cur.execute("ALTER TABLE assets ADD COLUMN IF NOT EXISTS software_list TEXT[];")
+    # Rows stored before this column only have the joined string; split it the way it was joined.
+    cur.execute("""
+        UPDATE assets SET software_list = string_to_array(software, ', ')
+        WHERE software_list IS NULL AND software IS NOT NULL;
+    """)
+
+
+# (version, description, function). Append only.
+MIGRATIONS = [
+    (1, "agents and assets tables, classification columns", _baseline),
+    (2, "asset search: ip_inet column and filter indexes", _asset_search),
+    (3, "asset search: trigram index (optional pg_trgm)", _trigram_search),
+    (4, "asset_ports listener index", _open_ports),
+    (5, "vulnerability feed tables", _vulnerabilities),
+    (6, "asset_risk scores", _risk_scores),
+    (7, "agent status column and state change log", _agent_status),
+    (8, "agent host_id and agents_archive", _agent_identity),
+    (9, "asset history snapshots and change log", _asset_history),
+    (10, "assets.software_list array", _software_list),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cur) -> int:
+    """Highest applied version; 0 for a database that predates schema_version."""
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cur.fetchone()[0]
+
+
+def migrate(conn, target: int = LATEST_VERSION) -> list:
+    """Apply every pending migration up to `target`; returns the versions applied."""
+    applied = []
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+    conn.commit()
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        """)
+        conn.commit()
+        done = current_version(cur)
+        for version, description, step in MIGRATIONS:
+            if version <= done or version > target:
+                continue
+            _apply(conn, cur, version, description, step)
+            applied.append(version)
+    finally:
+        conn.rollback()
+        cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        cur.close()
+    return applied
+
+
+def _apply(conn, cur, version: int, description: str, step):
+    for attempt in range(1, LOCK_RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';")
+            step(cur)
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s);", (version, description))
+            conn.commit()
+            print(f"✅ Migration {version} applied: {description} ({time.perf_counter() - started:.2f}s)")
+            return
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            if attempt == LOCK_RETRIES:
+                raise
+            print(f"⚠️ Migration {version} could not get its locks, retrying ({attempt}/{LOCK_RETRIES})")
+            time.sleep(attempt)
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def ensure_schema(db_config: dict, auto_migrate: bool = True) -> int:
+    """Startup check: one query when the schema is current, migrations only if allowed and needed."""
+    conn = psycopg2.connect(**db_config)
+    try:
+        cur = conn.cursor()
+        version = current_version(cur)
+        conn.commit()
+        cur.close()
+        if version > LATEST_VERSION:
+            print(f"⚠️ Database schema v{version} is newer than this build (v{LATEST_VERSION}); continuing.")
+        elif version < LATEST_VERSION:
+            if not auto_migrate:
+                raise RuntimeError(f"Database schema is v{version}, this build needs v{LATEST_VERSION}: "
+                                   "run `python migrations.py migrate`.")
+            migrate(conn)
+            version = LATEST_VERSION
+    finally:
+        conn.close()
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("migrate", help="apply pending migrations")
+    up.add_argument("--to", type=int, default=LATEST_VERSION, help="stop after this version")
+    sub.add_parser("status", help="show applied and pending migrations")
+    args = parser.parse_args()
+
+    from settings import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.command == "migrate":
+            applied = migrate(conn, args.to)
+            print(f"✅ Applied {len(applied)} migration(s)" if applied else "✅ Schema already up to date")
+        else:
+            cur = conn.cursor()
+            version = current_version(cur)
+            cur.close()
+            for number, description, _ in MIGRATIONS:
+                print(f"{'applied' if number <= version else 'pending'}  {number:>3}  {description}")
+    except Exception as e:
+        print(f"⚠️ Migration failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Opt-in slow-query profiler for the pooled cursors.
+
+When enabled, every statement slower than the threshold is logged to a rotating
+JSON-lines file with its parameters, duration and plan, and aggregated in memory
+by statement so `/admin/slow_queries` can list the worst offenders. Read-only
+statements get `EXPLAIN (ANALYZE, BUFFERS)`; writes only get a plain `EXPLAIN`
+so profiling never re-applies an upsert.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from queries import PREPARED_SQL
+
+_WHITESPACE = re.compile(r"\s+")
+_EXECUTE = re.compile(r"^EXECUTE\s+(\w+)", re.IGNORECASE)
+_WRITE_KEYWORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|COPY|CALL|NOTIFY|PG_NOTIFY)\b", re.IGNORECASE)
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "EXECUTE")
+
+
+class SlowQueryProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.threshold_seconds = 0.2
+        self.max_tracked = 500
+        self._logger = None
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def configure(self, enabled: bool, threshold_ms: float, log_path: str,
+                  max_bytes: int = 5 * 1024 * 1024, backup_count: int = 5):
+        self.threshold_seconds = threshold_ms / 1000
+        if enabled and self._logger is None:
+            logger = logging.getLogger("qs.slow_queries")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count))
+            self._logger = logger
+        self.enabled = enabled
+
+    def observe(self, cur, query, vars, seconds: float):
+        """Called by the timed cursors after every successful execute()."""
+        if seconds < self.threshold_seconds or getattr(self._local, "busy", False):
+            return
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        key = self._statement_key(text)
+        if key is None:
+            return
+        self._local.busy = True
+        try:
+            plan = self._explain(cur, text)
+        finally:
+            self._local.busy = False
+
+        record = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "statement": key,
+            "duration_ms": round(seconds * 1000, 2),
+            "params": _safe_params(vars),
+            "plan": plan,
+        }
+        if self._logger is not None:
+            self._logger.info(json.dumps(record, default=str))
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                if len(self._stats) >= self.max_tracked:
+                    return
+                entry = self._stats[key] = {"statement": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            entry["count"] += 1
+            entry["total_ms"] += record["duration_ms"]
+            if record["duration_ms"] >= entry["max_ms"]:
+                entry["max_ms"] = record["duration_ms"]
+                entry["worst_params"] = record["params"]
+                entry["worst_plan"] = plan
+            entry["last_seen"] = record["ts"]
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> list:
+        with self._lock:
+            entries = [dict(e, avg_ms=round(e["total_ms"] / e["count"], 2), total_ms=round(e["total_ms"], 2))
+                       for e in self._stats.values()]
+        return sorted(entries, key=lambda e: e[order_by], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    @staticmethod
+    def _statement_key(text: str):
+        text = _WHITESPACE.sub(" ", text).strip()
+        if not text.upper().startswith(_EXPLAINABLE):
+            return None
+        match = _EXECUTE.match(text)
+        return f"EXECUTE {match.group(1)}" if match else text[:500]
+
+    @staticmethod
+    def _explain(cur, text: str):
+        if getattr(cur, "name", None):
+            return None  # server-side cursor: the statement lives in a DECLARE
+        conn = cur.connection
+        match = _EXECUTE.match(text.strip())
+        underlying = PREPARED_SQL.get(match.group(1), text) if match else text
+        options = "FORMAT TEXT" if _WRITE_KEYWORDS.search(underlying) else "ANALYZE, BUFFERS, FORMAT TEXT"
+        in_transaction = not conn.autocommit
+        explain_cur = conn.cursor()
+        try:
+            if in_transaction:
+                explain_cur.execute("SAVEPOINT qs_explain;")
+            explain_cur.execute(f"EXPLAIN ({options}) {cur.query.decode()}")
+            plan = "\n".join(row[0] for row in explain_cur.fetchall())
+            if in_transaction:
+                explain_cur.execute("RELEASE SAVEPOINT qs_explain;")
+            return plan
+        except Exception as e:
+            if in_transaction:
+                try:
+                    explain_cur.execute("ROLLBACK TO SAVEPOINT qs_explain;")
+                except Exception:
+                    pass
+            return f"EXPLAIN failed: {e}"
+        finally:
+            explain_cur.close()
+
+
+def _safe_params(vars):
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {k: _short(v) for k, v in vars.items()}
+    return [_short(v) for v in vars]
+
+
+def _short(value):
+    text = value if isinstance(value, (int, float, bool, type(None))) else repr(value)
+    return text[:200] + "..." if isinstance(text, str) and len(text) > 200 else text
+
+
+PROFILER = SlowQueryProfiler()
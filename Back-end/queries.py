@@ -0,0 +1,906 @@
+"""
+Central home for the hot SQL statements.
+
+Each statement is a `PreparedStatement`: the first time a pooled connection runs
+it, the text is sent once as `PREPARE`, and from then on only `EXECUTE name(...)`
+and the parameter values go over the wire, so Postgres skips parse/plan on the
+heartbeat and asset-upload paths. Statements are written with `$n` placeholders
+and take a dict of named parameters.
+
+Per-statement timings are kept in `QUERY_STATS` and served by `/api/query_stats`.
+"""
+import re
+import threading
+import time
+
+# Explicit column lists (never `a.*`) so an added column can't invalidate a
+# prepared plan's result type on connections that outlive a migration.
+AGENT_COLUMNS = (
+    "a.agent_uuid, a.hostname, a.os_name, a.machine_type, a.ip_address, a.first_seen, "
+    "a.last_heartbeat, a.priority, a.is_internet_facing, a.department, a.status"
+)
+
+LATEST_AGENT_PER_HOST = """
+    FROM agents a INNER JOIN (
+        SELECT hostname, MAX(last_heartbeat) AS max_hb FROM agents GROUP BY hostname
+    ) b ON a.hostname = b.hostname AND a.last_heartbeat = b.max_hb
+"""
+
+
+class QueryStats:
+    """Cumulative execution counters per statement name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name: str, seconds: float, prepared_now: bool = False):
+        with self._lock:
+            entry = self._stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "prepares": 0})
+            ms = seconds * 1000
+            entry["calls"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            if prepared_now:
+                entry["prepares"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {**entry, "total_ms": round(entry["total_ms"], 3), "max_ms": round(entry["max_ms"], 3),
+                       "avg_ms": round(entry["total_ms"] / entry["calls"], 3) if entry["calls"] else 0.0}
+                for name, entry in self._stats.items()
+            }
+
+
+QUERY_STATS = QueryStats()
+
+_PLACEHOLDER = re.compile(r"\$(\d+)")
+
+# name -> SQL text, so tools that only see "EXECUTE name(...)" can look up what it runs.
+PREPARED_SQL = {}
+
+
+class PreparedStatement:
+    """A named server-side prepared statement, prepared lazily per connection."""
+
+    def __init__(self, name: str, sql: str, params: tuple):
+        self.name = name
+        self.sql = sql
+        self.params = params
+        PREPARED_SQL[name] = sql
+        self._prepare_sql = f"PREPARE {name} AS {sql}"
+        self._execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+
+    def execute(self, cur, values: dict = None):
+        values = values or {}
+        args = [values[p] for p in self.params]
+        conn = cur.connection
+        prepared = getattr(conn, "prepared_statements", None)
+        start = time.perf_counter()
+        if prepared is None:
+            # Not one of our pooled connections: fall back to a one-off statement.
+            cur.execute(self._inline_sql(), {f"p{i}": arg for i, arg in enumerate(args, 1)})
+            QUERY_STATS.record(self.name, time.perf_counter() - start)
+            return cur
+        prepared_now = self.name not in prepared
+        if prepared_now:
+            # PREPARE isn't transactional, so a later rollback doesn't undo it.
+            cur.execute(self._prepare_sql)
+            prepared.add(self.name)
+        cur.execute(self._execute_sql, args)
+        QUERY_STATS.record(self.name, time.perf_counter() - start, prepared_now)
+        return cur
+
+    def _inline_sql(self) -> str:
+        # Named placeholders: a statement may use $n out of order or more than once.
+        return _PLACEHOLDER.sub(r"%(p\1)s", self.sql.replace("%", "%%"))
+
+
+# --------------------------------------------------------------------------------------
+# INGESTION
+# --------------------------------------------------------------------------------------
+# `prev` is evaluated against the pre-upsert snapshot, so RETURNING can tell whether
+# anything a dashboard shows actually changed. A routine ping from an Active agent
+# only moves last_heartbeat and is left to the cache TTL.
+#
+# A heartbeat from a non-Active agent is its Inactive -> Active transition and is
+# logged to agent_state_changes. If the agent is still marked Active but its last
+# heartbeat is older than the threshold, the sweeper missed the outage (e.g. the
+# server was down), so the Active -> Inactive half is logged here too, timestamped
+# when the agent actually went quiet.
+HEARTBEAT_UPSERT = PreparedStatement("qs_heartbeat_upsert", """
+    WITH prev AS (
+        SELECT hostname, os_name, machine_type, ip_address, last_heartbeat, status,
+               status = 'Active' AND last_heartbeat < (NOW() at time zone 'utc') - make_interval(secs => $6) AS missed
+        FROM agents WHERE agent_uuid = $1
+    ), up AS (
+        INSERT INTO agents (agent_uuid, hostname, os_name, machine_type, ip_address, last_heartbeat, status, status_changed_at, host_id)
+        VALUES ($1, $2, $3, $4, $5, (NOW() at time zone 'utc'), 'Active', (NOW() at time zone 'utc'), $7)
+        ON CONFLICT (agent_uuid) DO UPDATE SET
+            hostname = EXCLUDED.hostname, os_name = EXCLUDED.os_name, machine_type = EXCLUDED.machine_type,
+            host_id = COALESCE(EXCLUDED.host_id, agents.host_id),
+            ip_address = EXCLUDED.ip_address, last_heartbeat = EXCLUDED.last_heartbeat, status = 'Active',
+            status_changed_at = CASE
+                WHEN agents.status = 'Active' AND agents.last_heartbeat >= EXCLUDED.last_heartbeat - make_interval(secs => $6)
+                THEN agents.status_changed_at ELSE EXCLUDED.status_changed_at END
+        RETURNING agent_uuid, hostname, last_heartbeat
+    ), logged AS (
+        INSERT INTO agent_state_changes (agent_uuid, hostname, from_status, to_status, changed_at)
+        SELECT up.agent_uuid, up.hostname, t.from_status, t.to_status, t.changed_at
+        FROM up CROSS JOIN LATERAL (
+            SELECT 'Active', 'Inactive', prev.last_heartbeat + make_interval(secs => $6) FROM prev WHERE prev.missed
+            UNION ALL
+            SELECT CASE WHEN prev.missed THEN 'Inactive' ELSE prev.status END, 'Active', up.last_heartbeat
+            FROM (SELECT 1) AS one LEFT JOIN prev ON TRUE
+            WHERE prev.status IS DISTINCT FROM 'Active' OR prev.missed
+        ) AS t(from_status, to_status, changed_at)
+    )
+    SELECT NOT EXISTS (
+        SELECT 1 FROM prev
+        WHERE prev.hostname IS NOT DISTINCT FROM $2
+          AND prev.os_name IS NOT DISTINCT FROM $3
+          AND prev.machine_type IS NOT DISTINCT FROM $4
+          AND prev.ip_address IS NOT DISTINCT FROM $5
+          AND prev.status = 'Active' AND NOT prev.missed
+    ) AS changed
+    FROM up
+""", ("uuid", "host", "os", "type", "ip", "threshold", "host_id"))
+
+ASSET_UPSERT = PreparedStatement("qs_asset_upsert", """
+    INSERT INTO assets (hostname, username, os, os_version, cpu, memory_gb, disk_gb, uptime_seconds, ip_addresses, ip_inet, open_ports, software, software_list, vmware_vms, ip_reporter, collected_at)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10::text[]::inet[], $11, $12, $13::text[], $14, $15, NOW())
+    ON CONFLICT (hostname) DO UPDATE SET
+        username = EXCLUDED.username, os = EXCLUDED.os, os_version = EXCLUDED.os_version, cpu = EXCLUDED.cpu, memory_gb = EXCLUDED.memory_gb, disk_gb = EXCLUDED.disk_gb, uptime_seconds = EXCLUDED.uptime_seconds, ip_addresses = EXCLUDED.ip_addresses, ip_inet = EXCLUDED.ip_inet, open_ports = EXCLUDED.open_ports, software = EXCLUDED.software, software_list = EXCLUDED.software_list, vmware_vms = EXCLUDED.vmware_vms, ip_reporter = EXCLUDED.ip_reporter, collected_at = NOW()
+""", ("hostname", "username", "os", "os_version", "cpu", "memory_gb", "disk_gb", "uptime_seconds",
+      "ip_addresses", "ip_inet", "open_ports", "software", "software_list", "vmware_vms", "ip_reporter"))
+
+
+# --------------------------------------------------------------------------------------
+# PRIORITY DASHBOARD
+# --------------------------------------------------------------------------------------
+# The sort whitelist, compiled once: every (sort_by, sort_order) pair gets its own
+# fixed ORDER BY and its own prepared statement, so no SQL is assembled per request.
+PRIORITY_SORT_COLUMNS = {
+    "priority": ("a.priority", "a.last_heartbeat DESC"),
+    "heartbeat": ("a.last_heartbeat", "a.priority ASC"),
+    "hostname": ("a.hostname", "a.priority ASC"),
+    "department": ("a.department", "a.priority ASC"),
+    "is_internet_facing": ("a.is_internet_facing", "a.priority ASC"),
+}
+SORT_ORDERS = {"asc": "ASC", "desc": "DESC"}
+
+LATEST_AGENT_COUNT = PreparedStatement(
+    "qs_latest_agent_count", f"SELECT COUNT(a.agent_uuid) AS total {LATEST_AGENT_PER_HOST}", ())
+
+LATEST_AGENT_COUNT_BY_STATUS = PreparedStatement(
+    "qs_latest_agent_count_by_status",
+    f"SELECT COUNT(a.agent_uuid) AS total {LATEST_AGENT_PER_HOST} WHERE a.status = $1", ("status",))
+
+PRIORITY_DASHBOARD_PAGE = {
+    (sort_by, sort_order): PreparedStatement(
+        f"qs_priority_page_{sort_by}_{sort_order}",
+        f"SELECT {AGENT_COLUMNS} {LATEST_AGENT_PER_HOST} ORDER BY {primary} {direction}, {secondary} LIMIT $1 OFFSET $2",
+        ("limit", "offset"),
+    )
+    for sort_by, (primary, secondary) in PRIORITY_SORT_COLUMNS.items()
+    for sort_order, direction in SORT_ORDERS.items()
+}
+
+
+# --------------------------------------------------------------------------------------
+# SERVER DASHBOARD & ASSET API
+# --------------------------------------------------------------------------------------
+# The display string is formatted by Postgres rather than per row in Python.
+SERVER_DASHBOARD_COLUMNS = f"{AGENT_COLUMNS}, to_char(a.last_heartbeat, 'YYYY-MM-DD HH24:MI:SS') AS last_heartbeat_str"
+
+SERVER_DASHBOARD_PAGE = PreparedStatement(
+    "qs_server_dashboard_page",
+    f"SELECT {SERVER_DASHBOARD_COLUMNS} {LATEST_AGENT_PER_HOST} ORDER BY a.last_heartbeat DESC LIMIT $1 OFFSET $2",
+    ("limit", "offset"),
+)
+
+SERVER_DASHBOARD_PAGE_BY_STATUS = PreparedStatement(
+    "qs_server_dashboard_page_by_status",
+    f"SELECT {SERVER_DASHBOARD_COLUMNS} {LATEST_AGENT_PER_HOST} WHERE a.status = $3 ORDER BY a.last_heartbeat DESC LIMIT $1 OFFSET $2",
+    ("limit", "offset", "status"),
+)
+
+SERVER_DASHBOARD_SUMMARY = PreparedStatement("qs_server_dashboard_summary", """
+    SELECT MAX(last_heartbeat) AS latest_hb, COUNT(DISTINCT ip_address) AS unique_ips FROM agents
+""", ())
+
+ASSET_COUNT = PreparedStatement("qs_asset_count", "SELECT COUNT(*) AS total FROM assets", ())
+
+# `risk` is the materialized level from asset_risk (see risk.py); hosts not yet
+# scored fall back to 'Medium'. Sorting by risk walks idx_asset_risk_score.
+ASSET_PAGE_SORTS = {
+    "hostname": "ast.hostname ASC",
+    "risk": "r.score DESC NULLS LAST, ast.hostname ASC",
+}
+ASSET_PAGE_COLUMNS = """
+    ast.hostname, ast.username, ast.os, ast.os_version, ast.cpu,
+    ast.memory_gb, ast.disk_gb, ast.uptime_seconds, ast.ip_addresses,
+    ast.collected_at,
+    COALESCE(r.level, 'Medium') AS risk, COALESCE(r.score, 0) AS risk_score
+"""
+
+ASSET_PAGE = {
+    "hostname": PreparedStatement("qs_asset_page_hostname", f"""
+        SELECT {ASSET_PAGE_COLUMNS}
+        FROM assets ast
+        LEFT JOIN asset_risk r ON r.hostname = ast.hostname
+        ORDER BY ast.hostname ASC
+        LIMIT $1 OFFSET $2
+    """, ("limit", "offset")),
+    # Hosts not scored yet (e.g. before RiskSweeper's first pass after migration 6)
+    # sort as score 0 rather than dropping out, so pages always add up to ASSET_COUNT.
+    "risk": PreparedStatement("qs_asset_page_risk", f"""
+        SELECT {ASSET_PAGE_COLUMNS}
+        FROM assets ast
+        LEFT JOIN asset_risk r ON r.hostname = ast.hostname
+        ORDER BY COALESCE(r.score, 0) DESC, ast.hostname ASC
+        LIMIT $1 OFFSET $2
+    """, ("limit", "offset")),
+}
+
+
+# --------------------------------------------------------------------------------------
+# ASSET FILTERS & EXPORT
+# --------------------------------------------------------------------------------------
+# Filters are dynamic, so these statements are composed per request (from fixed
+# fragments only -- user input always travels as a bind parameter).
+LATEST_AGENT_JOIN = """
+    LEFT JOIN (
+        SELECT DISTINCT ON (hostname) hostname, priority, department, is_internet_facing
+        FROM agents
+        ORDER BY hostname, last_heartbeat DESC
+    ) AS latest_agent ON ast.hostname = latest_agent.hostname
+"""
+
+
+def asset_search_expr(alias: str = "") -> str:
+    """Text searched by `q`. The trigram index (migration 3) is built on exactly this expression."""
+    prefix = f"{alias}." if alias else ""
+    return " || ' ' || ".join(
+        f"COALESCE({prefix}{col}, '')" for col in ("hostname", "username", "os", "os_version", "ip_addresses")
+    )
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def build_asset_filters(os_name=None, department=None, priority=None, is_internet_facing=None,
+                        ip=None, cidr=None, username=None, search=None, risk=None, min_risk_score=None):
+    """Return (WHERE clause, params) for the asset list/export filters.
+
+    Each filter maps onto an index: lower(os) and lower(username) btrees, the GIN
+    index on ip_inet for exact addresses, and the trigram index for `search`.
+    """
+    clauses, params = [], {}
+    if os_name:
+        clauses.append("lower(ast.os) = lower(%(os)s)")
+        params["os"] = os_name
+    if department:
+        clauses.append("COALESCE(latest_agent.department, 'Unassigned') = %(department)s")
+        params["department"] = department
+    if priority:
+        clauses.append("COALESCE(latest_agent.priority, 'Medium') = %(priority)s")
+        params["priority"] = priority
+    if is_internet_facing is not None:
+        clauses.append("COALESCE(latest_agent.is_internet_facing, FALSE) = %(is_internet_facing)s")
+        params["is_internet_facing"] = is_internet_facing
+    if ip:
+        clauses.append("ast.ip_inet @> ARRAY[%(ip)s::inet]")
+        params["ip"] = ip
+    if cidr:
+        clauses.append("EXISTS (SELECT 1 FROM unnest(ast.ip_inet) AS addr WHERE addr <<= %(cidr)s::cidr)")
+        params["cidr"] = cidr
+    if username:
+        clauses.append("lower(ast.username) = lower(%(username)s)")
+        params["username"] = username
+    if search:
+        clauses.append(f"({asset_search_expr('ast')}) ILIKE %(search)s")
+        params["search"] = _like_pattern(search)
+    if risk:
+        clauses.append("COALESCE(r.level, 'Medium') = %(risk)s")
+        params["risk"] = risk
+    if min_risk_score is not None:
+        clauses.append("r.score >= %(min_risk_score)s")
+        params["min_risk_score"] = min_risk_score
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+RISK_JOIN = "LEFT JOIN asset_risk r ON r.hostname = ast.hostname"
+
+
+def asset_count_sql(where_clause: str) -> str:
+    return f"SELECT COUNT(*) AS total FROM assets ast {LATEST_AGENT_JOIN} {RISK_JOIN} {where_clause}"
+
+
+def asset_page_sql(where_clause: str, sort: str = "hostname") -> str:
+    return f"""
+        SELECT {ASSET_PAGE_COLUMNS}
+        FROM assets ast
+        {LATEST_AGENT_JOIN}
+        {RISK_JOIN}
+        {where_clause}
+        ORDER BY {ASSET_PAGE_SORTS[sort]}
+        LIMIT %(limit)s OFFSET %(offset)s
+    """
+
+
+EXPORT_COLUMNS = (
+    "hostname", "username", "os", "os_version", "cpu", "memory_gb", "disk_gb", "uptime_seconds",
+    "ip_addresses", "collected_at", "priority", "department", "is_internet_facing", "risk", "risk_score",
+)
+
+
+def asset_export_sql(where_clause: str, expand_software: bool) -> str:
+    """One row per host, or one row per (host, installed package) when expanding software."""
+    software_join = software_column = ""
+    if expand_software:
+        software_column = ", sw.package"
+        software_join = "LEFT JOIN LATERAL unnest(ast.software_list) AS sw(package) ON TRUE"
+    return f"""
+        SELECT
+            ast.hostname, ast.username, ast.os, ast.os_version, ast.cpu, ast.memory_gb, ast.disk_gb,
+            ast.uptime_seconds, ast.ip_addresses, ast.collected_at,
+            COALESCE(latest_agent.priority, 'Medium'), COALESCE(latest_agent.department, 'Unassigned'),
+            COALESCE(latest_agent.is_internet_facing, FALSE),
+            COALESCE(r.level, 'Medium'), COALESCE(r.score, 0){software_column}
+        FROM assets ast
+        {LATEST_AGENT_JOIN}
+        {RISK_JOIN}
+        {software_join}
+        {where_clause}
+        ORDER BY ast.hostname
+    """
+
+
+# --------------------------------------------------------------------------------------
+# OPEN PORTS
+# --------------------------------------------------------------------------------------
+# asset_ports is the normalized copy of assets.open_ports, one row per listener.
+# `wildcard` (a generated column) marks listeners bound to every interface (0.0.0.0, :: or *).
+
+LATEST_AGENT_FOR_PORTS = """
+    LEFT JOIN (
+        SELECT DISTINCT ON (hostname) hostname, priority, department, is_internet_facing
+        FROM agents
+        ORDER BY hostname, last_heartbeat DESC
+    ) AS latest_agent ON p.hostname = latest_agent.hostname
+"""
+
+# Replaces one host's listeners in a single statement: the new set arrives as
+# parallel arrays, rows that disappeared are deleted and the rest are upserted
+# (the delete and the upsert touch disjoint rows, so they can share a snapshot).
+ASSET_PORTS_SYNC = PreparedStatement("qs_asset_ports_sync", """
+    WITH incoming AS (
+        SELECT * FROM unnest($2::int[], $3::text[], $4::text[]) AS n(port, ip, process)
+    ), removed AS (
+        DELETE FROM asset_ports p
+        WHERE p.hostname = $1
+          AND NOT EXISTS (SELECT 1 FROM incoming i WHERE i.port = p.port AND i.ip = p.ip)
+    )
+    INSERT INTO asset_ports (hostname, port, ip, process)
+    SELECT $1, port, ip, process FROM incoming
+    ON CONFLICT (hostname, port, ip) DO UPDATE SET process = EXCLUDED.process
+    WHERE asset_ports.process IS DISTINCT FROM EXCLUDED.process
+""", ("hostname", "ports", "ips", "processes"))
+
+PORT_SUMMARY = PreparedStatement("qs_port_summary", f"""
+    SELECT
+        p.port, p.process,
+        COUNT(DISTINCT p.hostname) AS hosts,
+        COUNT(DISTINCT p.hostname) FILTER (WHERE p.wildcard) AS wildcard_hosts,
+        COUNT(DISTINCT p.hostname) FILTER (WHERE p.wildcard AND latest_agent.is_internet_facing) AS exposed_hosts
+    FROM asset_ports p
+    {LATEST_AGENT_FOR_PORTS}
+    GROUP BY p.port, p.process
+    ORDER BY hosts DESC, p.port
+    LIMIT $1
+""", ("limit",))
+
+PORT_EXPOSURES = PreparedStatement("qs_port_exposures", f"""
+    SELECT
+        p.hostname, p.port, p.ip, p.process,
+        latest_agent.priority, latest_agent.department
+    FROM asset_ports p
+    {LATEST_AGENT_FOR_PORTS}
+    WHERE p.wildcard AND latest_agent.is_internet_facing AND p.port = ANY($1::int[])
+    ORDER BY CASE latest_agent.priority WHEN 'High' THEN 0 WHEN 'Medium' THEN 1 ELSE 2 END, p.hostname, p.port
+""", ("ports",))
+
+
+def build_port_filters(port=None, process=None, wildcard_only=False, is_internet_facing=None):
+    """Return (WHERE clause, params) for the per-port host listing."""
+    clauses, params = [], {}
+    if port is not None:
+        clauses.append("p.port = %(port)s")
+        params["port"] = port
+    if process:
+        clauses.append("lower(p.process) = lower(%(process)s)")
+        params["process"] = process
+    if wildcard_only:
+        clauses.append("p.wildcard")
+    if is_internet_facing is not None:
+        clauses.append("COALESCE(latest_agent.is_internet_facing, FALSE) = %(is_internet_facing)s")
+        params["is_internet_facing"] = is_internet_facing
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def port_hosts_sql(where_clause: str) -> str:
+    return f"""
+        SELECT
+            p.hostname, p.port, p.ip, p.process, p.wildcard,
+            COALESCE(latest_agent.is_internet_facing, FALSE) AS is_internet_facing,
+            COALESCE(latest_agent.priority, 'Medium') AS priority,
+            COALESCE(latest_agent.department, 'Unassigned') AS department,
+            COUNT(*) OVER () AS total
+        FROM asset_ports p
+        {LATEST_AGENT_FOR_PORTS}
+        {where_clause}
+        ORDER BY p.port, p.hostname, p.ip
+        LIMIT %(limit)s OFFSET %(offset)s
+    """
+
+
+# --------------------------------------------------------------------------------------
+# FLEET ANALYTICS
+# --------------------------------------------------------------------------------------
+# Each statement makes one pass over its table and returns every chart series at
+# once via GROUPING SETS; `dimension` says which grouping a row belongs to.
+AGENT_ANALYTICS = PreparedStatement("qs_agent_analytics", """
+    WITH latest AS (
+        SELECT DISTINCT ON (hostname) os_name, machine_type, priority, department, is_internet_facing, status
+        FROM agents
+        ORDER BY hostname, last_heartbeat DESC
+    )
+    SELECT
+        CASE
+            WHEN GROUPING(os_name) = 0 THEN 'os_name'
+            WHEN GROUPING(priority) = 0 THEN 'priority'
+            WHEN GROUPING(department) = 0 THEN 'department'
+            WHEN GROUPING(machine_type) = 0 THEN 'machine_type'
+            WHEN GROUPING(is_internet_facing) = 0 THEN 'is_internet_facing'
+            ELSE 'total'
+        END AS dimension,
+        COALESCE(os_name, priority, department, machine_type, is_internet_facing::text) AS value,
+        COUNT(*) AS agents,
+        COUNT(*) FILTER (WHERE status = 'Active') AS active
+    FROM latest
+    GROUP BY GROUPING SETS ((os_name), (priority), (department), (machine_type), (is_internet_facing), ())
+""", ())
+
+# width_bucket(x, edges) is 0 below the first edge, i for edges[i-1] <= x < edges[i],
+# and len(edges) at or above the last one; NULL when the agent didn't report x.
+ASSET_ANALYTICS = PreparedStatement("qs_asset_analytics", """
+    WITH ast AS (
+        SELECT
+            os, memory_gb, disk_gb, uptime_seconds,
+            width_bucket(memory_gb, $1::float8[]) AS memory_bucket,
+            width_bucket(disk_gb, $2::float8[]) AS disk_bucket,
+            width_bucket(uptime_seconds / 86400.0, $3::float8[]) AS uptime_bucket
+        FROM assets
+    )
+    SELECT
+        CASE
+            WHEN GROUPING(os) = 0 THEN 'os'
+            WHEN GROUPING(memory_bucket) = 0 THEN 'memory_gb'
+            WHEN GROUPING(disk_bucket) = 0 THEN 'disk_gb'
+            WHEN GROUPING(uptime_bucket) = 0 THEN 'uptime_days'
+            ELSE 'total'
+        END AS dimension,
+        os AS value,
+        COALESCE(memory_bucket, disk_bucket, uptime_bucket) AS bucket,
+        COUNT(*) AS assets,
+        SUM(memory_gb) AS memory_gb_sum, AVG(memory_gb) AS memory_gb_avg,
+        SUM(disk_gb) AS disk_gb_sum, AVG(disk_gb) AS disk_gb_avg,
+        AVG(uptime_seconds) AS uptime_seconds_avg
+    FROM ast
+    GROUP BY GROUPING SETS ((os), (memory_bucket), (disk_bucket), (uptime_bucket), ())
+""", ("memory_edges", "disk_edges", "uptime_edges"))
+
+
+# --------------------------------------------------------------------------------------
+# RISK SCORES
+# --------------------------------------------------------------------------------------
+# Everything risk.score_host() needs for a batch of hostnames, one row per host
+# that still has an agent or an asset record. Staleness is decided here, against
+# the database clock, so heartbeat and inventory timestamps compare like for like.
+RISK_INPUTS = PreparedStatement("qs_risk_inputs", """
+    SELECT
+        h.hostname, la.priority, la.is_internet_facing,
+        la.last_heartbeat < (NOW() at time zone 'utc') - make_interval(secs => $3) AS stale_heartbeat,
+        ast.collected_at < NOW()::timestamp - make_interval(secs => $4) AS stale_inventory,
+        (SELECT COUNT(DISTINCT p.port) FROM asset_ports p
+         WHERE p.hostname = h.hostname AND p.wildcard AND p.port = ANY($2::int[])) AS risky_listeners,
+        (SELECT COUNT(DISTINCT av.cve_id) FROM asset_vulns av WHERE av.hostname = h.hostname) AS vulns,
+        (SELECT COUNT(DISTINCT av.cve_id) FROM asset_vulns av JOIN vulnerabilities v USING (cve_id)
+         WHERE av.hostname = h.hostname AND v.is_kev) AS kev_vulns
+    FROM unnest($1::text[]) AS h(hostname)
+    LEFT JOIN LATERAL (
+        SELECT priority, is_internet_facing, last_heartbeat FROM agents a
+        WHERE a.hostname = h.hostname ORDER BY last_heartbeat DESC LIMIT 1
+    ) AS la ON TRUE
+    LEFT JOIN assets ast ON ast.hostname = h.hostname
+    WHERE la.priority IS NOT NULL OR ast.hostname IS NOT NULL
+""", ("hostnames", "risky_ports", "stale_heartbeat_seconds", "stale_inventory_seconds"))
+
+RISK_UPSERT = PreparedStatement("qs_risk_upsert", """
+    INSERT INTO asset_risk (hostname, score, level, factors, stale_heartbeat, stale_inventory, computed_at)
+    SELECT hostname, score, level, factors::jsonb, stale_heartbeat, stale_inventory, NOW()
+    FROM unnest($1::text[], $2::int[], $3::text[], $4::text[], $5::bool[], $6::bool[])
+         AS n(hostname, score, level, factors, stale_heartbeat, stale_inventory)
+    ON CONFLICT (hostname) DO UPDATE SET
+        score = EXCLUDED.score, level = EXCLUDED.level, factors = EXCLUDED.factors,
+        stale_heartbeat = EXCLUDED.stale_heartbeat, stale_inventory = EXCLUDED.stale_inventory,
+        computed_at = EXCLUDED.computed_at
+    WHERE (asset_risk.score, asset_risk.factors) IS DISTINCT FROM (EXCLUDED.score, EXCLUDED.factors)
+""", ("hostnames", "scores", "levels", "factors", "stale_heartbeat", "stale_inventory"))
+
+# Hosts whose staleness flipped since their score was computed. Nothing writes
+# when a host goes quiet, so these are found by polling rather than by event.
+RISK_STALE_CANDIDATES = PreparedStatement("qs_risk_stale_candidates", """
+    SELECT r.hostname
+    FROM asset_risk r
+    LEFT JOIN LATERAL (
+        SELECT last_heartbeat FROM agents a
+        WHERE a.hostname = r.hostname ORDER BY last_heartbeat DESC LIMIT 1
+    ) AS la ON TRUE
+    LEFT JOIN assets ast ON ast.hostname = r.hostname
+    WHERE COALESCE(la.last_heartbeat < (NOW() at time zone 'utc') - make_interval(secs => $1), FALSE)
+              IS DISTINCT FROM r.stale_heartbeat
+       OR COALESCE(ast.collected_at < NOW()::timestamp - make_interval(secs => $2), FALSE)
+              IS DISTINCT FROM r.stale_inventory
+""", ("stale_heartbeat_seconds", "stale_inventory_seconds"))
+
+# Hosts with no score yet, e.g. everything that predates the asset_risk table.
+RISK_UNSCORED = PreparedStatement("qs_risk_unscored", """
+    SELECT hostname FROM (SELECT hostname FROM assets UNION SELECT hostname FROM agents) AS h
+    WHERE hostname IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM asset_risk r WHERE r.hostname = h.hostname)
+""", ())
+
+
+# --------------------------------------------------------------------------------------
+# AGENT BULK UPDATE
+# --------------------------------------------------------------------------------------
+# Filled in with psycopg2.extras.execute_values; a NULL column leaves the field as is.
+AGENT_BULK_UPDATE_SQL = """
+    UPDATE agents a SET
+        priority = COALESCE(v.priority, a.priority),
+        department = COALESCE(v.department, a.department),
+        is_internet_facing = COALESCE(v.is_internet_facing, a.is_internet_facing)
+    FROM (VALUES %s) AS v(agent_uuid, priority, department, is_internet_facing)
+    WHERE a.agent_uuid = v.agent_uuid
+    RETURNING a.agent_uuid, a.hostname
+"""
+AGENT_BULK_UPDATE_TEMPLATE = "(%s, %s::text, %s::text, %s::boolean)"
+
+
+def build_agent_filters(agent_uuids=None, hostnames=None, os_name=None, department=None,
+                        priority=None, is_internet_facing=None):
+    """Return (WHERE clause, params) selecting agents for a filter-based bulk update."""
+    clauses, params = [], {}
+    if agent_uuids:
+        clauses.append("agent_uuid = ANY(%(agent_uuids)s)")
+        params["agent_uuids"] = list(agent_uuids)
+    if hostnames:
+        clauses.append("hostname = ANY(%(hostnames)s)")
+        params["hostnames"] = list(hostnames)
+    if os_name:
+        clauses.append("lower(os_name) = lower(%(os_name)s)")
+        params["os_name"] = os_name
+    if department:
+        clauses.append("department = %(department)s")
+        params["department"] = department
+    if priority:
+        clauses.append("priority = %(priority)s")
+        params["priority"] = priority
+    if is_internet_facing is not None:
+        clauses.append("is_internet_facing = %(is_internet_facing)s")
+        params["is_internet_facing"] = is_internet_facing
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def agent_filter_update_sql(where_clause: str) -> str:
+    return f"""
+        UPDATE agents SET
+            priority = COALESCE(%(set_priority)s, priority),
+            department = COALESCE(%(set_department)s, department),
+            is_internet_facing = COALESCE(%(set_is_internet_facing)s, is_internet_facing)
+        {where_clause}
+        RETURNING agent_uuid, hostname
+    """
+
+
+# --------------------------------------------------------------------------------------
+# VULNERABILITIES
+# --------------------------------------------------------------------------------------
+# Same shape as ASSET_PORTS_SYNC: the host's current matches arrive as arrays.
+ASSET_VULNS_SYNC = PreparedStatement("qs_asset_vulns_sync", """
+    WITH incoming AS (
+        SELECT * FROM unnest($2::text[], $3::text[], $4::text[]) AS n(cve_id, package, version)
+    ), removed AS (
+        DELETE FROM asset_vulns av
+        WHERE av.hostname = $1
+          AND NOT EXISTS (SELECT 1 FROM incoming i WHERE i.cve_id = av.cve_id AND i.package = av.package)
+    )
+    INSERT INTO asset_vulns (hostname, cve_id, package, version)
+    SELECT $1, cve_id, package, version FROM incoming
+    ON CONFLICT (hostname, cve_id, package) DO UPDATE SET version = EXCLUDED.version
+    WHERE asset_vulns.version IS DISTINCT FROM EXCLUDED.version
+""", ("hostname", "cve_ids", "packages", "versions"))
+
+VULN_COLUMNS = "v.cve_id, v.vendor, v.product, v.name, v.severity, v.is_kev, v.date_added"
+
+VULN_SUMMARY = PreparedStatement("qs_vuln_summary", f"""
+    SELECT {VULN_COLUMNS}, COUNT(DISTINCT av.hostname) AS affected_hosts
+    FROM vulnerabilities v
+    JOIN asset_vulns av ON av.cve_id = v.cve_id
+    WHERE (NOT $1 OR v.is_kev)
+    GROUP BY v.cve_id
+    ORDER BY v.is_kev DESC, affected_hosts DESC, v.cve_id
+    LIMIT $2
+""", ("kev_only", "limit"))
+
+VULN_DETAIL = PreparedStatement("qs_vuln_detail", f"""
+    SELECT {VULN_COLUMNS}, v.description FROM vulnerabilities v WHERE v.cve_id = $1
+""", ("cve_id",))
+
+VULN_HOSTS = PreparedStatement("qs_vuln_hosts", """
+    SELECT
+        av.hostname, av.package, av.version,
+        COALESCE(r.level, 'Medium') AS risk, COALESCE(r.score, 0) AS risk_score
+    FROM asset_vulns av
+    LEFT JOIN asset_risk r ON r.hostname = av.hostname
+    WHERE av.cve_id = $1
+    ORDER BY risk_score DESC, av.hostname
+""", ("cve_id",))
+
+HOST_VULNS = PreparedStatement("qs_host_vulns", f"""
+    SELECT {VULN_COLUMNS}, av.package, av.version
+    FROM asset_vulns av
+    JOIN vulnerabilities v ON v.cve_id = av.cve_id
+    WHERE av.hostname = $1
+    ORDER BY v.is_kev DESC, v.cve_id
+""", ("hostname",))
+
+
+# --------------------------------------------------------------------------------------
+# AGENT STATUS
+# --------------------------------------------------------------------------------------
+# Active -> Inactive, applied only if the agent really is overdue: another worker
+# may have taken its latest heartbeat, so the row, not the sweeper's heap, decides.
+# The transition is timestamped when the agent went quiet, not when it was noticed.
+_MARK_INACTIVE = """
+    WITH gone AS (
+        UPDATE agents SET status = 'Inactive', status_changed_at = last_heartbeat + make_interval(secs => $1)
+        WHERE status = 'Active' AND last_heartbeat < (NOW() at time zone 'utc') - make_interval(secs => $1) {extra}
+        RETURNING agent_uuid, hostname, status_changed_at
+    )
+    INSERT INTO agent_state_changes (agent_uuid, hostname, from_status, to_status, changed_at)
+    SELECT agent_uuid, hostname, 'Active', 'Inactive', status_changed_at FROM gone
+    RETURNING agent_uuid
+"""
+
+AGENTS_MARK_INACTIVE = PreparedStatement(
+    "qs_agents_mark_inactive", _MARK_INACTIVE.format(extra="AND agent_uuid = ANY($2::text[])"), ("threshold", "uuids"))
+
+# Full reconciliation, for startup and as a periodic safety net.
+AGENTS_MARK_ALL_INACTIVE = PreparedStatement(
+    "qs_agents_mark_all_inactive", _MARK_INACTIVE.format(extra=""), ("threshold",))
+
+ACTIVE_AGENT_DEADLINES = PreparedStatement("qs_active_agent_deadlines", """
+    SELECT agent_uuid, EXTRACT(EPOCH FROM (NOW() at time zone 'utc') - last_heartbeat) AS age_seconds
+    FROM agents WHERE status = 'Active'
+""", ())
+
+AGENT_STATE_CHANGES = PreparedStatement("qs_agent_state_changes", """
+    SELECT agent_uuid, hostname, from_status, to_status, changed_at
+    FROM agent_state_changes
+    WHERE agent_uuid = $1
+    ORDER BY changed_at DESC, id DESC
+    LIMIT $2
+""", ("agent_uuid", "limit"))
+
+# Each Inactive transition paired with the agent's next transition (its return).
+AGENT_OUTAGES = PreparedStatement("qs_agent_outages", """
+    SELECT agent_uuid, hostname, went_offline, back_online,
+           EXTRACT(EPOCH FROM COALESCE(back_online, (NOW() at time zone 'utc')) - went_offline) AS duration_seconds
+    FROM (
+        SELECT agent_uuid, hostname, to_status, changed_at AS went_offline,
+               lead(changed_at) OVER (PARTITION BY agent_uuid ORDER BY changed_at, id) AS back_online
+        FROM agent_state_changes
+        WHERE changed_at >= $1
+    ) AS s
+    WHERE to_status = 'Inactive'
+    ORDER BY went_offline DESC
+    LIMIT $2
+""", ("since", "limit"))
+
+
+# --------------------------------------------------------------------------------------
+# AGENT DEDUPLICATION
+# --------------------------------------------------------------------------------------
+# Rows superseded by a newer agent_uuid on the same machine (same host_id, e.g. after a
+# rename, or same hostname when either row predates host_id) that have been silent for $2
+# seconds. Two rows with different host_ids are different machines, whatever their names.
+# Incremental passes ($1 = previous pass start) only look around recently created rows.
+AGENT_DEDUP_CANDIDATES = PreparedStatement("qs_agent_dedup_candidates", """
+    SELECT DISTINCT o.agent_uuid
+    FROM agents n
+    JOIN agents o ON o.agent_uuid <> n.agent_uuid
+                 AND (o.host_id = n.host_id
+                      OR (o.hostname = n.hostname AND (o.host_id IS NULL OR n.host_id IS NULL)))
+    WHERE ($1::timestamp IS NULL OR n.first_seen >= $1::timestamp - make_interval(secs => $2))
+      AND (o.last_heartbeat, o.agent_uuid) < (n.last_heartbeat, n.agent_uuid)
+      AND o.last_heartbeat < (NOW() at time zone 'utc') - make_interval(secs => $2)
+    LIMIT $3
+""", ("since", "grace_seconds", "limit"))
+
+# Moves the candidates to agents_archive. Before they go, the surviving row takes
+# over any classification the admins set on them that it still has at the default.
+# Conditions are re-checked here so a heartbeat that arrived meanwhile keeps its row.
+AGENT_DEDUP_ARCHIVE = PreparedStatement("qs_agent_dedup_archive", """
+    WITH superseded AS (
+        SELECT o.agent_uuid, o.last_heartbeat, o.priority, o.department, o.is_internet_facing,
+               s.agent_uuid AS survivor
+        FROM agents o
+        CROSS JOIN LATERAL (
+            SELECT n.agent_uuid FROM agents n
+            WHERE n.agent_uuid <> o.agent_uuid
+              AND (o.host_id = n.host_id
+                   OR (o.hostname = n.hostname AND (o.host_id IS NULL OR n.host_id IS NULL)))
+              AND (n.last_heartbeat, n.agent_uuid) > (o.last_heartbeat, o.agent_uuid)
+            ORDER BY n.last_heartbeat DESC, n.agent_uuid DESC
+            LIMIT 1
+        ) AS s
+        WHERE o.agent_uuid = ANY($1)
+          AND o.last_heartbeat < (NOW() at time zone 'utc') - make_interval(secs => $2)
+    ), inherit AS (
+        SELECT survivor,
+               (array_agg(priority ORDER BY last_heartbeat DESC) FILTER (WHERE priority <> 'Medium'))[1] AS priority,
+               (array_agg(department ORDER BY last_heartbeat DESC) FILTER (WHERE department <> 'Unassigned'))[1] AS department,
+               bool_or(is_internet_facing) AS is_internet_facing
+        FROM superseded
+        WHERE survivor NOT IN (SELECT agent_uuid FROM superseded)
+        GROUP BY survivor
+    ), merged AS (
+        UPDATE agents a SET
+            priority = CASE WHEN a.priority = 'Medium' THEN COALESCE(i.priority, a.priority) ELSE a.priority END,
+            department = CASE WHEN a.department = 'Unassigned' THEN COALESCE(i.department, a.department) ELSE a.department END,
+            is_internet_facing = a.is_internet_facing OR i.is_internet_facing
+        FROM inherit i
+        WHERE a.agent_uuid = i.survivor
+          AND ((a.priority = 'Medium' AND i.priority IS NOT NULL)
+               OR (a.department = 'Unassigned' AND i.department IS NOT NULL)
+               OR (NOT a.is_internet_facing AND i.is_internet_facing))
+        RETURNING a.hostname
+    ), removed AS (
+        DELETE FROM agents a USING superseded s
+        WHERE a.agent_uuid = s.agent_uuid AND a.last_heartbeat = s.last_heartbeat
+        RETURNING a.agent_uuid, a.hostname, a.host_id, a.os_name, a.machine_type, a.ip_address,
+                  a.first_seen, a.last_heartbeat, a.priority, a.department, a.is_internet_facing, s.survivor
+    ), archived AS (
+        INSERT INTO agents_archive (agent_uuid, hostname, host_id, os_name, machine_type, ip_address, first_seen,
+                                    last_heartbeat, priority, department, is_internet_facing, superseded_by, archived_at)
+        SELECT agent_uuid, hostname, host_id, os_name, machine_type, ip_address, first_seen,
+               last_heartbeat, priority, department, is_internet_facing, survivor, (NOW() at time zone 'utc')
+        FROM removed
+        ON CONFLICT (agent_uuid) DO UPDATE SET
+            hostname = EXCLUDED.hostname, host_id = EXCLUDED.host_id, os_name = EXCLUDED.os_name,
+            machine_type = EXCLUDED.machine_type, ip_address = EXCLUDED.ip_address,
+            last_heartbeat = EXCLUDED.last_heartbeat, priority = EXCLUDED.priority, department = EXCLUDED.department,
+            is_internet_facing = EXCLUDED.is_internet_facing, superseded_by = EXCLUDED.superseded_by,
+            archived_at = EXCLUDED.archived_at
+        RETURNING hostname
+    )
+    SELECT 'archived' AS action, hostname FROM archived
+    UNION ALL
+    SELECT 'merged', hostname FROM merged
+""", ("uuids", "grace_seconds"))
+
+AGENT_ARCHIVE_FOR_HOST = PreparedStatement("qs_agent_archive_for_host", """
+    SELECT agent_uuid, hostname, host_id, os_name, machine_type, ip_address, first_seen, last_heartbeat,
+           priority, department, is_internet_facing, superseded_by, archived_at
+    FROM agents_archive
+    WHERE hostname = $1
+    ORDER BY last_heartbeat DESC
+    LIMIT $2
+""", ("hostname", "limit"))
+
+
+# --------------------------------------------------------------------------------------
+# ASSET HISTORY
+# --------------------------------------------------------------------------------------
+# One head row per host holds the latest state (compressed) and its content hash, so an
+# unchanged upload costs a primary-key lookup and nothing is written.
+HISTORY_HEAD = PreparedStatement("qs_history_head", """
+    SELECT content_hash, snapshot_id, keyframe_id, chain_length, state
+    FROM asset_history_heads WHERE hostname = $1
+    FOR UPDATE
+""", ("hostname",))
+
+# keyframe_id is the snapshot's own id for a full snapshot and its keyframe's id for a
+# delta, so a chain is one index range. $5 = NULL means "I am the keyframe".
+HISTORY_SNAPSHOT_INSERT = PreparedStatement("qs_history_snapshot_insert", """
+    WITH ins AS (
+        INSERT INTO asset_snapshots (id, hostname, taken_at, kind, keyframe_id, content_hash, payload)
+        SELECT id, $1, (NOW() at time zone 'utc'), $2, COALESCE($5::bigint, id), $3, $4
+        FROM (SELECT nextval('asset_snapshots_id_seq') AS id) AS seq
+        RETURNING id, keyframe_id
+    ), head AS (
+        INSERT INTO asset_history_heads (hostname, content_hash, snapshot_id, keyframe_id, chain_length, state, updated_at)
+        SELECT $1, $3, id, keyframe_id, $6, $7, (NOW() at time zone 'utc') FROM ins
+        ON CONFLICT (hostname) DO UPDATE SET
+            content_hash = EXCLUDED.content_hash, snapshot_id = EXCLUDED.snapshot_id,
+            keyframe_id = EXCLUDED.keyframe_id, chain_length = EXCLUDED.chain_length,
+            state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
+    )
+    SELECT id, keyframe_id FROM ins
+""", ("hostname", "kind", "content_hash", "payload", "keyframe_id", "chain_length", "state"))
+
+HISTORY_CHANGES_INSERT = PreparedStatement("qs_history_changes_insert", """
+    INSERT INTO asset_changes (hostname, snapshot_id, changed_at, field, item, change, detail)
+    SELECT $1, $2, (NOW() at time zone 'utc'), f, i, c, d
+    FROM unnest($3::text[], $4::text[], $5::text[], $6::text[]) AS t(f, i, c, d)
+""", ("hostname", "snapshot_id", "fields", "items", "changes", "details"))
+
+# The chain needed to rebuild a host's state as of $2: its keyframe and the deltas up
+# to the last snapshot taken at or before $2.
+HISTORY_CHAIN_AT = PreparedStatement("qs_history_chain_at", """
+    WITH last AS (
+        SELECT id, keyframe_id FROM asset_snapshots
+        WHERE hostname = $1 AND taken_at <= $2
+        ORDER BY taken_at DESC, id DESC
+        LIMIT 1
+    )
+    SELECT s.id, s.taken_at, s.kind, s.payload
+    FROM asset_snapshots s JOIN last ON s.keyframe_id = last.keyframe_id AND s.id <= last.id
+    ORDER BY s.id
+""", ("hostname", "at"))
+
+HISTORY_SNAPSHOTS = PreparedStatement("qs_history_snapshots", """
+    SELECT id, taken_at, kind, keyframe_id, octet_length(payload) AS stored_bytes,
+           encode(content_hash, 'hex') AS content_hash
+    FROM asset_snapshots
+    WHERE hostname = $1 AND taken_at >= $2
+    ORDER BY taken_at DESC, id DESC
+    LIMIT $3
+""", ("hostname", "since", "limit"))
+
+HISTORY_CHANGES = PreparedStatement("qs_history_changes", """
+    SELECT hostname, changed_at, field, item, change, detail
+    FROM asset_changes
+    WHERE changed_at >= $1
+      AND ($2::text IS NULL OR hostname = $2)
+      AND ($3::text IS NULL OR field = $3)
+      AND ($4::text IS NULL OR item = $4)
+      AND ($5::text IS NULL OR change = $5)
+    ORDER BY changed_at DESC, id DESC
+    LIMIT $6
+""", ("since", "hostname", "field", "item", "change", "limit"))
+
+# Retention: everything before each host's newest keyframe taken at or before the
+# cutoff goes; that keyframe stays so states just after the cutoff can be rebuilt.
+HISTORY_PRUNE = PreparedStatement("qs_history_prune", """
+    WITH anchors AS (
+        SELECT DISTINCT ON (hostname) hostname, id
+        FROM asset_snapshots
+        WHERE kind = 'full' AND taken_at <= $1
+        ORDER BY hostname, taken_at DESC, id DESC
+    ), snapshots AS (
+        DELETE FROM asset_snapshots s USING anchors a
+        WHERE s.hostname = a.hostname AND s.id < a.id
+        RETURNING 1
+    ), changes AS (
+        DELETE FROM asset_changes WHERE changed_at < $1
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM snapshots) AS snapshots, (SELECT COUNT(*) FROM changes) AS changes
+""", ("cutoff",))
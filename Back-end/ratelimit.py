@@ -0,0 +1,103 @@
+"""
+Token-bucket rate limits for the agent ingestion routes.
+
+Each limiter keeps one bucket per key (agent UUID for heartbeats, hostname for
+asset uploads) plus one global bucket for the worker. A request takes a token
+from its own bucket and from the global one, or gets back how long until it
+could. Buckets are two floats in an LRU-ordered dict capped at `max_keys`, so a
+check is O(1) and memory stays bounded however many agents exist. Evicting a
+bucket only ever forgives it; a refilled bucket is identical to a missing one.
+
+Throttled keys are counted in a second bounded LRU, and the busiest are
+exported on /metrics as qs_ingest_throttled_agent_total{route,key}. Only the
+top THROTTLED_TOP_N are exported, so the label set stays small.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY, Counter, format_labels
+
+THROTTLED_TOP_N = 20
+
+THROTTLED = REGISTRY.register(Counter(
+    "qs_ingest_throttled_total", "Ingestion requests rejected with 429, by route and which bucket was empty.",
+    ("route", "scope")))
+
+
+class TokenBucketLimiter:
+    def __init__(self, route: str, rate: float, burst: float, global_rate: float, global_burst: float,
+                 max_keys: int = 100_000, max_throttled_keys: int = 1024):
+        self.route = route
+        self.rate, self.burst = rate, burst
+        self.global_rate, self.global_burst = global_rate, global_burst
+        self.max_keys = max_keys
+        self.max_throttled_keys = max_throttled_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._global = [global_burst, time.monotonic()]
+        self._throttled = OrderedDict()  # key -> times throttled, most recent last
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _refill(bucket: list, rate: float, burst: float, now: float):
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+
+    def check(self, key: str) -> float:
+        """Take a token for `key`: 0.0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                self._refill(bucket, self.rate, self.burst, now)
+            if bucket[0] < 1:
+                self._note_throttled(key, "agent")
+                return (1 - bucket[0]) / self.rate
+            self._refill(self._global, self.global_rate, self.global_burst, now)
+            if self._global[0] < 1:
+                self._note_throttled(key, "global")
+                return (1 - self._global[0]) / self.global_rate
+            bucket[0] -= 1
+            self._global[0] -= 1
+            return 0.0
+
+    def _note_throttled(self, key: str, scope: str):
+        THROTTLED.inc((self.route, scope))
+        if scope != "agent":
+            return
+        self._throttled[key] = self._throttled.pop(key, 0) + 1
+        if len(self._throttled) > self.max_throttled_keys:
+            self._throttled.popitem(last=False)
+
+    def top_throttled(self, n: int = THROTTLED_TOP_N) -> list:
+        """(key, times throttled) for the most throttled recently seen keys."""
+        with self._lock:
+            items = list(self._throttled.items())
+        return sorted(items, key=lambda kv: -kv[1])[:n]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._throttled.clear()
+            self._global = [self.global_burst, time.monotonic()]
+
+
+class ThrottledAgentsCollector:
+    """Renders each limiter's most throttled keys as a labelled counter."""
+
+    name = "qs_ingest_throttled_agent_total"
+
+    def __init__(self, limiters: list):
+        self.limiters = limiters
+
+    def render(self):
+        yield f"# HELP {self.name} 429s per agent (top {THROTTLED_TOP_N} per route, recently throttled agents only)."
+        yield f"# TYPE {self.name} counter"
+        for limiter in self.limiters:
+            for key, count in limiter.top_throttled():
+                yield f"{self.name}{format_labels(('route', 'key'), (limiter.route, key))} {count}"
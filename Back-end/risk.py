@@ -0,0 +1,144 @@
+"""
+Materialized per-host risk scores.
+
+`asset_risk` holds one score per hostname, combining the agent's priority and
+internet exposure, risky listeners from `asset_ports`, matched CVEs from
+`asset_vulns`, and heartbeat/inventory staleness. Scores are recomputed only for the hosts whose inputs changed: the
+write paths call `refresh_risk()` with the hostnames they touched, and
+`RiskSweeper` picks up hosts that went stale without any write happening, and
+on startup scores any host that has no row yet.
+"""
+import json
+import threading
+
+from db import db_session
+from queries import RISK_INPUTS, RISK_STALE_CANDIDATES, RISK_UNSCORED, RISK_UPSERT
+
+# Listeners that should never be reachable from the internet.
+RISKY_PORTS = {
+    21: "FTP", 22: "SSH", 23: "Telnet", 135: "MSRPC", 139: "NetBIOS", 445: "SMB",
+    1433: "MSSQL", 3306: "MySQL", 3389: "RDP", 5432: "PostgreSQL", 5900: "VNC",
+    6379: "Redis", 9200: "Elasticsearch", 27017: "MongoDB",
+}
+
+RISK_WEIGHTS = {
+    "priority": {"High": 40, "Medium": 20, "Low": 5},
+    "internet_facing": 20,
+    "risky_listener": 10,       # per distinct risky port bound to every interface...
+    "risky_listener_max": 30,   # ...up to this much
+    "exposed_listener": 15,     # extra when such a listener is on an internet-facing host
+    "stale_heartbeat": 10,
+    "stale_inventory": 10,
+    "vuln": 5,                  # per matched CVE...
+    "vuln_max": 20,             # ...up to this much
+    "kev_vuln": 15,             # per known-exploited CVE...
+    "kev_vuln_max": 30,         # ...up to this much
+}
+# Score thresholds for the High/Medium levels; anything lower is Low.
+RISK_LEVELS = (("High", 60), ("Medium", 30))
+
+STALE_HEARTBEAT_SECONDS = 3600
+STALE_INVENTORY_SECONDS = 7 * 86400
+REFRESH_BATCH = 1000
+
+
+def score_host(inputs: dict) -> tuple:
+    """(score 0-100, level, factors) for one RISK_INPUTS row."""
+    factors = {}
+    if inputs["priority"]:
+        factors["priority"] = RISK_WEIGHTS["priority"].get(inputs["priority"], RISK_WEIGHTS["priority"]["Medium"])
+    if inputs["is_internet_facing"]:
+        factors["internet_facing"] = RISK_WEIGHTS["internet_facing"]
+    if inputs["risky_listeners"]:
+        factors["risky_listeners"] = min(inputs["risky_listeners"] * RISK_WEIGHTS["risky_listener"],
+                                         RISK_WEIGHTS["risky_listener_max"])
+        if inputs["is_internet_facing"]:
+            factors["exposed_listeners"] = RISK_WEIGHTS["exposed_listener"]
+    if inputs["stale_heartbeat"]:
+        factors["stale_heartbeat"] = RISK_WEIGHTS["stale_heartbeat"]
+    if inputs["stale_inventory"]:
+        factors["stale_inventory"] = RISK_WEIGHTS["stale_inventory"]
+    if inputs["vulns"]:
+        factors["vulns"] = min(inputs["vulns"] * RISK_WEIGHTS["vuln"], RISK_WEIGHTS["vuln_max"])
+    if inputs["kev_vulns"]:
+        factors["kev_vulns"] = min(inputs["kev_vulns"] * RISK_WEIGHTS["kev_vuln"], RISK_WEIGHTS["kev_vuln_max"])
+    score = min(sum(factors.values()), 100)
+    level = next((name for name, threshold in RISK_LEVELS if score >= threshold), "Low")
+    return score, level, factors
+
+
+def refresh_risk(cur, hostnames) -> int:
+    """Recompute and store scores for `hostnames` inside the caller's transaction.
+
+    Returns how many hosts were scored. Rows whose score and factors are unchanged
+    are not rewritten.
+    """
+    hostnames = sorted({h for h in hostnames if h})
+    scored = 0
+    for start in range(0, len(hostnames), REFRESH_BATCH):
+        rows = RISK_INPUTS.execute(cur, {
+            "hostnames": hostnames[start:start + REFRESH_BATCH], "risky_ports": list(RISKY_PORTS),
+            "stale_heartbeat_seconds": STALE_HEARTBEAT_SECONDS, "stale_inventory_seconds": STALE_INVENTORY_SECONDS,
+        }).fetchall()
+        if not rows:
+            continue
+        columns = [d[0] for d in cur.description]
+        batch = {"hostnames": [], "scores": [], "levels": [], "factors": [], "stale_heartbeat": [], "stale_inventory": []}
+        for row in rows:
+            inputs = dict(zip(columns, row)) if not isinstance(row, dict) else row
+            score, level, factors = score_host(inputs)
+            batch["hostnames"].append(inputs["hostname"])
+            batch["scores"].append(score)
+            batch["levels"].append(level)
+            batch["factors"].append(json.dumps(factors, sort_keys=True))
+            batch["stale_heartbeat"].append(bool(inputs["stale_heartbeat"]))
+            batch["stale_inventory"].append(bool(inputs["stale_inventory"]))
+        RISK_UPSERT.execute(cur, batch)
+        scored += len(rows)
+    return scored
+
+
+class RiskSweeper(threading.Thread):
+    """Periodically rescores hosts whose heartbeat or inventory went stale (or fresh)."""
+
+    def __init__(self, cache, interval_seconds: float = 60.0):
+        super().__init__(name="risk-sweeper", daemon=True)
+        self.cache = cache
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def sweep(self, unscored: bool = False) -> int:
+        with db_session() as conn:
+            cur = conn.cursor()
+            if unscored:
+                RISK_UNSCORED.execute(cur)
+            else:
+                RISK_STALE_CANDIDATES.execute(cur, {
+                    "stale_heartbeat_seconds": STALE_HEARTBEAT_SECONDS,
+                    "stale_inventory_seconds": STALE_INVENTORY_SECONDS,
+                })
+            hostnames = [row[0] for row in cur.fetchall()]
+            if hostnames:
+                refresh_risk(cur, hostnames)
+                self.cache.notify(cur, "assets")
+            conn.commit()
+            cur.close()
+        return len(hostnames)
+
+    def run(self):
+        try:
+            scored = self.sweep(unscored=True)
+            if scored:
+                print(f"✅ Risk scores computed for {scored} unscored host(s).")
+        except Exception as e:
+            print(f"⚠️ Risk sweeper error: {e}")
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                changed = self.sweep()
+                if changed:
+                    print(f"[INFO] Risk rescored for {changed} host(s) after staleness change")
+            except Exception as e:
+                print(f"⚠️ Risk sweeper error: {e}")
@@ -0,0 +1,54 @@
+"""
+Fast JSON for the hot responses.
+
+FastAPI's default path walks a returned dict through `jsonable_encoder` (pure
+Python, per value) and then `json.dumps`. For the polled pages (/api/assets,
+/server_dashboard/data) the loaders instead fetch plain tuples, zip them into
+dicts once, and encode the rows with orjson when the result is cached. A request
+then only splices the cached bytes into a small envelope (`json_object`), so a
+cache hit does no per-row work at all.
+
+orjson writes datetimes as ISO 8601 like jsonable_encoder does. Types it doesn't
+know (Decimal, sets, addresses) go through `_default`. `loads` is the decoder
+the ingestion routes use for agent payloads (see ingest.parse_payload).
+"""
+import decimal
+
+import orjson
+from fastapi.responses import Response
+
+
+class Encoded(bytes):
+    """A value that is already JSON; json_object() inserts it as is."""
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+loads = orjson.loads
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def fetch_dicts(cur) -> list:
+    """Rows from a plain (tuple) cursor as dicts; much cheaper than RealDictCursor's per-column setitem."""
+    columns = [col.name for col in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def json_object(**fields) -> bytes:
+    """Encode a JSON object, splicing Encoded values in without re-encoding them."""
+    return b"{" + b",".join(
+        dumps(key) + b":" + (value if isinstance(value, Encoded) else dumps(value)) for key, value in fields.items()
+    ) + b"}"
+
+
+def json_response(**fields) -> Response:
+    return Response(content=json_object(**fields), media_type="application/json")
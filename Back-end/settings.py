@@ -0,0 +1,72 @@
+"""
+Configuration shared by every process type: the full API (app.py) and the
+ingest-only workers (ingest.py). Kept free of FastAPI and template imports so
+importing it costs nothing.
+"""
+import os
+
+from cache import QueryCache
+
+# --- Directory Config ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGS_DIR = os.path.join(BASE_DIR, "logs")
+os.makedirs(LOGS_DIR, exist_ok=True)
+
+# --- Database Config ---
+DB_CONFIG = {"dbname": "assetdb", "user": "postgres", "password": "root", "host": "localhost", "port": 5432}
+
+# --- Agent Status Config ---
+ACTIVE_THRESHOLD_SECONDS = 10
+# The status sweeper reacts to each missed heartbeat on its own; this full pass is a safety net.
+STATUS_RECONCILE_SECONDS = 60
+
+# --- Ingestion Rate Limit Config ---
+# Token buckets per agent (heartbeats by agent_uuid, uploads by hostname) and per worker overall;
+# excess posts get 429 + Retry-After. Agents heartbeat every 5s and upload hourly, so the per-agent
+# limits only bite on tight loops and on hosts sharing one cloned agent_uuid.
+HEARTBEAT_RATE_PER_AGENT = 1 / 3  # tokens per second
+HEARTBEAT_BURST_PER_AGENT = 4
+ASSET_RATE_PER_HOST = 1 / 60
+ASSET_BURST_PER_HOST = 3
+HEARTBEAT_RATE_GLOBAL = float(os.environ.get("QS_HEARTBEAT_RATE", "2000"))  # per worker process
+ASSET_RATE_GLOBAL = float(os.environ.get("QS_ASSET_RATE", "50"))
+RATE_LIMIT_MAX_KEYS = 100_000  # buckets kept per route; least recently seen agents are forgotten first
+
+# --- Schema Config ---
+# Startup only checks schema_version. With auto-migrate off, run `python migrations.py migrate`
+# before deploying; with it on, the first worker applies pending migrations under an advisory lock.
+SCHEMA_AUTO_MIGRATE = os.environ.get("QS_AUTO_MIGRATE", "1") == "1"
+
+# --- Service Role Config ---
+# "all": one app serves agents and people. "query": dashboards, APIs and the periodic jobs only,
+# with agents sent to dedicated ingest workers (`uvicorn ingest:create_ingest_app --factory`).
+# Each service is its own set of processes, so each gets its own pool and limits below.
+SERVICE_ROLE = os.environ.get("QS_ROLE", "all")
+if SERVICE_ROLE not in ("all", "query"):
+    raise ValueError(f"QS_ROLE must be 'all' or 'query', not {SERVICE_ROLE!r}")
+
+# --- Connection Pool Config ---
+# Keep DB_POOL_MAX at or below THREADPOOL_SIZE and, summed over every worker of every
+# service, below Postgres' max_connections.
+DB_POOL_MIN = 2
+DB_POOL_MAX = int(os.environ.get("QS_DB_POOL_MAX", "20"))
+DB_POOL_TIMEOUT_SECONDS = 10
+THREADPOOL_SIZE = int(os.environ.get("QS_THREADPOOL_SIZE", "40"))  # sync routes run on these threads
+
+# --- Admission Control Config ---
+# Requests served at once per worker, heartbeats first (see admission.py). Defaults to the pool
+# size so an admitted request never waits for a connection.
+ADMISSION_CAPACITY = int(os.environ.get("QS_ADMISSION_CAPACITY", DB_POOL_MAX))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = 5
+
+# --- Slow Query Profiling Config ---
+# Off by default: set QS_PROFILE_SQL=1 to log statements slower than the threshold with their plans.
+SLOW_QUERY_PROFILING = os.environ.get("QS_PROFILE_SQL") == "1"
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("QS_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.path.join(LOGS_DIR, "slow_queries.log")
+
+# --- Dashboard Query Cache Config ---
+# TTL is the worst-case staleness if an invalidation NOTIFY is missed.
+CACHE_TTL_SECONDS = 5
+CACHE_MAX_ENTRIES = 512
+query_cache = QueryCache(max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS)
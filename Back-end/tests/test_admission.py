@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, default_lanes
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 3, 10, 40])
+def test_every_lane_fits_on_an_idle_server(capacity):
+    controller = AdmissionController(capacity, default_lanes(capacity, queue_timeout=0.01))
+    for lane in controller.lanes:
+        assert asyncio.run(controller.acquire(lane)), lane.name
+        controller.release(lane)
+
+
+def test_heartbeats_keep_headroom():
+    controller = AdmissionController(10, default_lanes(10, queue_timeout=0.01))
+    heartbeat, _, query, _ = controller.lanes
+    admitted = 0
+    while asyncio.run(controller.acquire(query)):
+        admitted += 1
+    assert admitted == 10 - query.headroom
+    assert asyncio.run(controller.acquire(heartbeat))
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        default_lanes(0, queue_timeout=1)
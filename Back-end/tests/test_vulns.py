@@ -0,0 +1,28 @@
+from vulns import VulnIndex, normalize_product
+
+
+def index(*affected):
+    return VulnIndex.from_rows([("CVE-1", list(affected))])
+
+
+def test_match_in_range():
+    idx = index({"products": ["openssl"], "versionStartIncluding": "1.1.1", "versionEndExcluding": "3.0.7"})
+    assert idx.match(["openssl 3.0.2-0ubuntu1", "curl 7.81.0"]) == [("CVE-1", "openssl", "3.0.2-0ubuntu1")]
+    assert idx.match(["openssl 3.0.7"]) == []
+
+
+def test_match_two_versions_of_one_package():
+    # asset_vulns is keyed on (hostname, cve_id, package): one row, both versions.
+    idx = index({"products": ["openssl"], "versionStartIncluding": "1.1.1", "versionEndExcluding": "3.0.7"})
+    matches = idx.match(["openssl 3.0.2-0ubuntu1", "openssl 1.1.1f-1ubuntu2"])
+    assert matches == [("CVE-1", "openssl", "1.1.1f-1ubuntu2, 3.0.2-0ubuntu1")]
+
+
+def test_match_multiarch_package():
+    idx = index({"products": ["libssl3"], "versionEndExcluding": "3.0.7"})
+    assert idx.match(["libssl3:amd64 3.0.2-0ubuntu1"]) == [("CVE-1", "libssl3", "3.0.2-0ubuntu1")]
+
+
+def test_normalize_product():
+    assert normalize_product("  LibSSL3:i386 ") == "libssl3"
+    assert normalize_product("Microsoft  Visual C++") == "microsoft visual c++"
@@ -0,0 +1,263 @@
+"""
+Offline KEV/CVE correlation against the installed-software inventory.
+
+The feed is a local JSON dump (we run without internet access). It follows the
+CISA KEV catalog layout, extended with NVD-style version ranges so entries can
+be matched against package versions:
+
+    {"vulnerabilities": [{
+        "cveID": "CVE-2024-6387", "vendorProject": "OpenBSD", "product": "OpenSSH",
+        "vulnerabilityName": "regreSSHion", "dateAdded": "2024-07-01",
+        "severity": "critical", "knownExploited": true,
+        "affected": [{"products": ["openssh-server", "OpenSSH"],
+                      "versionStartIncluding": "8.5p1", "versionEndExcluding": "9.8p1"}]
+    }]}
+
+Package names are matched exactly after lower-casing, collapsing whitespace and
+dropping a dpkg architecture suffix (":amd64"), so list every name the agents
+report for a product ("openssh-server" from dpkg, "OpenSSH" from the Windows
+uninstall keys). Entries without `affected` are kept for the CVE listing but
+never match a host.
+
+The product index is built from the `vulnerabilities` table and cached under the
+"vulns" tag, so a reload on any worker reaches the others through the usual
+cache NOTIFY. Load a feed with:
+
+    python vulns.py load path/to/feed.json
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from psycopg2.extras import Json, execute_values
+
+from queries import ASSET_VULNS_SYNC
+from risk import refresh_risk
+
+_EPOCH = re.compile(r"^\d+:")
+_TOKENS = re.compile(r"\d+|[a-z]+")
+_SPACES = re.compile(r"\s+")
+# dpkg qualifies multi-arch packages with their architecture ("libssl3:amd64").
+_ARCH = re.compile(r":(?:all|amd64|arm64|armel|armhf|i386|ppc64el|riscv64|s390x)$")
+
+FULL_MATCH_BATCH = 500
+
+
+def normalize_product(name: str) -> str:
+    return _ARCH.sub("", _SPACES.sub(" ", name.strip().lower()))
+
+
+def version_key(version: str) -> tuple:
+    """Sortable key for dotted/dpkg-style versions: "1:9.6p1-3ubuntu1" -> (9, 6, "p", 1, 3, "ubuntu", 1).
+
+    Numbers compare numerically and sort after letters, so "1.0" < "1.0.1" and
+    "1.0rc1" < "1.0.1". Distro revisions are kept and only break ties.
+    """
+    version = _EPOCH.sub("", version.strip().lower())
+    return tuple((1, int(tok)) if tok.isdigit() else (0, tok) for tok in _TOKENS.findall(version))
+
+
+def split_package(entry: str):
+    """("name", "version") from an agent software string "name version", or None."""
+    name, _, version = entry.strip().rpartition(" ")
+    if not name or not version or not any(ch.isdigit() for ch in version):
+        return None
+    return normalize_product(name), version
+
+
+@dataclass(frozen=True)
+class VersionRange:
+    cve_id: str
+    start: Optional[tuple] = None
+    start_inclusive: bool = True
+    end: Optional[tuple] = None
+    end_inclusive: bool = False
+
+    def contains(self, key: tuple) -> bool:
+        if self.start is not None and (key < self.start or (key == self.start and not self.start_inclusive)):
+            return False
+        if self.end is not None and (key > self.end or (key == self.end and not self.end_inclusive)):
+            return False
+        return True
+
+
+def _range_from_feed(cve_id: str, affected: dict) -> VersionRange:
+    if affected.get("version"):
+        exact = version_key(affected["version"])
+        return VersionRange(cve_id, exact, True, exact, True)
+    start = affected.get("versionStartIncluding") or affected.get("versionStartExcluding")
+    end = affected.get("versionEndIncluding") or affected.get("versionEndExcluding")
+    return VersionRange(
+        cve_id,
+        version_key(start) if start else None, "versionStartIncluding" in affected,
+        version_key(end) if end else None, "versionEndIncluding" in affected,
+    )
+
+
+class VulnIndex:
+    """normalized product name -> version ranges, for one feed load."""
+
+    def __init__(self, ranges: dict):
+        self.ranges = ranges
+
+    @classmethod
+    def from_rows(cls, rows) -> "VulnIndex":
+        ranges = {}
+        for cve_id, affected in rows:
+            for entry in affected or []:
+                version_range = _range_from_feed(cve_id, entry)
+                for product in entry.get("products") or []:
+                    ranges.setdefault(normalize_product(product), []).append(version_range)
+        return cls(ranges)
+
+    def match(self, software) -> list:
+        """(cve_id, package, versions) for every vulnerable package in `software`.
+
+        One tuple per (cve_id, package), the asset_vulns key: when several installed
+        versions of a package are affected, `versions` lists them all, lowest first.
+        """
+        found = {}
+        for entry in software or []:
+            parsed = split_package(entry)
+            if parsed is None or parsed[0] not in self.ranges:
+                continue
+            product, version = parsed
+            key = version_key(version)
+            for version_range in self.ranges[product]:
+                if version_range.contains(key):
+                    found.setdefault((version_range.cve_id, product), set()).add(version)
+        return [(cve_id, product, ", ".join(sorted(versions, key=version_key)))
+                for (cve_id, product), versions in sorted(found.items())]
+
+
+def load_index(cur) -> VulnIndex:
+    cur.execute("SELECT cve_id, affected FROM vulnerabilities WHERE affected IS NOT NULL;")
+    return VulnIndex.from_rows(cur.fetchall())
+
+
+def sync_host_vulns(cur, hostname: str, matches: list):
+    """Replace one host's asset_vulns rows with `matches`; unchanged rows are left alone."""
+    ASSET_VULNS_SYNC.execute(cur, {
+        "hostname": hostname,
+        "cve_ids": [m[0] for m in matches], "packages": [m[1] for m in matches], "versions": [m[2] for m in matches],
+    })
+
+
+def parse_feed(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        feed = json.load(f)
+    entries = feed.get("vulnerabilities", []) if isinstance(feed, dict) else feed
+    rows = []
+    for entry in entries:
+        cve_id = entry.get("cveID") or entry.get("cve_id") or entry.get("cve")
+        if not cve_id:
+            continue
+        rows.append((
+            cve_id.strip().upper(),
+            entry.get("vendorProject") or entry.get("vendor"),
+            entry.get("product"),
+            entry.get("vulnerabilityName") or entry.get("name"),
+            (entry.get("severity") or "unknown").lower(),
+            bool(entry.get("knownExploited", "dateAdded" in entry)),
+            entry.get("dateAdded") or None,
+            entry.get("shortDescription") or entry.get("description"),
+            Json(entry["affected"]) if entry.get("affected") else None,
+        ))
+    return rows
+
+
+def load_feed(conn, path: str) -> dict:
+    """Replace the vulnerabilities table with the feed at `path` and rematch every host.
+
+    Runs in one transaction, so readers see either the old feed and matches or the new.
+    """
+    started = time.perf_counter()
+    rows = parse_feed(path)
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE vuln_feed_load (LIKE vulnerabilities INCLUDING DEFAULTS) ON COMMIT DROP;")
+    execute_values(cur, """
+        INSERT INTO vuln_feed_load (cve_id, vendor, product, name, severity, is_kev, date_added, description, affected)
+        VALUES %s ON CONFLICT DO NOTHING
+    """, rows, page_size=1000)
+    cur.execute("DELETE FROM vulnerabilities v WHERE NOT EXISTS (SELECT 1 FROM vuln_feed_load n WHERE n.cve_id = v.cve_id);")
+    cur.execute("""
+        INSERT INTO vulnerabilities (cve_id, vendor, product, name, severity, is_kev, date_added, description, affected)
+        SELECT DISTINCT ON (cve_id) cve_id, vendor, product, name, severity, is_kev, date_added, description, affected
+        FROM vuln_feed_load
+        ON CONFLICT (cve_id) DO UPDATE SET
+            vendor = EXCLUDED.vendor, product = EXCLUDED.product, name = EXCLUDED.name,
+            severity = EXCLUDED.severity, is_kev = EXCLUDED.is_kev, date_added = EXCLUDED.date_added,
+            description = EXCLUDED.description, affected = EXCLUDED.affected;
+    """)
+    index = load_index(cur)
+    hosts, matched = match_all_hosts(conn, cur, index)
+    cur.execute("SELECT hostname FROM assets;")
+    refresh_risk(cur, [row[0] for row in cur.fetchall()])
+    cur.execute("""
+        INSERT INTO vuln_feed (id, source, entries, loaded_at) VALUES (1, %s, %s, NOW())
+        ON CONFLICT (id) DO UPDATE SET source = EXCLUDED.source, entries = EXCLUDED.entries, loaded_at = EXCLUDED.loaded_at;
+    """, (path, len(rows)))
+    cur.close()
+    return {"entries": len(rows), "products_indexed": len(index.ranges), "hosts_scanned": hosts,
+            "matches": matched, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def match_all_hosts(conn, cur, index: VulnIndex) -> tuple:
+    """One pass over every host's software, writing asset_vulns in batches.
+
+    Returns (hosts scanned, total matches).
+    """
+    reader = conn.cursor(name="vuln_full_match")
+    reader.itersize = FULL_MATCH_BATCH
+    reader.execute("SELECT hostname, software_list FROM assets;")
+    hosts = matched = 0
+    while True:
+        batch = reader.fetchmany(FULL_MATCH_BATCH)
+        if not batch:
+            break
+        for hostname, software_list in batch:
+            # The list as the agent reported it, exactly what the upload path matched.
+            matches = index.match(software_list)
+            sync_host_vulns(cur, hostname, matches)
+            hosts += 1
+            matched += len(matches)
+    reader.close()
+    return hosts, matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    load = sub.add_parser("load", help="load a feed file and rematch every host")
+    load.add_argument("path")
+    args = parser.parse_args()
+
+    import psycopg2
+
+    from settings import DB_CONFIG
+    from cache import CACHE_CHANNEL
+    from migrations import ensure_schema
+
+    ensure_schema(DB_CONFIG)
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        summary = load_feed(conn, args.path)
+        cur = conn.cursor()
+        cur.execute("SELECT pg_notify(%s, %s);", (CACHE_CHANNEL, "vulns,assets"))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"⚠️ Feed load failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+    print(f"✅ Loaded {summary['entries']} entries, {summary['matches']} matches "
+          f"across {summary['hosts_scanned']} hosts in {summary['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
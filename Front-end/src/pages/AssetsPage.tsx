@@ -1,5 +1,6 @@
 import { Badge } from "@/components/ui/badge";
 import { Button } from "@/components/ui/button";
+import { Input } from "@/components/ui/input";
 import {
   Dialog,
   DialogContent,
@@ -13,9 +14,10 @@ import {
   HardDrive,
   Loader2,
   RefreshCcw,
+  Search,
   Users
 } from "lucide-react";
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useState } from "react";
 import { toast } from "sonner";
 
 // -----------------------------
@@ -182,6 +184,7 @@ export default function AgentCenterPage() {
   const [isLoading, setIsLoading] = useState(true);
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [selectedAsset, setSelectedAsset] = useState<Asset | null>(null);
+  const [search, setSearch] = useState("");
 
   const handleEdit = (asset: Asset) => {
     setSelectedAsset(asset);
@@ -192,7 +195,10 @@ export default function AgentCenterPage() {
   const fetchAssets = async () => {
     setIsLoading(true);
     try {
-      const response = await fetch(ASSET_API_ENDPOINT);
+      // Filtering happens server-side: `q` matches hostname, user, OS and IPs.
+      const params = new URLSearchParams({ limit: "200" });
+      if (search.trim().length >= 2) params.set("q", search.trim());
+      const response = await fetch(`${ASSET_API_ENDPOINT}?${params}`);
       if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
       const data = await response.json();
       setAssets(Array.isArray(data) ? data : data.assets || []);
@@ -207,11 +213,11 @@ export default function AgentCenterPage() {
     }
   };
 
+  // ✅ Debounce so typing doesn't fire a request per keystroke
   useEffect(() => {
-    fetchAssets();
-  }, []);
-
-  const filteredAssets = useMemo(() => assets, [assets]);
+    const timer = setTimeout(fetchAssets, 300);
+    return () => clearTimeout(timer);
+  }, [search]);
 
   return (
     <div className="p-8 space-y-8 animate-fadeIn">
@@ -256,12 +262,23 @@ export default function AgentCenterPage() {
                   Comprehensive overview of all discovered assets.
                 </p>
               </div>
-              <Button variant="ghost" size="sm" onClick={fetchAssets} disabled={isLoading}>
-                <RefreshCcw className="h-4 w-4 mr-2" />
-                {isLoading ? "Refreshing..." : "Refresh"}
-              </Button>
+              <div className="flex items-center gap-2">
+                <div className="relative">
+                  <Search className="absolute left-2 top-2.5 h-4 w-4 text-muted-foreground" />
+                  <Input
+                    value={search}
+                    onChange={(e) => setSearch(e.target.value)}
+                    placeholder="Search hostname, user, OS or IP"
+                    className="pl-8 w-72"
+                  />
+                </div>
+                <Button variant="ghost" size="sm" onClick={fetchAssets} disabled={isLoading}>
+                  <RefreshCcw className="h-4 w-4 mr-2" />
+                  {isLoading ? "Refreshing..." : "Refresh"}
+                </Button>
+              </div>
             </div>
-            <AssetTable assets={filteredAssets} isLoading={isLoading} onEdit={handleEdit} />
+            <AssetTable assets={assets} isLoading={isLoading} onEdit={handleEdit} />
           </div>
         )}
 